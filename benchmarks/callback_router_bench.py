@@ -0,0 +1,80 @@
+# Routing cost of a button press: the old chain of regex CallbackQueryHandlers against the
+# callback_data codec plus one dictionary lookup.
+# Run from the repository root with: python benchmarks/callback_router_bench.py
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socialsoccerbot import callback_routes, decode_callback, encode_callback
+
+PRESSES = 200_000
+
+# The patterns main() used to register, in registration order
+LEGACY_PATTERNS = [
+    "create_event", "edit_event", "approve_event", "agree_terms",
+    "confirm_attendance|cancel_attendance|change_vote", "admin_actions", "close_voting",
+    "ban_member", "select_ban_", "confirm_ban_", "unban_member", "select_unban_", "confirm_unban",
+    "mark_no_show", "select_no_show_", "confirm_no_show", "next_page_ban_", "exit_admin_actions",
+    "generate_report",
+]
+
+
+def legacy_route(chain, data):
+    for index, pattern in enumerate(chain):
+        if pattern.match(data):
+            return index
+    return None
+
+
+def main():
+    rng = random.Random(0)
+    user_ids = [rng.randrange(10**9, 8 * 10**9) for _ in range(500)]
+
+    # A vote-heavy mix, like a busy Saturday morning: mostly votes, some admin presses
+    legacy, encoded = [], []
+    for _ in range(PRESSES):
+        user_id = rng.choice(user_ids)
+        kind = rng.random()
+        if kind < 0.85:
+            legacy.append(rng.choice(["confirm_attendance", "cancel_attendance"]))
+            encoded.append(encode_callback(rng.choice(["confirm_attendance", "cancel_attendance"]), event_id=3))
+        elif kind < 0.95:
+            legacy.append(f"confirm_no_show_{user_id}")
+            encoded.append(encode_callback("confirm_no_show", user_id=user_id))
+        else:
+            legacy.append(f"next_page_ban_{rng.randrange(50)}")
+            encoded.append(encode_callback("next_page_ban", page=rng.randrange(50)))
+
+    chain = [re.compile(pattern) for pattern in LEGACY_PATTERNS]
+    started = time.perf_counter()
+    for data in legacy:
+        legacy_route(chain, data)
+        data.split("_")  # The handlers then re-parsed the ids
+    legacy_cost = (time.perf_counter() - started) / PRESSES * 1e9
+
+    decode_callback.cache_clear()
+    started = time.perf_counter()
+    for data in encoded:
+        callback_routes.get(decode_callback(data).action)
+    codec_cost = (time.perf_counter() - started) / PRESSES * 1e9
+
+    decode_callback.cache_clear()
+    started = time.perf_counter()
+    for data in encoded:
+        callback_routes.get(decode_callback.__wrapped__(data).action)
+    uncached_cost = (time.perf_counter() - started) / PRESSES * 1e9
+
+    longest = max(len(encode_callback(action, event_id=2**64 - 1, user_id=2**64 - 1, page=2**64 - 1, days=2**64 - 1))
+                  for action in callback_routes)
+    print(f"regex chain:         {legacy_cost:8.0f} ns/press")
+    print(f"codec + dict:        {codec_cost:8.0f} ns/press")
+    print(f"codec (no cache):    {uncached_cost:8.0f} ns/press")
+    print(f"longest callback_data: {longest} bytes (limit 64)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# Time and peak memory of the exports. It fills the attendance history of one chat with growing
+# numbers of rows and, for each size, streams the history export to CSV and JSON through
+# send_export (peak memory is traced with tracemalloc and should stay flat as rows grow).
+# It then presses through every page of the participation report of a very large roster
+# against the fake Bot, checking that no page goes over Telegram's 4096-character limit and
+# that paging back and forth is served from the page cache.
+#
+# Run from the repository root, for example:
+#   python benchmarks/export_bench.py --rows 100000 1000000 --players 2000
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeContext, FakeUser
+from socialsoccerbot import AttendanceHistory, encode_callback
+
+CHAT_ID = -1001234567890
+REPORT_MESSAGE_ID = 700
+
+
+# Fake Bot that reads every document it is sent, as the upload would
+class CountingBot(FakeBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.document_bytes = 0
+
+    async def send_document(self, chat_id, document, **kwargs):
+        while chunk := document.read(1 << 16):
+            self.document_bytes += len(chunk)
+        return await super().send_document(chat_id, document, **kwargs)
+
+
+# Function to add games of 40 players until the chat's history holds `rows` rows
+def fill(history, rows, rng):
+    games = (rows - len(history)) // 40
+    started = time.time() - games * 7 * 86400
+    for game in range(games):
+        history.append(started + game * 7 * 86400, CHAT_ID, game + 1, rng.choice(5000, size=40, replace=False) + 1,
+                       rng.choice(list(AttendanceHistory.outcomes), size=40), rng.uniform(0, 72, size=40))
+
+
+# Function to export the history once for the time and once more under tracemalloc (which slows
+# every allocation down) for the peak memory
+async def export_history(bot, fmt):
+    bot.document_bytes = 0
+    began = time.perf_counter()
+    await bot_module.send_export(bot, CHAT_ID, "history", fmt)
+    elapsed = time.perf_counter() - began
+    tracemalloc.start()
+    await bot_module.send_export(bot, CHAT_ID, "history", fmt)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, bot.document_bytes // 2
+
+
+async def page_through_report(args):
+    bot = CountingBot()
+    chat = FakeChat(bot, CHAT_ID)
+    event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00, Central Park", capacity=args.players // 2)
+    for i in range(args.players):
+        bot_module.cast_vote(event, 10_000 + i, f"Player number {i} with a fairly long name", True)
+    admin = FakeUser(bot_module.bot_owner_id, "Owner")
+    context = FakeContext(bot)
+
+    pages, longest, page = 1, 0, 0
+    began = time.perf_counter()
+    while page < pages:
+        await bot_module.route_callback(bot.press(admin, chat, REPORT_MESSAGE_ID, encode_callback("generate_report", page=page)), context)
+        _, _, text = bot.edits[-1]
+        longest = max(longest, len(text))
+        footer = re.search(r"Page (\d+)/(\d+)$", text)
+        pages = int(footer.group(2)) if footer else 1
+        page += 1
+    first_pass = time.perf_counter() - began
+    misses = bot_module.report_pages.misses
+    began = time.perf_counter()
+    for page in range(pages - 1, -1, -1):
+        await bot_module.route_callback(bot.press(admin, chat, REPORT_MESSAGE_ID, encode_callback("generate_report", page=page)), context)
+    second_pass = time.perf_counter() - began
+    return pages, longest, first_pass, second_pass, bot_module.report_pages.misses - misses
+
+
+async def run(args):
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        bot_module.journal = bot_module.Journal(os.path.join(directory, "export.db"))
+        bot_module.history = AttendanceHistory(os.path.join(directory, "history"))
+        bot = CountingBot()
+        for rows in sorted(args.rows):
+            fill(bot_module.history, rows, rng)
+            for fmt in bot_module.export_formats:
+                elapsed, peak, size = await export_history(bot, fmt)
+                print(f"history {fmt:<4} {len(bot_module.history):>9} rows  {elapsed:7.2f}s  "
+                      f"{len(bot_module.history) / elapsed:10.0f} rows/s  file {size / 1e6:7.1f} MB  peak {peak / 1e6:6.2f} MB")
+
+        pages, longest, first_pass, second_pass, rebuilt = await page_through_report(args)
+        print(f"report  {args.players} players: {pages} pages, longest {longest} characters, "
+              f"first pass {first_pass * 1000:.1f} ms, paging back {second_pass * 1000:.1f} ms ({rebuilt} rebuilds)")
+        await bot_module.journal.flush()
+        bot_module.journal.close()
+        if longest > 4096 or rebuilt:
+            sys.exit("Report pages too long or not served from the cache")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000], help="history sizes to export")
+    parser.add_argument("--players", type=int, default=2000, help="players voting Yes for the report")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+# In-process stand-ins for telegram.Bot and the update objects the handlers read, used by the
+# benchmarks. The fake Bot records every API call, simulates network latency and answers with
+# RetryAfter (HTTP 429) when the global rate limit is exceeded, the way the real Bot API does.
+# The fake updates expose just the attributes and shortcuts socialsoccerbot.py uses, and every
+# shortcut goes through the fake Bot so outbound calls are counted.
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+
+class FakeUser:
+    def __init__(self, user_id, first_name, last_name=None, language_code="en", is_bot=False):
+        self.id = user_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.language_code = language_code
+        self.is_bot = is_bot
+
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name}" if self.last_name else self.first_name
+
+
+class FakeChat:
+    def __init__(self, bot, chat_id, chat_type="supergroup"):
+        self.bot = bot
+        self.id = chat_id
+        self.type = chat_type
+
+    async def get_administrators(self):
+        return await self.bot.get_chat_administrators(chat_id=self.id)
+
+
+class FakeMessage:
+    def __init__(self, chat_id, message_id, text, bot=None, chat=None, from_user=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.bot = bot
+        self.chat = chat
+        self.from_user = from_user
+
+    async def reply_text(self, text, **kwargs):
+        return await self.bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+
+    async def edit_text(self, text, **kwargs):
+        return await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, **kwargs)
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot, query_id, from_user, message, data):
+        self.bot = bot
+        self.id = query_id
+        self.from_user = from_user
+        self.message = message
+        self.data = data
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        return await self.bot.answer_callback_query(self.id, text=text, show_alert=show_alert)
+
+    async def edit_message_text(self, text, **kwargs):
+        return await self.message.edit_text(text, **kwargs)
+
+
+class FakeUpdate:
+    def __init__(self, update_id, callback_query=None, message=None, chat_member=None):
+        self.update_id = update_id
+        self.callback_query = callback_query
+        self.message = message
+        self.chat_member = chat_member
+        self.inline_query = None
+
+    @property
+    def effective_user(self):
+        if self.callback_query is not None:
+            return self.callback_query.from_user
+        if self.chat_member is not None:
+            return self.chat_member.from_user
+        return self.message.from_user if self.message is not None else None
+
+    @property
+    def effective_chat(self):
+        if self.chat_member is not None:
+            return self.chat_member.chat
+        source = self.callback_query.message if self.callback_query is not None else self.message
+        return source.chat if source is not None else None
+
+    @property
+    def effective_message(self):
+        return self.callback_query.message if self.callback_query is not None else self.message
+
+
+class FakeJob:
+    def __init__(self, data=None):
+        self.data = data
+
+
+class FakeContext:
+    def __init__(self, bot, user_data=None, args=None, job=None):
+        self.bot = bot
+        self.user_data = user_data if user_data is not None else {}
+        self.args = args or []
+        self.job = job
+
+
+class FakeBot:
+    def __init__(self, latency=0.0, jitter=0.0, global_rate=None, blocked=(), unknown=(), admin_ids=(), seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.global_rate = global_rate
+        self.blocked = set(blocked)
+        self.unknown = set(unknown)  # Members who never started the bot
+        self.admin_ids = list(admin_ids)
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.sent = []
+        self.edits = []
+        self.rate_limited = 0
+        self.window_started = time.monotonic()
+        self.window_count = 0
+        self.message_ids = itertools.count(1000)
+        self.update_ids = itertools.count(1)
+        self.query_ids = itertools.count(1)
+
+    # Function to account for one API call: latency, rate limit and bookkeeping
+    async def _call(self, method, chat_id=None):
+        self.calls[method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+        if self.global_rate is not None:
+            now = time.monotonic()
+            if now - self.window_started >= 1:
+                self.window_started, self.window_count = now, 0
+            self.window_count += 1
+            if self.window_count > self.global_rate:
+                self.rate_limited += 1
+                raise RetryAfter(1)
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if chat_id in self.unknown:
+            raise BadRequest("Chat not found")
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call("sendMessage", chat_id)
+        self.sent.append((chat_id, text))
+        return FakeMessage(chat_id, next(self.message_ids), text, bot=self)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        await self._call("editMessageText", chat_id)
+        self.edits.append((chat_id, message_id, text))
+        return FakeMessage(chat_id, message_id, text, bot=self)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call("deleteMessage", chat_id)
+        return True
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        await self._call("answerCallbackQuery")
+        return True
+
+    async def get_chat_administrators(self, chat_id, **kwargs):
+        await self._call("getChatAdministrators", chat_id)
+        return [FakeChatMember(FakeUser(user_id, "Admin"), "administrator") for user_id in self.admin_ids]
+
+    async def send_document(self, chat_id, document, **kwargs):
+        await self._call("sendDocument", chat_id)
+        return FakeMessage(chat_id, next(self.message_ids), None, bot=self)
+
+    # Function to fabricate a button press on a message, as Telegram would deliver it
+    def press(self, user, chat, message_id, data):
+        message = FakeMessage(chat.id, message_id, "", bot=self, chat=chat)
+        query = FakeCallbackQuery(self, str(next(self.query_ids)), user, message, data)
+        return FakeUpdate(next(self.update_ids), callback_query=query)
+
+    # Function to fabricate a text message (or command) sent by a user in a chat
+    def say(self, user, chat, text):
+        message = FakeMessage(chat.id, next(self.message_ids), text, bot=self, chat=chat, from_user=user)
+        return FakeUpdate(next(self.update_ids), message=message)
+
+    # Function to fabricate a member joining, leaving or changing rank in a chat, done by `by`
+    def member_change(self, by, chat, user, status):
+        change = FakeChatMemberUpdated(chat, by, FakeChatMember(user, status))
+        return FakeUpdate(next(self.update_ids), chat_member=change)
+
+    # Function to rebuild a fake update from the Bot API JSON form (see update_to_dict)
+    def update_from_dict(self, data):
+        def user(fields):
+            return FakeUser(fields["id"], fields["first_name"], fields.get("last_name"), fields.get("language_code"), fields.get("is_bot", False))
+
+        def message(fields):
+            chat = FakeChat(self, fields["chat"]["id"], fields["chat"]["type"])
+            from_user = user(fields["from"]) if "from" in fields else None
+            return FakeMessage(chat.id, fields["message_id"], fields.get("text", ""), bot=self, chat=chat, from_user=from_user)
+
+        if "callback_query" in data:
+            fields = data["callback_query"]
+            query = FakeCallbackQuery(self, fields["id"], user(fields["from"]), message(fields["message"]), fields.get("data"))
+            return FakeUpdate(data["update_id"], callback_query=query)
+        if "chat_member" in data:
+            fields = data["chat_member"]
+            member = FakeChatMember(user(fields["new_chat_member"]["user"]), fields["new_chat_member"]["status"])
+            change = FakeChatMemberUpdated(FakeChat(self, fields["chat"]["id"], fields["chat"]["type"]), user(fields["from"]), member)
+            return FakeUpdate(data["update_id"], chat_member=change)
+        return FakeUpdate(data["update_id"], message=message(data["message"]))
+
+
+# Function to serialize a fake update the way the Bot API delivers it (getUpdates or webhook)
+def update_to_dict(update):
+    def user(user):
+        fields = {"id": user.id, "is_bot": user.is_bot, "first_name": user.first_name}
+        if user.last_name:
+            fields["last_name"] = user.last_name
+        if user.language_code:
+            fields["language_code"] = user.language_code
+        return fields
+
+    def message(message):
+        fields = {"message_id": message.message_id, "date": int(time.time()), "chat": {"id": message.chat.id, "type": message.chat.type}}
+        if message.from_user is not None:
+            fields["from"] = user(message.from_user)
+        if message.text:
+            fields["text"] = message.text
+        return fields
+
+    if update.callback_query is not None:
+        query = update.callback_query
+        return {"update_id": update.update_id, "callback_query": {
+            "id": query.id, "from": user(query.from_user), "message": message(query.message),
+            "chat_instance": str(query.message.chat.id), "data": query.data,
+        }}
+    if update.chat_member is not None:
+        change = update.chat_member
+        return {"update_id": update.update_id, "chat_member": {
+            "chat": {"id": change.chat.id, "type": change.chat.type}, "from": user(change.from_user), "date": int(time.time()),
+            "new_chat_member": {"user": user(change.new_chat_member.user), "status": change.new_chat_member.status},
+        }}
+    return {"update_id": update.update_id, "message": message(update.message)}
+
+
+class FakeChatMember:
+    def __init__(self, user, status):
+        self.user = user
+        self.status = status
+
+
+class FakeChatMemberUpdated:
+    def __init__(self, chat, from_user, new_chat_member):
+        self.chat = chat
+        self.from_user = from_user
+        self.new_chat_member = new_chat_member
@@ -0,0 +1,78 @@
+# Time to compute season statistics from the columnar attendance history. It fills a history with
+# years of weekly games for a chat with thousands of members, then times the vectorized per-member
+# statistics (full history and the last season), rebuilding the reliability lookup and a single
+# reliability_of() call on the vote path.
+#
+# Run from the repository root, for example:
+#   python benchmarks/history_bench.py --members 5000 --years 5 --players 40
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from socialsoccerbot import AttendanceHistory
+
+CHAT_ID = -1001234567890
+
+
+def fill(history, args):
+    rng = np.random.default_rng(args.seed)
+    outcomes = list(AttendanceHistory.outcomes)
+    # Every member has their own habits: some nearly always show, some often do not
+    habits = rng.dirichlet([20, 1, 2, 3, 2], size=args.members)
+    started = time.time() - args.years * 365 * 86400
+    games = args.years * 52
+    for game in range(games):
+        players = rng.choice(args.members, size=args.players, replace=False)
+        picks = [outcomes[rng.choice(len(outcomes), p=habits[player])] for player in players]
+        leads = rng.uniform(0, 72, size=len(players))
+        history.append(started + game * 7 * 86400, CHAT_ID, game + 1, players + 1, picks, leads)
+    return games
+
+
+def timed(label, function, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        began = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - began)
+    print(f"{label:<36} {best * 1000:9.2f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=5000, help="members of the chat")
+    parser.add_argument("--years", type=int, default=5, help="years of weekly games")
+    parser.add_argument("--players", type=int, default=40, help="players with an outcome per game")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        history = AttendanceHistory(directory)
+        began = time.perf_counter()
+        games = fill(history, args)
+        print(f"{games} games, {len(history)} rows written in {time.perf_counter() - began:.2f}s")
+
+        bot_module.history = history
+        stats = timed("stats, full history", lambda: history.stats(CHAT_ID))
+        timed("stats, last 365 days", lambda: history.stats(CHAT_ID, time.time() - 365 * 86400))
+
+        def rebuild():
+            bot_module.reliability_cache.clear()
+            return bot_module.reliability_of(CHAT_ID, 1)
+
+        timed("reliability lookup rebuild", rebuild)
+        timed("reliability_of (cached)", lambda: bot_module.reliability_of(CHAT_ID, 2), repeat=1000)
+        print(f"{len(stats['user_id'])} members with stats, mean reliability {stats['reliability'].mean():.2f}, "
+              f"longest no-show streak {stats['longest_no_show_streak'].max()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Throughput of the update processors. Votes for several chats arrive interleaved. Every fake Bot API
+# call takes a random time, and every update first waits a random moment before its handler runs
+# (as a handler does when it looks something up before touching the roster). Handlers therefore
+# reach the roster in a different order on every round. Each round dispatches the updates the
+# way the Application does, through one processor:
+#   sequential  one update at a time (the Application's default)
+#   unordered   SimpleUpdateProcessor, concurrent with no ordering
+#   ordered     OrderedUpdateProcessor
+# That the ordered processor keeps first come, first served within every chat is checked by
+# tests/test_ordered_updates.py, on the same votes.
+#
+# Run from the repository root, for example:
+#   python benchmarks/ordered_updates_bench.py --chats 10 --votes 30 --rounds 3 --latency 0.02
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeContext, FakeUser
+from socialsoccerbot import OrderedUpdateProcessor, encode_callback
+from telegram.ext import SimpleUpdateProcessor
+
+ROSTER_MESSAGE_ID = 500
+
+
+# Function to build the interleaved stream of votes: (chat_id, event, user, going, update)
+def build_votes(bot, args, rng):
+    votes = []
+    for c in range(args.chats):
+        chat = FakeChat(bot, -1000 - c)
+        event = bot_module.create_chat_event(chat.id, f"Game {c}", capacity=args.capacity)
+        users = [FakeUser(100_000 * (c + 1) + i, f"Player{c}-{i}") for i in range(args.users)]
+        for _ in range(args.votes):
+            user = rng.choice(users)
+            going = rng.random() < 0.7
+            action = "confirm_attendance" if going else "cancel_attendance"
+            votes.append((chat.id, event, user, going, bot.press(user, chat, ROSTER_MESSAGE_ID, encode_callback(action, event_id=event.event_id))))
+    rng.shuffle(votes)
+    return votes
+
+
+async def run_round(mode, args, seed):
+    rng = random.Random(seed)
+    bot = FakeBot(latency=args.latency, jitter=args.latency * 2, seed=seed)
+    votes = build_votes(bot, args, rng)
+    contexts = defaultdict(lambda: FakeContext(bot))
+
+    async def handle(update, delay):
+        await asyncio.sleep(delay)
+        context = contexts[update.effective_user.id]
+        await bot_module.track_members_seen(update, context)
+        await bot_module.route_callback(update, context)
+
+    delays = [rng.random() * args.latency for _ in votes]
+    began = time.perf_counter()
+    if mode == "sequential":
+        for (*_, update), delay in zip(votes, delays):
+            await handle(update, delay)
+    else:
+        processor = OrderedUpdateProcessor(args.workers) if mode == "ordered" else SimpleUpdateProcessor(args.workers)
+        await asyncio.gather(*[
+            asyncio.ensure_future(processor.process_update(update, handle(update, delay))) for (*_, update), delay in zip(votes, delays)
+        ])
+    elapsed = time.perf_counter() - began
+    await bot_module.roster_renderer.drain(bot)
+    return elapsed, len(votes)
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        bot_module.journal = bot_module.Journal(os.path.join(directory, "ordered.db"))
+        bot_module.roster_renderer = bot_module.RosterRenderer(window=0.05)
+        results = {}
+        for mode in ("sequential", "unordered", "ordered"):
+            totals = [0.0, 0]
+            for r in range(args.rounds):
+                for i, value in enumerate(await run_round(mode, args, args.seed + r)):
+                    totals[i] += value
+            results[mode] = totals
+        await bot_module.journal.flush()
+        bot_module.journal.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=10, help="group chats voting at the same time")
+    parser.add_argument("--users", type=int, default=30, help="members per chat")
+    parser.add_argument("--votes", type=int, default=30, help="votes per chat and round")
+    parser.add_argument("--capacity", type=int, default=10, help="players per game, small so the waitlist is used")
+    parser.add_argument("--workers", type=int, default=64, help="concurrent updates")
+    parser.add_argument("--latency", type=float, default=0.02, help="average simulated Bot API latency in seconds")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds with different random interleavings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    for mode, (elapsed, updates) in results.items():
+        print(f"{mode:<11} {updates / elapsed:9.1f} updates/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+# Replays a trace of real updates, recorded by the bot when trace_directory is set, through the
+# real handlers against the fake Bot. Updates are dispatched the way the Application does: the
+# duplicate filter, member tracking, then the command, text or button handler, all through
+# OrderedUpdateProcessor. Replay runs either as fast as possible (--speed 0) or at the recorded
+# pace (--speed 1, or any other factor). Every run starts from a freshly imported
+# socialsoccerbot, and the duplicate filter sees the recorded times, so runs are repeatable.
+#
+# After every run it compares the final rosters and bans against the first run. With --output
+# it saves per-handler timings and the final state. With --baseline (a file saved by another
+# build) it prints per-handler timing deltas and fails when the final state differs.
+#
+# Without recorded traffic, --synthesize writes a synthetic trace first, through the same
+# recorder: vote flip-flops, double taps, redelivered updates, admin menus opened mid-burst,
+# and ban and no-show flows.
+#
+# Run from the repository root, for example:
+#   python benchmarks/replay.py traces/updates-20261017-180000.jsonl.gz --runs 3 --output new.json
+#   git stash && python benchmarks/replay.py TRACE --output old.json && git stash pop
+#   python benchmarks/replay.py TRACE --baseline old.json
+#   python benchmarks/replay.py /tmp/synthetic.jsonl.gz --synthesize 5000
+import argparse
+import asyncio
+import contextvars
+import gzip
+import hashlib
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeChatMember, FakeContext, FakeUser, update_to_dict
+from telegram.ext import ApplicationHandlerStop
+
+# Recorded time of the update being handled, read by the duplicate filter instead of the clock
+trace_clock = contextvars.ContextVar("trace_clock", default=0.0)
+
+
+# Fake Bot that answers getChatAdministrators with the admins recorded in the trace
+class ReplayBot(FakeBot):
+    def __init__(self, admins, **kwargs):
+        super().__init__(**kwargs)
+        self.admins = admins  # chat_id -> set of admin ids
+
+    async def get_chat_administrators(self, chat_id, **kwargs):
+        await self._call("getChatAdministrators", chat_id)
+        return [FakeChatMember(FakeUser(user_id, "Admin"), "administrator") for user_id in self.admins.get(chat_id, ())]
+
+
+# Function to read a trace: its header, then (time, entry) for every line, streamed
+def read_trace(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("trace") != 1:
+            sys.exit(f"{path} is not an update trace")
+        yield header
+        for line in f:
+            entry = json.loads(line)
+            yield entry.pop("t"), entry
+
+
+# Function to find the admins of every chat as first fetched, the state replay starts from
+def first_admins(path):
+    trace = read_trace(path)
+    next(trace)
+    admins = {}
+    for _, entry in trace:
+        if "admins" in entry:
+            admins.setdefault(entry["admins"]["chat"], set(entry["admins"]["ids"]))
+    return admins
+
+
+# Function to hand one update to the handlers, the way the Application's handler groups do
+async def dispatch(bot, update, at, user_data):
+    trace_clock.set(at)
+    user = update.effective_user
+    context = FakeContext(bot, user_data[user.id if user is not None else 0])
+    try:
+        try:
+            await bot_module.drop_duplicate_updates(update, context)
+        except ApplicationHandlerStop:
+            return
+        await bot_module.track_members_seen(update, context)
+        if update.chat_member is not None:
+            await bot_module.track_chat_members(update, context)
+        elif update.callback_query is not None:
+            await bot_module.route_callback(update, context)
+        elif update.message is not None and update.message.text:
+            text = update.message.text
+            if text.startswith("/"):
+                command, *context.args = text.split()
+                name = command[1:].split("@")[0].lower()
+                handler = bot_module.command_routes.get(name)
+                if handler is not None:
+                    await bot_module.run_timed(name, handler, update, context)
+            else:
+                await bot_module.run_timed("event_message", bot_module.handle_event_message, update, context)
+    except Exception:
+        pass  # Counted in handler_errors_total; the Application would log it and carry on
+
+
+# Function to capture what must come out the same on every run: rosters and bans
+def final_state():
+    return {
+        "events": [
+            {
+                "chat_id": chat_id, "event_id": event_id, "capacity": event.roster.capacity, "closed": event.closed,
+                "confirmed": list(event.roster.confirmed), "waitlist": list(event.roster.waitlist), "declined": list(event.roster.declined),
+            }
+            for (chat_id, event_id), event in sorted(bot_module.events.events.items())
+        ],
+        # Ban ends depend on when the replay ran, so only who is banned (and as whom) is compared
+        "bans": sorted([scope, user_id, name] for scope, banned in bot_module.bans.scopes.items() for user_id, (name, _) in banned.items()),
+    }
+
+
+def digest(state):
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()[:16]
+
+
+async def replay(path, args, directory):
+    importlib.reload(bot_module)
+    bot_module.logger.setLevel(logging.WARNING)  # Replays would log every recorded event message
+    trace = read_trace(path)
+    header = next(trace)
+    bot_module.bot_owner_id = header.get("owner") or 0
+    bot_module.journal = bot_module.Journal(os.path.join(directory, "replay.db"))
+    bot_module.history = bot_module.AttendanceHistory(os.path.join(directory, "history"))
+    bot_module.roster_renderer = bot_module.RosterRenderer(window=args.window)
+    bot_module.deduplicator.clock = trace_clock.get
+    bot = ReplayBot(first_admins(path), latency=args.latency, seed=args.seed)
+    processor = bot_module.OrderedUpdateProcessor(bot_module.max_concurrent_updates)
+    user_data = defaultdict(dict)
+
+    tasks, updates = set(), 0
+    began = time.perf_counter()
+    for at, entry in trace:
+        if args.speed:
+            await asyncio.sleep(max(0.0, began + at / args.speed - time.perf_counter()))
+        if "admins" in entry:
+            bot.admins[entry["admins"]["chat"]] = set(entry["admins"]["ids"])
+            continue
+        update = bot.update_from_dict(entry["update"])
+        task = asyncio.ensure_future(processor.process_update(update, dispatch(bot, update, at, user_data)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        updates += 1
+        if not args.speed and len(tasks) >= 4 * bot_module.max_concurrent_updates:
+            await asyncio.sleep(0)  # Let the handlers catch up instead of queueing the whole trace
+    while tasks:
+        await asyncio.gather(*tasks)
+    await bot_module.roster_renderer.drain(bot)
+    elapsed = time.perf_counter() - began
+    await bot_module.journal.flush()
+    bot_module.journal.close()
+
+    handlers = {}
+    for (name, labels), histogram in bot_module.metrics.histograms.items():
+        if name == "handler_seconds":
+            handlers[dict(labels)["handler"]] = {"calls": histogram.count, "mean_ms": histogram.sum / histogram.count * 1000}
+    errors = sum(value for (name, _), value in bot_module.metrics.counters.items() if name == "handler_errors_total")
+    state = final_state()
+    return {"elapsed": elapsed, "updates": updates, "errors": errors, "api_calls": dict(bot.calls), "handlers": handlers, "state": state, "digest": digest(state)}
+
+
+# Function to merge runs: the fastest mean of every handler, the state of the first run
+def summarize(runs):
+    handlers = {}
+    for run in runs:
+        for name, timing in run["handlers"].items():
+            best = handlers.setdefault(name, dict(timing))
+            best["mean_ms"] = min(best["mean_ms"], timing["mean_ms"])
+    return {
+        "updates": runs[0]["updates"], "errors": runs[0]["errors"], "elapsed": min(run["elapsed"] for run in runs),
+        "api_calls": runs[0]["api_calls"], "handlers": handlers, "digest": runs[0]["digest"], "state": runs[0]["state"],
+    }
+
+
+# Function to describe how two final states differ, in a few lines
+def state_differences(old, new, limit=10):
+    lines = []
+    old_events = {(e["chat_id"], e["event_id"]): e for e in old["events"]}
+    new_events = {(e["chat_id"], e["event_id"]): e for e in new["events"]}
+    for key in sorted(set(old_events) | set(new_events)):
+        before, after = old_events.get(key), new_events.get(key)
+        if before != after:
+            fields = [field for field in ("capacity", "closed", "confirmed", "waitlist", "declined") if (before or {}).get(field) != (after or {}).get(field)]
+            lines.append(f"event {key}: {', '.join(fields) if before and after else 'only in one run'} differ")
+    old_bans, new_bans = {tuple(ban) for ban in old["bans"]}, {tuple(ban) for ban in new["bans"]}
+    lines += [f"ban only in the baseline: {ban}" for ban in sorted(old_bans - new_bans)]
+    lines += [f"ban only in this build: {ban}" for ban in sorted(new_bans - old_bans)]
+    return lines[:limit]
+
+
+# Function to write a synthetic trace through UpdateRecorder: several chats, each with an admin
+# creating the game, members agreeing to the terms and voting (with flip-flops, double taps and
+# redelivered updates), and the admin opening menus, banning and marking a no-show mid-burst
+def synthesize(path, updates, args):
+    rng = random.Random(args.seed)
+    bot = FakeBot()
+    recorder = bot_module.UpdateRecorder(path, owner_id=bot_module.bot_owner_id)
+    encode = bot_module.encode_callback
+    schedule = []  # (time, order, step): an update factory, ("redeliver", factory) or ("admins", chat, ids)
+    chats = max(1, updates // 500)
+    for c in range(chats):
+        chat = FakeChat(bot, -1_000_000 - c)
+        admin = FakeUser(900_000 + c, f"Admin{c}")
+        members = [FakeUser(1_000_000 * (c + 1) + i, f"Player{i}", f"Family{i}", language_code=rng.choice(("en", "fa"))) for i in range(120)]
+        roster_message, menu_message = 10 * c + 1, 10 * c + 2
+        start = rng.uniform(0, 5)
+        steps = [
+            (start, lambda chat=chat, admin=admin, m=menu_message: bot.press(admin, chat, m, encode("admin_actions"))),
+            (start + 1, lambda chat=chat, admin=admin, m=menu_message: bot.press(admin, chat, m, encode("create_event"))),
+            (start + 8, lambda chat=chat, admin=admin: bot.say(admin, chat, "Saturday 10:00\nCentral Park, pitch 3\nBring a white and a dark shirt")),
+            (start + 12, lambda chat=chat, admin=admin, m=menu_message: bot.press(admin, chat, m, encode("approve_event"))),
+            (start + 13, lambda chat=chat, admin=admin: bot.say(admin, chat, f"/capacity {rng.choice((12, 14, 16))}")),
+        ]
+        schedule.append((start, -1, ("admins", chat.id, [admin.id])))
+        t = start + 15
+        per_chat = max(1, updates // chats)
+        for _ in range(per_chat):
+            t += rng.expovariate(5.0)
+            member = rng.choice(members)
+            roll = rng.random()
+            data = encode("confirm_attendance" if rng.random() < 0.75 else "cancel_attendance")
+            vote = lambda chat=chat, member=member, data=data, m=roster_message: bot.press(member, chat, m, data)
+            steps.append((t, vote))
+            if roll < 0.12:  # Flip-flop: changes their mind twice within seconds
+                steps.append((t + rng.uniform(1, 4), lambda chat=chat, member=member, m=roster_message: bot.press(member, chat, m, encode("cancel_attendance"))))
+                steps.append((t + rng.uniform(4, 8), lambda chat=chat, member=member, m=roster_message: bot.press(member, chat, m, encode("confirm_attendance"))))
+            elif roll < 0.18:  # Double tap on a slow connection
+                steps.append((t + rng.uniform(0.1, 0.5), vote))
+            elif roll < 0.20:  # Telegram delivers the same update again
+                steps.append((t + rng.uniform(0.5, 2), ("redeliver", vote)))
+            elif roll < 0.22:  # The admin opens the menu and the report mid-burst
+                for i, action in enumerate(("admin_actions", "generate_report", "admin_actions", "exit_admin_actions")):
+                    steps.append((t + 2 * i, lambda chat=chat, admin=admin, action=action, m=menu_message: bot.press(admin, chat, m, encode(action))))
+            elif roll < 0.23:  # A ban flow, on a member picked from the list
+                target = rng.choice(members).id
+                for i, (action, fields) in enumerate((("ban_member", {}), ("select_ban", {"user_id": target}), ("confirm_ban", {"user_id": target, "days": 7}))):
+                    steps.append((t + 3 * i, lambda chat=chat, admin=admin, action=action, fields=fields, m=menu_message: bot.press(admin, chat, m, encode(action, **fields))))
+            elif roll < 0.235:  # A no-show flow
+                target = rng.choice(members).id
+                for i, (action, fields) in enumerate((("mark_no_show", {}), ("select_no_show", {"user_id": target}), ("confirm_no_show", {"user_id": target}))):
+                    steps.append((t + 3 * i, lambda chat=chat, admin=admin, action=action, fields=fields, m=menu_message: bot.press(admin, chat, m, encode(action, **fields))))
+            elif roll < 0.24:  # Someone leaves the group
+                steps.append((t, lambda chat=chat, admin=admin, member=member: bot.member_change(admin, chat, member, "left")))
+        schedule += [(at, order, step) for order, (at, step) in enumerate(steps)]
+
+    schedule.sort(key=lambda item: (item[0], item[1]))
+    made = {}  # update factory -> the dict recorded for it, for redeliveries
+    for at, _, step in schedule:
+        if callable(step):
+            data = made[step] = update_to_dict(step())
+            recorder.record(data, at=at)
+        elif step[0] == "redeliver":
+            recorder.record(made[step[1]], at=at)
+        else:
+            recorder.record_admins(step[1], step[2], at=at)
+    recorder.close()
+    return recorder.recorded
+
+
+def print_comparison(baseline, current):
+    print(f"{'handler':<20} {'calls':>7} {'baseline ms':>12} {'this build ms':>14} {'delta':>8}")
+    for name in sorted(set(baseline["handlers"]) | set(current["handlers"])):
+        old, new = baseline["handlers"].get(name), current["handlers"].get(name)
+        if old is None or new is None:
+            print(f"{name:<20} {(new or old)['calls']:7d} {'-' if old is None else format(old['mean_ms'], '.3f'):>12} "
+                  f"{'-' if new is None else format(new['mean_ms'], '.3f'):>14} {'':>8}")
+            continue
+        delta = (new["mean_ms"] - old["mean_ms"]) / old["mean_ms"] if old["mean_ms"] else 0.0
+        print(f"{name:<20} {new['calls']:7d} {old['mean_ms']:12.3f} {new['mean_ms']:14.3f} {delta:+8.1%}")
+    print(f"{'whole trace':<20} {current['updates']:7d} {baseline['elapsed'] * 1000:12.1f} {current['elapsed'] * 1000:14.1f} "
+          f"{(current['elapsed'] - baseline['elapsed']) / baseline['elapsed']:+8.1%}")
+    for method in sorted(set(baseline["api_calls"]) | set(current["api_calls"])):
+        old, new = baseline["api_calls"].get(method, 0), current["api_calls"].get(method, 0)
+        if old != new:
+            print(f"API calls {method}: {old} -> {new}")
+
+
+async def run(args):
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for r in range(args.runs):
+            run_directory = os.path.join(directory, str(r))
+            os.makedirs(run_directory)
+            runs.append(await replay(args.trace, args, run_directory))
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("trace", help="trace file (.jsonl.gz) recorded by the bot")
+    parser.add_argument("--speed", type=float, default=0.0, help="0 replays as fast as possible, 1 at the recorded pace, 2 twice as fast...")
+    parser.add_argument("--runs", type=int, default=2, help="replays of the trace, each from a fresh bot")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Bot API latency in seconds")
+    parser.add_argument("--window", type=float, default=bot_module.render_window, help="roster render window in seconds")
+    parser.add_argument("--output", help="save the timings and final state of this build as JSON")
+    parser.add_argument("--baseline", help="JSON saved with --output by another build, to compare against")
+    parser.add_argument("--synthesize", type=int, metavar="UPDATES", help="first write a synthetic trace of about this many votes to TRACE")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthesize:
+        print(f"wrote {synthesize(args.trace, args.synthesize, args)} updates to {args.trace}")
+    runs = asyncio.run(run(args))
+    for r, result in enumerate(runs):
+        print(f"run {r + 1}: {result['updates']} updates in {result['elapsed']:.2f}s ({result['updates'] / result['elapsed']:.0f}/s), "
+              f"{result['errors']} handler errors, final state {result['digest']}")
+    summary = summarize(runs)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    failed = False
+    for r, result in enumerate(runs[1:], 2):
+        if result["digest"] != runs[0]["digest"]:
+            failed = True
+            print(f"run {r} ended in a different state than run 1:")
+            for line in state_differences(runs[0]["state"], result["state"]):
+                print(f"  {line}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print_comparison(baseline, summary)
+        if baseline["digest"] != summary["digest"]:
+            failed = True
+            print("final state differs from the baseline:")
+            for line in state_differences(baseline["state"], summary["state"]):
+                print(f"  {line}")
+    if failed:
+        sys.exit("replay did not reproduce the same rosters and bans")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# Micro-benchmark for the vote path: the old list-based roster against the indexed Roster.
+# Run from the repository root with: python benchmarks/roster_bench.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socialsoccerbot import Roster
+
+SIZES = [100, 1000, 5000, 10000]
+VOTES = 2000
+
+
+# The vote logic as it was before the Roster, kept here only for comparison
+class ListRoster:
+    def __init__(self, capacity=20):
+        self.capacity = capacity
+        self.yes_votes = []
+        self.no_votes = []
+        self.waitlist = []
+
+    def vote(self, user_id, user_name, going):
+        entry = (user_id, user_name)
+        if entry in self.yes_votes:
+            self.yes_votes.remove(entry)
+        if entry in self.no_votes:
+            self.no_votes.remove(entry)
+        if entry in self.waitlist:
+            self.waitlist.remove(entry)
+        if going:
+            if len(self.yes_votes) < self.capacity:
+                self.yes_votes.append(entry)
+            else:
+                self.waitlist.append(entry)
+        else:
+            self.no_votes.append(entry)
+        if len(self.yes_votes) < self.capacity and self.waitlist:
+            self.yes_votes.append(self.waitlist.pop(0))
+
+
+# Function to fill a roster with `size` players and time a burst of random flip-flop votes. With
+# `ranked`, every player carries a reliability and the waitlist is promoted by it.
+def measure(roster, size, ranked=False):
+    rng = random.Random(size)
+    reliability = {user_id: rng.random() for user_id in range(size)}
+    extra = (lambda user_id: {"priority": reliability[user_id]}) if ranked else (lambda user_id: {})
+    for user_id in range(size):
+        roster.vote(user_id, f"Player {user_id}", going=user_id % 3 != 0, **extra(user_id))
+
+    votes = [(rng.randrange(size), rng.random() < 0.5) for _ in range(VOTES)]
+    started = time.perf_counter()
+    for user_id, going in votes:
+        roster.vote(user_id, f"Player {user_id}", going=going, **extra(user_id))
+    return (time.perf_counter() - started) / VOTES * 1e6
+
+
+def main():
+    print(f"{'players':>8} {'list (us/vote)':>16} {'indexed (us/vote)':>18} {'by reliability (us/vote)':>25}")
+    for size in SIZES:
+        list_cost = measure(ListRoster(), size)
+        indexed_cost = measure(Roster(), size)
+        ranked_cost = measure(Roster(), size, ranked=True)
+        print(f"{size:>8} {list_cost:>16.2f} {indexed_cost:>18.2f} {ranked_cost:>25.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Solution quality against time for the team generator. Random rosters (ratings 1-10, a few
+# friend groups and one captain per team) are split by:
+#   snake      sort by strength and draft 1-2-2-1..., the way it is done by hand
+#   kk         Karmarkar-Karp differencing only
+#   kk+ls      differencing plus one local search, no random restarts
+#   budget=N   balance_teams with an N ms time budget (what the bot runs, at 40 ms)
+#   exact      the two-team DP (small rosters only)
+# For each method it reports the mean and worst strength gap between the strongest and weakest
+# team, the mean and worst time, and how often team sizes or captains were off.
+#
+# Run from the repository root, for example:
+#   python benchmarks/team_bench.py --players 40 --teams 2 --trials 50
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socialsoccerbot import balance_teams, improve_split, split_differencing, split_exact
+
+
+# Function to build a random roster: strengths, friend groups and captains
+def random_roster(rng, players, teams):
+    strengths = {uid: round(rng.uniform(1, 10), 1) for uid in range(players)}
+    ids = list(strengths)
+    rng.shuffle(ids)
+    together = [ids[0:2], ids[2:5]] if players >= 10 else []
+    captains = ids[5:5 + teams] if players >= 5 + teams else []
+    return strengths, together, captains
+
+
+def snake_draft(strengths, teams):
+    result = [[] for _ in range(teams)]
+    for position, uid in enumerate(sorted(strengths, key=strengths.get, reverse=True)):
+        round_number, pick = divmod(position, teams)
+        result[pick if round_number % 2 == 0 else teams - 1 - pick].append(uid)
+    return result
+
+
+# Function to run the building blocks of balance_teams directly, ignoring friend groups
+def plain_split(strengths, teams, captains, method):
+    ids = list(strengths)
+    weights = [strengths[uid] for uid in ids]
+    sizes = [1] * len(ids)
+    captain_flags = [int(uid in captains) for uid in ids]
+    if method == "exact":
+        assignment = split_exact(weights, sizes, captain_flags)
+    else:
+        assignment = split_differencing(weights, teams)
+        if method == "kk+ls":
+            improve_split(assignment, weights, sizes, captain_flags, teams, time.perf_counter() + 1)
+    result = [[] for _ in range(teams)]
+    for uid, team in zip(ids, assignment):
+        result[team].append(uid)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=40)
+    parser.add_argument("--teams", type=int, default=2)
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    methods = {
+        "snake": lambda s, together, captains: snake_draft(s, args.teams),
+        "kk": lambda s, together, captains: plain_split(s, args.teams, captains, "kk"),
+        "kk+ls": lambda s, together, captains: plain_split(s, args.teams, captains, "kk+ls"),
+    }
+    for budget in (5, 10, 20, 40):
+        methods[f"budget={budget}"] = lambda s, together, captains, budget=budget: balance_teams(
+            s, args.teams, together, captains, budget=budget / 1000
+        )
+    if args.teams == 2 and args.players <= 20:
+        methods["exact"] = lambda s, together, captains: plain_split(s, args.teams, captains, "exact")
+
+    rng = random.Random(args.seed)
+    rosters = [random_roster(rng, args.players, args.teams) for _ in range(args.trials)]
+    print(f"{args.players} players, {args.teams} teams, {args.trials} rosters")
+    print(f"{'method':<10} {'mean gap':>9} {'worst gap':>10} {'mean ms':>8} {'worst ms':>9} {'size off':>9} {'captains off':>13}")
+    for name, method in methods.items():
+        gaps, times, size_off, captains_off = [], [], 0, 0
+        for strengths, together, captains in rosters:
+            started = time.perf_counter()
+            teams = method(strengths, together, captains)
+            times.append((time.perf_counter() - started) * 1000)
+            sums = [sum(strengths[uid] for uid in team) for team in teams]
+            gaps.append(max(sums) - min(sums))
+            counts = [len(team) for team in teams]
+            size_off += max(counts) - min(counts) > 1
+            captains_off += any(sum(uid in captains for uid in team) > 1 for team in teams)
+        print(f"{name:<10} {sum(gaps) / len(gaps):9.3f} {max(gaps):10.3f} {sum(times) / len(times):8.2f} {max(times):9.2f} "
+              f"{size_off:9d} {captains_off:13d}")
+
+
+if __name__ == '__main__':
+    main()
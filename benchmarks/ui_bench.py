@@ -0,0 +1,74 @@
+# Allocations and time per click for the keyboards of the busiest buttons, built on every click
+# (as the handlers used to) against served from the UI registry. Also shows the bytes a new game
+# posts to the group and the bytes /start sends, before and after the rules were split per
+# language and members who agreed skip them.
+#
+# Run from the repository root, for example:
+#   python benchmarks/ui_bench.py --clicks 20000
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socialsoccerbot import UIRegistry, encode_callback, terms_and_conditions, ui
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+# Function to build the admin menu the way admin_actions used to, on every click
+def build_admin_menu(i):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text, callback_data=encode_callback(action, **fields))]
+        for text, action, fields in (
+            ("➕ Create Event", "create_event", {}), ("🔨 Ban a Member", "ban_member", {}), ("🚫 Unban a Member", "unban_member", {}),
+            ("📋 Generate Report", "generate_report", {}), ("🚫 Mark No-Show", "mark_no_show", {}), ("⚖️ Make Teams", "make_teams", {"page": 2}),
+            ("❌ Close Voting", "close_voting", {}), ("❌ Exit Admin Actions", "exit_admin_actions", {}),
+        )
+    ])
+
+
+# Function to measure a keyboard source over many clicks: (microseconds, bytes allocated) per click
+def measure(make, clicks):
+    began = time.perf_counter()
+    for i in range(clicks):
+        make(i)
+    elapsed = time.perf_counter() - began
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [make(i) for i in range(min(clicks, 1000))]
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return elapsed / clicks * 1e6, allocated / len(kept)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clicks", type=int, default=20000)
+    parser.add_argument("--events", type=int, default=3, help="events the votes are spread over")
+    args = parser.parse_args()
+
+    fresh = UIRegistry(terms_and_conditions)  # Its underscored builders make a new keyboard every time
+    keyboards = {
+        "after vote": (lambda i: fresh._after_vote_menu(i % args.events + 1), lambda i: ui.after_vote_menu(i % args.events + 1)),
+        "admin menu": (build_admin_menu, lambda i: ui.admin_menu),
+        "ban duration": (lambda i: fresh._ban_durations(1000 + i % 50), lambda i: ui.ban_durations(1000 + i % 50)),
+    }
+    print(f"{'keyboard':<14} {'built us':>9} {'built B':>8} {'registry us':>12} {'registry B':>11}")
+    for name, (build, serve) in keyboards.items():
+        built_us, built_bytes = measure(build, args.clicks)
+        served_us, served_bytes = measure(serve, args.clicks)
+        print(f"{name:<14} {built_us:9.2f} {built_bytes:8.0f} {served_us:12.3f} {served_bytes:11.0f}")
+
+    old_event = len("Please agree to the terms and conditions to participate:".encode()) + len(f"Terms & Conditions: \n{terms_and_conditions}".encode())
+    print(f"new game posted to the group: {old_event} bytes before, {len(UIRegistry.event_prompt.encode())} bytes now")
+    old_start = len(("Welcome to our Saturday Social Soccer program! Please respect the group rules and others as we aim to have a friendly "
+                     "but competitive game. Please confirm you have read and agree to the following rules:" + terms_and_conditions).encode())
+    for language in ui.welcome:
+        print(f"/start ({language}): {old_start} bytes before, {len(ui.welcome[language].encode())} bytes now, "
+              f"{len(ui.text(language, 'welcome_back').encode())} bytes once the rules were accepted")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# Vote-storm load test: drives the real handlers of socialsoccerbot.py with fabricated updates
+# against the in-process fake Bot and reports handler latency percentiles, throughput, outbound
+# API calls per update and peak memory.
+#
+# Run from the repository root, for example:
+#   python benchmarks/vote_storm.py --users 1000 --seconds 5 --output storm.json
+#   python benchmarks/vote_storm.py --seconds 0 --compare storm.json   # as fast as possible
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeContext, FakeUser
+from socialsoccerbot import decode_callback, encode_callback
+from telegram.ext import ApplicationHandlerStop
+
+ADMIN_ID = 1
+CHAT_ID = -1001234567890
+ROSTER_MESSAGE_ID = 500
+
+
+# Function to get the p-th percentile of an already sorted list
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# Function to build the timeline of (arrival offset, update) the storm replays
+def build_timeline(bot, chat, event, args):
+    rng = random.Random(args.seed)
+    admin = FakeUser(ADMIN_ID, "Admin")
+    users = [FakeUser(10_000 + i, f"Player{i}", f"Family{i}") for i in range(args.users)]
+    spread = max(args.seconds, 0.0)
+    timeline = []
+
+    # Some presses are double-tapped within a fraction of a second
+    def press(at, user, action):
+        data = encode_callback(action, event_id=event.event_id)
+        timeline.append((at, bot.press(user, chat, ROSTER_MESSAGE_ID, data)))
+        if rng.random() < args.double_tap:
+            timeline.append((at + rng.random() * 0.3, bot.press(user, chat, ROSTER_MESSAGE_ID, data)))
+
+    # Everyone votes Yes once; flip-floppers change their mind a few more times
+    for user in users:
+        at = rng.random() * spread
+        press(at, user, "confirm_attendance")
+        if rng.random() < args.flip_flop:
+            for flip in range(rng.randint(1, 4)):
+                at += rng.random() * spread * 0.1
+                press(at, user, "cancel_attendance" if flip % 2 == 0 else "confirm_attendance")
+
+    # Admin menus opened during the burst: reports, ban-list paging and no-shows
+    for _ in range(args.admin_actions):
+        at = rng.random() * spread
+        kind = rng.random()
+        if kind < 0.4:
+            data = encode_callback("generate_report")
+        elif kind < 0.8:
+            cursor = rng.choice(users).id
+            data = encode_callback(rng.choice(["next_page_ban", "prev_page_ban"]), user_id=cursor)
+        else:
+            data = encode_callback("confirm_no_show", user_id=rng.choice(users).id)
+        timeline.append((at, bot.press(admin, chat, 700, data)))
+
+    timeline.sort(key=lambda item: item[0])
+    timeline.append((spread, bot.press(admin, chat, 700, encode_callback("close_voting"))))
+    return timeline
+
+
+async def run(args):
+    tracemalloc.start()
+    bot = FakeBot(latency=args.latency, admin_ids=[ADMIN_ID], seed=args.seed)
+    chat = FakeChat(bot, CHAT_ID)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_module.journal = bot_module.Journal(os.path.join(directory, "storm.db"))
+        bot_module.history = bot_module.AttendanceHistory(os.path.join(directory, "history"))
+        event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00, Central Park", capacity=args.capacity)
+        timeline = build_timeline(bot, chat, event, args)
+        contexts = defaultdict(lambda: FakeContext(bot))
+
+        latencies = defaultdict(list)
+        end_to_end = []
+        errors = 0
+        suppressed = 0
+        started = time.perf_counter()
+        for at, update in timeline:
+            delay = at - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            arrived = started + at
+            action = decode_callback(update.callback_query.data).action
+            handler_started = time.perf_counter()
+            try:
+                context = contexts[update.effective_user.id]
+                await bot_module.drop_duplicate_updates(update, context)
+                await bot_module.track_members_seen(update, context)
+                await bot_module.route_callback(update, context)
+            except ApplicationHandlerStop:
+                suppressed += 1
+            except Exception as e:
+                errors += 1
+                print(f"{action} failed: {e!r}", file=sys.stderr)
+            finished = time.perf_counter()
+            latencies[action].append(finished - handler_started)
+            end_to_end.append(finished - max(arrived, handler_started))
+        processing = time.perf_counter() - started
+
+        # Let the coalesced roster edits go out before counting API calls
+        await asyncio.sleep(bot_module.render_window + 0.1)
+        await bot_module.journal.flush()
+        bot_module.journal.close()
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    all_latencies = sorted(value for values in latencies.values() for value in values)
+    end_to_end.sort()
+    updates = len(timeline)
+    return {
+        "scenario": {
+            "users": args.users, "seconds": args.seconds, "flip_flop": args.flip_flop,
+            "admin_actions": args.admin_actions, "capacity": args.capacity, "latency": args.latency,
+            "seed": args.seed,
+        },
+        "updates": updates,
+        "errors": errors,
+        "suppressed": suppressed,
+        "updates_per_second": updates / processing if processing else 0.0,
+        "latency_ms": {f"p{p}": percentile(all_latencies, p) * 1000 for p in (50, 95, 99)},
+        "end_to_end_ms": {f"p{p}": percentile(end_to_end, p) * 1000 for p in (50, 95, 99)},
+        "handlers": {
+            action: {"count": len(values), **{f"p{p}_ms": percentile(sorted(values), p) * 1000 for p in (50, 95, 99)}}
+            for action, values in sorted(latencies.items())
+        },
+        "api_calls": dict(bot.calls),
+        "api_calls_per_update": sum(bot.calls.values()) / updates,
+        "peak_memory_kb": peak / 1024,
+        "final_roster": {
+            "confirmed": len(event.roster.confirmed),
+            "waitlist": len(event.roster.waitlist),
+            "declined": len(event.roster.declined),
+        },
+    }
+
+
+def print_report(result, baseline=None):
+    def line(label, value, key=None, unit=""):
+        text = f"{label:<24} {value:12.3f}{unit}"
+        if baseline is not None and key is not None:
+            old = baseline
+            for part in key.split("."):
+                old = old.get(part, {}) if isinstance(old, dict) else {}
+            if isinstance(old, (int, float)) and old:
+                text += f"   ({(value - old) / old * 100:+.1f}% vs baseline)"
+        print(text)
+
+    print(f"{result['updates']} updates, {result['errors']} errors, {result['suppressed']} suppressed, final roster {result['final_roster']}")
+    line("updates/sec", result["updates_per_second"], "updates_per_second")
+    for p in ("p50", "p95", "p99"):
+        line(f"handler latency {p}", result["latency_ms"][p], f"latency_ms.{p}", " ms")
+    for p in ("p50", "p95", "p99"):
+        line(f"end-to-end {p}", result["end_to_end_ms"][p], f"end_to_end_ms.{p}", " ms")
+    line("API calls per update", result["api_calls_per_update"], "api_calls_per_update")
+    line("peak memory", result["peak_memory_kb"], "peak_memory_kb", " KiB")
+    print("per handler:")
+    for action, stats in result["handlers"].items():
+        print(f"  {action:<20} n={stats['count']:<6} p50={stats['p50_ms']:.3f} ms  p95={stats['p95_ms']:.3f} ms  p99={stats['p99_ms']:.3f} ms")
+    print(f"API calls: {result['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=1000, help="members voting in the storm")
+    parser.add_argument("--seconds", type=float, default=5.0, help="length of the storm (0 = as fast as possible)")
+    parser.add_argument("--flip-flop", type=float, default=0.2, help="share of users who change their vote")
+    parser.add_argument("--double-tap", type=float, default=0.1, help="share of presses tapped twice")
+    parser.add_argument("--admin-actions", type=int, default=50, help="admin button presses during the storm")
+    parser.add_argument("--capacity", type=int, default=20, help="players per game")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated Bot API latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
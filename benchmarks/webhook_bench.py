@@ -0,0 +1,234 @@
+# Click-to-edit latency of long polling against the webhook server, with a simulated Telegram in
+# between. Users press the vote button at random (Poisson) times. Telegram hands each press to the
+# bot either through getUpdates long polling or by POSTing the update JSON to WebhookServer on
+# localhost, and the bot runs the real handlers against the fake Bot. For every press the
+# benchmark measures the time until the button was answered and until the roster message showing
+# the vote was edited.
+#
+# Run from the repository root, for example:
+#   python benchmarks/webhook_bench.py --clicks 300 --rate 10 --latency 0.05 --window 0.2
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeContext, FakeUser, update_to_dict
+from socialsoccerbot import WebhookServer, encode_callback
+
+CHAT_ID = -1001234567890
+ROSTER_MESSAGE_ID = 500
+SECRET = "benchmark-secret"
+PATH = "/telegram"
+
+
+# Fake Bot that notes when each button was answered and when each roster edit went out
+class TimedBot(FakeBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.answered = {}  # callback query id -> time the answer completed
+        self.roster_edits = []  # (started, finished) of every edit of the roster message
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        result = await super().answer_callback_query(callback_query_id, **kwargs)
+        self.answered.setdefault(callback_query_id, time.perf_counter())
+        return result
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        started = time.perf_counter()
+        result = await super().edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+        if message_id == ROSTER_MESSAGE_ID:
+            self.roster_edits.append((started, time.perf_counter()))
+        return result
+
+
+# Telegram's side of getUpdates: updates wait here until a long poll picks them up
+class SimulatedTelegram:
+    def __init__(self, latency):
+        self.latency = latency
+        self.pending = []
+        self.arrived = asyncio.Event()
+
+    def click(self, data):
+        self.pending.append(data)
+        self.arrived.set()
+
+    async def get_updates(self, timeout=10):
+        await asyncio.sleep(self.latency)  # The request travels to Telegram
+        if not self.pending:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch, self.pending = self.pending[:100], self.pending[100:]
+        await asyncio.sleep(self.latency)  # The response travels back
+        return batch
+
+
+# Keep-alive HTTP client standing in for Telegram's webhook delivery
+class WebhookClient:
+    def __init__(self, port, connections):
+        self.port = port
+        self.idle = asyncio.Queue()
+        self.slots = asyncio.Semaphore(connections)
+        self.rejected = 0
+
+    async def post(self, data):
+        body = json.dumps(data).encode()
+        async with self.slots:
+            reader, writer = self.idle.get_nowait() if not self.idle.empty() else await asyncio.open_connection("127.0.0.1", self.port)
+            writer.write(
+                f"POST {PATH} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nX-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            keep_alive = True
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                if line.lower().startswith(b"connection:") and b"close" in line.lower():
+                    keep_alive = False
+            if keep_alive:
+                self.idle.put_nowait((reader, writer))
+            else:
+                writer.close()
+            return status
+
+    # Function to deliver one update the way Telegram does: retry until the bot takes it
+    async def deliver(self, data, latency):
+        await asyncio.sleep(latency)
+        while await self.post(data) != 200:
+            self.rejected += 1
+            await asyncio.sleep(1)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait()[1].close()
+
+
+# Function to get the p-th percentile of an already sorted list
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def run_mode(mode, args, directory):
+    bot = TimedBot(latency=args.latency, seed=args.seed)
+    chat = FakeChat(bot, CHAT_ID)
+    bot_module.journal = bot_module.Journal(os.path.join(directory, f"{mode}.db"))
+    bot_module.roster_renderer = bot_module.RosterRenderer(window=args.window)
+    event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00, Central Park", capacity=args.capacity)
+
+    # The bot side: one worker taking updates off the queue, as the Application does
+    queue = asyncio.Queue()
+    contexts = defaultdict(lambda: FakeContext(bot))
+    handled = {}
+
+    async def consume():
+        while True:
+            update = await queue.get()
+            context = contexts[update.effective_user.id]
+            await bot_module.track_members_seen(update, context)
+            await bot_module.route_callback(update, context)
+            handled[update.callback_query.id] = time.perf_counter()
+            queue.task_done()
+
+    telegram = SimulatedTelegram(args.latency)
+    workers = [asyncio.ensure_future(consume())]
+    client = server = None
+    if mode == "polling":
+        async def poll():
+            while True:
+                for data in await telegram.get_updates():
+                    queue.put_nowait(bot.update_from_dict(data))
+        workers.append(asyncio.ensure_future(poll()))
+    else:
+        server = WebhookServer(SimpleNamespace(update_queue=queue, bot=bot), path=PATH, secret=SECRET, max_queue=args.queue_size)
+        server.parse_update = bot.update_from_dict
+        port = (await server.start("127.0.0.1", 0)).sockets[0].getsockname()[1]
+        client = WebhookClient(port, args.connections)
+
+    # Users press the button; each press reaches Telegram and is handed to the bot
+    rng = random.Random(args.seed)
+    clicked = {}
+    deliveries = []
+    for i in range(args.clicks):
+        await asyncio.sleep(rng.expovariate(args.rate))
+        update = bot.press(FakeUser(10_000 + i, f"Player{i}"), chat, ROSTER_MESSAGE_ID, encode_callback("confirm_attendance", event_id=event.event_id))
+        clicked[update.callback_query.id] = time.perf_counter()
+        if mode == "polling":
+            telegram.click(update_to_dict(update))
+        else:
+            deliveries.append(asyncio.ensure_future(client.deliver(update_to_dict(update), args.latency)))
+
+    # Wait until every press was handled and the last roster edit went out
+    while len(handled) < args.clicks:
+        await asyncio.sleep(0.01)
+    await bot_module.roster_renderer.drain(bot)
+    await asyncio.gather(*deliveries)
+    if server is not None:
+        client.close()
+        await server.stop()
+    for worker in workers:
+        worker.cancel()
+    await bot_module.journal.flush()
+    bot_module.journal.close()
+
+    edit_starts = [started for started, _ in bot.roster_edits]
+    to_answer, to_edit = [], []
+    for query_id, at in clicked.items():
+        to_answer.append(bot.answered[query_id] - at)
+        first_edit = bisect.bisect_left(edit_starts, handled[query_id])
+        if first_edit < len(bot.roster_edits):
+            to_edit.append(bot.roster_edits[first_edit][1] - at)
+    to_answer.sort()
+    to_edit.sort()
+    return {
+        "click_to_answer_ms": {f"p{p}": percentile(to_answer, p) * 1000 for p in (50, 95, 99)},
+        "click_to_edit_ms": {f"p{p}": percentile(to_edit, p) * 1000 for p in (50, 95, 99)},
+        "roster_edits": len(bot.roster_edits),
+        "rejected_deliveries": client.rejected if client is not None else 0,
+    }
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        return {mode: await run_mode(mode, args, directory) for mode in ("polling", "webhook")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clicks", type=int, default=300, help="button presses per mode")
+    parser.add_argument("--rate", type=float, default=10.0, help="average presses per second")
+    parser.add_argument("--latency", type=float, default=0.05, help="one-way network latency to Telegram in seconds")
+    parser.add_argument("--window", type=float, default=bot_module.render_window, help="roster render window in seconds")
+    parser.add_argument("--capacity", type=int, default=20, help="players per game")
+    parser.add_argument("--connections", type=int, default=40, help="parallel webhook connections (Telegram's max_connections)")
+    parser.add_argument("--queue-size", type=int, default=1000, help="webhook update queue bound")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    for mode, stats in result.items():
+        answer, edit = stats["click_to_answer_ms"], stats["click_to_edit_ms"]
+        print(f"{mode:<8} click-to-answer p50={answer['p50']:8.1f} p95={answer['p95']:8.1f} p99={answer['p99']:8.1f} ms   "
+              f"click-to-edit p50={edit['p50']:8.1f} p95={edit['p95']:8.1f} p99={edit['p99']:8.1f} ms   "
+              f"edits={stats['roster_edits']} rejected={stats['rejected_deliveries']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,32 @@
+import asyncio
+import base64
+import binascii
+import bisect
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import json
 import logging
+import os
+import random
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+import numpy as np
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from itertools import chain, islice
+from urllib.parse import urlsplit
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+from telegram.ext import Application, ApplicationHandlerStop, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, ChatMemberHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from datetime import datetime, timedelta
 
 # Enable logging for debugging
@@ -10,17 +36,1822 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize variables
-yes_votes = []
-no_votes = []
-waitlist = []
-attendance = {}
-ban_list = {}
-members = [(123, "John Doe"), (124, "Jane Doe"), (125, "Max Mustermann")]  # Dummy member list for demonstration
+# Roster of one game, indexed by user id so every vote is O(1).
+# Confirmed and declined players live in insertion-ordered dicts and the waitlist in an
+# OrderedDict, so removing a player and promoting the head of the waitlist never scan a list.
+# When players carry a priority, the waitlist is also ranked in a heap of (-priority, seq);
+# entries of players who left the waitlist are skipped when they reach the top.
+class Roster:
+    def __init__(self, capacity=20):
+        self.capacity = capacity
+        self.confirmed = {}
+        self.waitlist = OrderedDict()
+        self.declined = {}
+        self.attendance = {}
+        self.priority = {}  # user_id -> reliability of waitlisted players when the waitlist is ordered by reliability
+        self.ranking = []  # heap of (-priority, seq, user_id)
+        self.ranked_seq = {}  # user_id -> seq of their live heap entry
+        self.ranked_count = 0
+        self.revisions = {"confirmed": 0, "waitlist": 0, "declined": 0}  # Bumped whenever a section changes
+
+    # Function to get the name of a player from whichever section they are in
+    def name_of(self, user_id):
+        for section in (self.confirmed, self.waitlist, self.declined):
+            if user_id in section:
+                return section[user_id]
+        return None
+
+    # Function to take a player out of every section
+    def _discard(self, user_id):
+        for name, section in (("confirmed", self.confirmed), ("waitlist", self.waitlist), ("declined", self.declined)):
+            if section.pop(user_id, None) is not None:
+                self.revisions[name] += 1
+        self.priority.pop(user_id, None)
+        self.ranked_seq.pop(user_id, None)
+
+    # Function to put a waitlisted player in line by priority; equal priorities keep the order they came in
+    def rank(self, user_id, priority):
+        self.priority[user_id] = priority
+        self.ranked_count += 1
+        self.ranked_seq[user_id] = self.ranked_count
+        heapq.heappush(self.ranking, (-priority, self.ranked_count, user_id))
+        if len(self.ranking) > 2 * len(self.ranked_seq) + 64:
+            self.ranking = [(-self.priority[uid], seq, uid) for uid, seq in self.ranked_seq.items()]
+            heapq.heapify(self.ranking)
+
+    # Function to pop the highest ranked player still on the waitlist, None when nobody is ranked
+    def _pop_ranked(self):
+        while self.ranking:
+            _, seq, user_id = heapq.heappop(self.ranking)
+            if self.ranked_seq.get(user_id) == seq:
+                del self.ranked_seq[user_id]
+                del self.priority[user_id]
+                return user_id
+        return None
+
+    # Function to record a Yes/No vote, returns the players promoted from the waitlist. A
+    # `priority` (the player's reliability) lets more reliable players be promoted first.
+    def vote(self, user_id, user_name, going, priority=None):
+        # Voting the same way again keeps the player's place in line
+        if going and (user_id in self.confirmed or user_id in self.waitlist):
+            return []
+        if not going and user_id in self.declined:
+            return []
+
+        self._discard(user_id)
+        if not going:
+            self.declined[user_id] = user_name
+            self.attendance[user_id] = "canceled"
+            self.revisions["declined"] += 1
+        elif len(self.confirmed) < self.capacity:
+            self.confirmed[user_id] = user_name
+            self.attendance[user_id] = "confirmed"
+            self.revisions["confirmed"] += 1
+        else:
+            self.waitlist[user_id] = user_name
+            self.attendance[user_id] = "waitlist"
+            self.revisions["waitlist"] += 1
+            if priority is not None:
+                self.rank(user_id, priority)
+        return self.promote()
+
+    # Function to drop a confirmed player (e.g. a no-show), returns the players promoted. Once the
+    # game's vote is closed the spot stays free (`promote=False`).
+    def remove(self, user_id, status="no_show", promote=True):
+        self._discard(user_id)
+        self.attendance[user_id] = status
+        return self.promote() if promote else []
+
+    # Function to move the head of the waitlist into the free spots. Players carrying a priority
+    # go first, most reliable first; the rest follow in the order they joined the waitlist.
+    def promote(self):
+        promoted = []
+        while len(self.confirmed) < self.capacity and self.waitlist:
+            user_id = self._pop_ranked()
+            if user_id is not None:
+                user_name = self.waitlist.pop(user_id)
+            else:
+                user_id, user_name = self.waitlist.popitem(last=False)
+            self.confirmed[user_id] = user_name
+            self.attendance[user_id] = "confirmed"
+            promoted.append((user_id, user_name))
+        if promoted:
+            self.revisions["confirmed"] += 1
+            self.revisions["waitlist"] += 1
+        return promoted
+
+# One game in one chat. Each event owns its roster, capacity, kickoff and vote-close times and
+# the scope its bans apply to (the chat by default, so a ban covers every game in that group).
+class Event:
+    def __init__(self, chat_id, event_id, content, capacity=20, close_at=None, ban_scope=None, kickoff_at=None):
+        self.chat_id = chat_id
+        self.event_id = event_id
+        self.content = content
+        self.roster = Roster(capacity)
+        self.kickoff_at = kickoff_at
+        self.close_at = close_at
+        self.closed = False
+        self.ban_scope = ban_scope if ban_scope is not None else chat_id
+        self.together = []  # groups of friends who play on the same team
+        self.voted_at = {}  # user_id -> time of their first Yes vote
+        self.late_cancels = set()  # players who dropped out of the game close to kickoff
+        self.captains = []  # players put on different teams
+
+    @property
+    def key(self):
+        return (self.chat_id, self.event_id)
+
+    # Function to check whether votes are still accepted
+    def voting_open(self, now=None):
+        if self.closed:
+            return False
+        return self.close_at is None or (now or datetime.now()) < self.close_at
+
+# Registry of all events keyed by (chat_id, event_id), with the newest event of every chat
+# indexed separately so lookups never scan across events.
+class EventRegistry:
+    def __init__(self):
+        self.events = {}
+        self.latest_ids = {}
+
+    # Function to open a new event in a chat with the next free event id
+    def create(self, chat_id, content, **kwargs):
+        event_id = self.latest_ids.get(chat_id, 0) + 1
+        return self.add(Event(chat_id, event_id, content, **kwargs))
+
+    def add(self, event):
+        self.events[event.key] = event
+        if event.event_id >= self.latest_ids.get(event.chat_id, 0):
+            self.latest_ids[event.chat_id] = event.event_id
+        return event
+
+    def get(self, chat_id, event_id):
+        return self.events.get((chat_id, event_id))
+
+    # Function to get the newest event of a chat, used when a button carries no event id
+    def latest(self, chat_id):
+        event_id = self.latest_ids.get(chat_id)
+        return None if event_id is None else self.events.get((chat_id, event_id))
+
+# Append-only journal of every vote, ban, unban and promotion, stored in SQLite (WAL mode).
+# Handlers only append to an in-memory batch; the batch is committed by a background task
+# (group commit) so the disk write never sits on the handler's critical path. Compaction
+# writes a snapshot of the whole state and drops the journal rows it already covers.
+class Journal:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, payload TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL, state TEXT NOT NULL)")
+        self.db.commit()
+        # Entries are numbered here, not by SQLite, so a snapshot knows exactly which entries it covers
+        self.seq = self.db.execute(
+            "SELECT MAX(COALESCE((SELECT MAX(seq) FROM journal), 0), COALESCE((SELECT seq FROM snapshot WHERE id = 1), 0))"
+        ).fetchone()[0]
+        self.lock = threading.Lock()  # The writer threads share one connection
+        self.pending = []
+        self.writes = set()  # Batches handed to a writer thread and not committed yet
+        self.flushing = None
+
+    # Function to queue one journal entry; it is committed shortly after by the flush task
+    def record(self, op, **payload):
+        self.seq += 1
+        self.pending.append((self.seq, op, json.dumps(payload, default=str)))
+        if self.flushing is None:
+            try:
+                self.flushing = asyncio.get_running_loop().create_task(self._flush_soon())
+            except RuntimeError:
+                pass  # No event loop (e.g. during restore), flush() will pick it up
+
+    async def _flush_soon(self):
+        try:
+            while self.pending:
+                await self._write_pending()
+        except Exception as e:
+            logger.error(f"Error writing journal: {e}")
+        finally:
+            self.flushing = None
+
+    # Function to hand the pending entries to a writer thread, returns a task that finishes once
+    # they are committed
+    def _write_pending(self):
+        batch, self.pending = self.pending, []
+        task = asyncio.ensure_future(asyncio.to_thread(self._write, batch))
+        self.writes.add(task)
+        task.add_done_callback(self.writes.discard)
+        return task
+
+    def _write(self, batch):
+        with self.lock, self.db:
+            self.db.executemany("INSERT INTO journal (seq, op, payload) VALUES (?, ?, ?)", batch)
+
+    # Function to commit everything recorded so far. It waits only for the writes already under
+    # way, so it returns even while new entries keep coming in.
+    async def flush(self):
+        if self.pending:
+            self._write_pending()
+        if self.writes:
+            await asyncio.gather(*self.writes)
+
+    # Function to replace the journal rows with a snapshot of the state returned by `snapshot`.
+    # The state and the seq it covers are taken together, with no await in between, so entries
+    # recorded while the snapshot is written stay in the journal.
+    async def compact(self, snapshot):
+        await self.flush()
+        state, seq = snapshot(), self.seq
+        await asyncio.to_thread(self._compact, seq, json.dumps(state, default=str))
+
+    def _compact(self, seq, state):
+        with self.lock, self.db:
+            if seq == 0:
+                return
+            self.db.execute("INSERT OR REPLACE INTO snapshot (id, seq, state) VALUES (1, ?, ?)", (seq, state))
+            self.db.execute("DELETE FROM journal WHERE seq <= ?", (seq,))
+
+    # Function to read the latest snapshot and the journal entries written after it
+    def load(self):
+        row = self.db.execute("SELECT seq, state FROM snapshot WHERE id = 1").fetchone()
+        seq, state = row if row else (0, None)
+        entries = self.db.execute("SELECT op, payload FROM journal WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+        return (json.loads(state) if state else None), [(op, json.loads(payload)) for op, payload in entries]
+
+    def close(self):
+        self.db.close()
+
+# Append-only columnar history of game outcomes, one row per player per game. Every column is a
+# flat binary file, so an append is one write per column and reads map the files straight into
+# NumPy arrays. A later row for the same player and game (a no-show marked after the game)
+# overrides the earlier one. All statistics are computed with vectorized aggregations.
+class AttendanceHistory:
+    columns = (("at", "<f8"), ("chat_id", "<i8"), ("event_id", "<i4"), ("user_id", "<i8"), ("outcome", "i1"), ("lead", "<f4"))
+    outcomes = {"played": 0, "no_show": 1, "late_cancel": 2, "canceled": 3, "waitlist": 4}
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.paths = {name: os.path.join(directory, f"{name}.bin") for name, _ in self.columns}
+        self.version = 0
+        self.loaded = None
+        # A crash between column writes leaves some files a row ahead: cut them back
+        rows = min(self._rows(name, dtype) for name, dtype in self.columns)
+        for name, dtype in self.columns:
+            with open(self.paths[name], "ab") as f:
+                f.truncate(rows * np.dtype(dtype).itemsize)
+
+    def _rows(self, name, dtype):
+        path = self.paths[name]
+        return os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+
+    def __len__(self):
+        return self._rows(*self.columns[0])
+
+    # Function to append the outcomes of one game: user_ids, outcome names and vote leads (hours)
+    def append(self, at, chat_id, event_id, user_ids, outcomes, leads):
+        values = {
+            "at": np.full(len(user_ids), at),
+            "chat_id": np.full(len(user_ids), chat_id),
+            "event_id": np.full(len(user_ids), event_id),
+            "user_id": user_ids,
+            "outcome": [self.outcomes[outcome] for outcome in outcomes],
+            "lead": leads,
+        }
+        for name, dtype in self.columns:
+            with open(self.paths[name], "ab") as f:
+                f.write(np.asarray(values[name], dtype=dtype).tobytes())
+        self.version += 1
+        self.loaded = None
+
+    # Function to get every column as an array (memory-mapped, read-only)
+    def load(self):
+        if self.loaded is None:
+            rows = len(self)
+            self.loaded = {
+                name: np.memmap(self.paths[name], dtype=dtype, mode="r", shape=(rows,)) if rows else np.empty(0, dtype=dtype)
+                for name, dtype in self.columns
+            }
+        return self.loaded
+
+    # Function to compute per-member statistics of a chat (optionally only games since a
+    # timestamp). Returns a dict of equally long arrays, one entry per member, sorted by user id.
+    def stats(self, chat_id, since=None):
+        columns = self.load()
+        mask = columns["chat_id"] == chat_id
+        if since is not None:
+            mask &= columns["at"] >= since
+        rows = np.flatnonzero(mask)
+
+        # Keep the last row of every (player, game); rows of one group end up next to each other
+        order = np.lexsort((rows, columns["event_id"][rows], columns["user_id"][rows]))
+        rows = rows[order]
+        user, event = columns["user_id"][rows], columns["event_id"][rows]
+        group_end = np.ones(len(rows), dtype=bool)
+        group_end[:-1] = (user[1:] != user[:-1]) | (event[1:] != event[:-1])
+        group_start = np.flatnonzero(np.concatenate(([True], group_end[:-1]))) if len(rows) else np.empty(0, dtype=np.int64)
+        lead = np.fmax.reduceat(columns["lead"][rows].astype(np.float64), group_start) if len(rows) else np.empty(0)
+        user, outcome = user[group_end], columns["outcome"][rows[group_end]]
+
+        users, first = np.unique(user, return_index=True)
+
+        def per_user(values):
+            return np.add.reduceat(values, first) if len(user) else np.zeros(0, dtype=values.dtype)
+
+        played = per_user((outcome == 0).astype(np.int64))
+        no_shows = per_user((outcome == 1).astype(np.int64))
+        late_cancels = per_user((outcome == 2).astype(np.int64))
+        committed = played + no_shows
+        has_lead = ~np.isnan(lead)
+        lead_count = per_user(has_lead.astype(np.int64))
+
+        # No-show streaks over the games each member committed to, oldest first
+        played_or_missed = outcome <= 1
+        streak_user, missed = user[played_or_missed], outcome[played_or_missed] == 1
+        position = np.arange(len(streak_user))
+        streak_start = np.searchsorted(streak_user, streak_user)
+        last_shown = np.maximum.accumulate(np.where(missed, -1, position)) if len(position) else position
+        run = position - np.maximum(last_shown, streak_start - 1)
+        current_streak = np.zeros(len(users), dtype=np.int64)
+        longest_streak = np.zeros(len(users), dtype=np.int64)
+        if len(streak_user):
+            streak_users, streak_first = np.unique(streak_user, return_index=True)
+            streak_last = np.append(streak_first[1:], len(streak_user)) - 1
+            slots = np.searchsorted(users, streak_users)
+            current_streak[slots] = run[streak_last]
+            longest_streak[slots] = np.maximum.reduceat(run, streak_first)
+
+        # Reliability: shows per commitment (late cancels count half), starting from 0.75 for
+        # newcomers and dropping further for every no-show in a row
+        reliability = (played + 1.5) / (committed + 0.5 * late_cancels + 2.0) * 0.8 ** current_streak
+        return {
+            "user_id": users,
+            "games": committed,
+            "played": played,
+            "no_shows": no_shows,
+            "late_cancels": late_cancels,
+            "show_rate": np.divide(played, committed, out=np.ones(len(users)), where=committed > 0),
+            "late_cancel_rate": np.divide(late_cancels, committed + late_cancels, out=np.zeros(len(users)), where=committed + late_cancels > 0),
+            "no_show_streak": current_streak,
+            "longest_no_show_streak": longest_streak,
+            "vote_lead_hours": np.divide(per_user(np.where(has_lead, lead, 0.0)), lead_count, out=np.full(len(users), np.nan), where=lead_count > 0),
+            "reliability": reliability,
+        }
+
+    # Function to stream the rows of a chat, oldest first, as (time, event_id, user_id, outcome,
+    # vote lead in hours). Only `chunk` rows of every column are read into memory at a time. The
+    # columns are mapped right away, so the rows can be gone through in another thread.
+    def rows(self, chat_id, chunk=65536):
+        columns = self.load()
+        names = {code: name for name, code in self.outcomes.items()}
+
+        def stream():
+            last_at, when = None, None
+            for start in range(0, len(columns["at"]), chunk):
+                part = {name: values[start:start + chunk] for name, values in columns.items()}
+                mask = part["chat_id"] == chat_id
+                for at, event_id, user_id, outcome, lead in zip(*(part[name][mask].tolist() for name in ("at", "event_id", "user_id", "outcome", "lead"))):
+                    if at != last_at:  # Every player of a game shares its timestamp
+                        last_at, when = at, datetime.fromtimestamp(at).isoformat(timespec="seconds")
+                    yield (when, event_id, user_id, names[outcome], None if lead != lead else round(lead, 1))
+        return stream()
+
+# Token bucket: allows `rate` sends per second with bursts of up to `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    # Function to wait until a token is available and take it
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# Outcome of one broadcast: who got the message, who did not and how fast it went
+class BroadcastReport:
+    def __init__(self, name):
+        self.name = name
+        self.delivered = []
+        self.failed = {}  # chat_id -> error description
+        self.retries = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        return len(self.delivered) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (
+            f"Broadcast '{self.name}': {len(self.delivered)} delivered, {len(self.failed)} failed, "
+            f"{self.retries} retries in {self.elapsed:.2f}s ({self.throughput:.1f} msg/s)"
+        )
+
+# Sends one message to many chats with a bounded number of workers. Every send takes a token
+# from the global bucket and from the recipient's own bucket, so Telegram's limits (about 30
+# messages per second overall and 1 per second per chat) are respected. A RetryAfter pauses all
+# workers for the time Telegram asks; network errors are retried with exponential backoff. One
+# Broadcaster is shared by every broadcast, so the pause and the per-chat buckets span
+# broadcasts running at the same time.
+class Broadcaster:
+    def __init__(self, bot, global_limiter, concurrency=8, per_chat_rate=1, max_attempts=5, backoff=0.5):
+        self.bot = bot
+        self.global_limiter = global_limiter
+        self.concurrency = concurrency
+        self.per_chat_rate = per_chat_rate
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.chat_limiters = {}
+        self.paused_until = 0.0
+
+    # Function to send `text` to every chat id and report per-recipient delivery
+    async def run(self, name, chat_ids, text, **kwargs):
+        # Buckets left untouched long enough to be full again are no different from new ones
+        now = time.monotonic()
+        self.chat_limiters = {
+            chat_id: limiter for chat_id, limiter in self.chat_limiters.items() if now - limiter.updated < limiter.capacity / limiter.rate
+        }
+        report = BroadcastReport(name)
+        recipients = iter(dict.fromkeys(chat_ids))  # Drop duplicates, keep order
+
+        async def worker():
+            for chat_id in recipients:
+                await self._deliver(chat_id, text, kwargs, report)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        report.elapsed = time.monotonic() - report.started
+        logger.info(report.summary())
+        return report
+
+    async def _deliver(self, chat_id, text, kwargs, report):
+        chat_limiter = self.chat_limiters.setdefault(chat_id, TokenBucket(self.per_chat_rate, 1))
+        for attempt in range(1, self.max_attempts + 1):
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await chat_limiter.acquire()
+            await self.global_limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                report.delivered.append(chat_id)
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+                error = e
+            except Forbidden as e:
+                report.failed[chat_id] = str(e)  # The user blocked the bot or never started it
+                return
+            except BadRequest as e:
+                report.failed[chat_id] = str(e)  # E.g. "Chat not found": sending again won't help
+                return
+            except NetworkError as e:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+                error = e
+            report.retries += 1
+        report.failed[chat_id] = str(error)
+
+# Active bans indexed two ways: a dict per ban scope for O(1) "is banned" checks and listings,
+# and a min-heap ordered by expiry so the next ban to run out is always at the top. Lifting or
+# extending a ban leaves its old heap entry behind; such stale entries are skipped when they
+# reach the top, and the heap is rebuilt once they outnumber the live bans.
+class BanRegistry:
+    def __init__(self):
+        self.scopes = {}  # ban scope -> {user_id: (name, ban_until)}
+        self.expiries = []  # heap of (ban_until, scope, user_id)
+        self.revision = 0  # Bumped whenever a ban is added or lifted
+
+    # Function to check whether a member is banned in a scope right now
+    def is_banned(self, scope, user_id, now=None):
+        entry = self.scopes.get(scope, {}).get(user_id)
+        return entry is not None and entry[1] > (now or datetime.now())
+
+    def get(self, scope, user_id):
+        return self.scopes.get(scope, {}).get(user_id)
+
+    # Function to list the bans of a scope as {user_id: (name, ban_until)}
+    def in_scope(self, scope):
+        return self.scopes.get(scope, {})
+
+    def __len__(self):
+        return sum(len(bans) for bans in self.scopes.values())
+
+    def ban(self, scope, user_id, user_name, ban_until):
+        self.scopes.setdefault(scope, {})[user_id] = (user_name, ban_until)
+        self.revision += 1
+        heapq.heappush(self.expiries, (ban_until, scope, user_id))
+        if len(self.expiries) > 2 * len(self) + 64:
+            self.expiries = [(until, scope, uid) for scope, bans in self.scopes.items() for uid, (_, until) in bans.items()]
+            heapq.heapify(self.expiries)
+
+    def unban(self, scope, user_id):
+        self.revision += 1
+        return self.scopes.get(scope, {}).pop(user_id, (None, None))
+
+    # Function to get when the next live ban runs out, dropping stale heap entries on the way
+    def next_expiry(self):
+        while self.expiries:
+            until, scope, user_id = self.expiries[0]
+            entry = self.scopes.get(scope, {}).get(user_id)
+            if entry is not None and entry[1] == until:
+                return until
+            heapq.heappop(self.expiries)
+        return None
+
+    # Function to lift every ban that has run out, returns [(scope, user_id, name)]
+    def expire(self, now=None):
+        now = now or datetime.now()
+        expired = []
+        while self.expiries and self.expiries[0][0] <= now:
+            until, scope, user_id = heapq.heappop(self.expiries)
+            entry = self.scopes.get(scope, {}).get(user_id)
+            if entry is not None and entry[1] == until:
+                del self.scopes[scope][user_id]
+                expired.append((scope, user_id, entry[0]))
+                self.revision += 1
+        return expired
+
+# Characters folded together when comparing names, so Persian names typed with an Arabic
+# keyboard (or with optional diacritics, tatweel or zero-width non-joiners) still match
+persian_name_folding = str.maketrans({
+    "ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه", "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ؤ": "و",
+    "\u200c": "", "\u200d": "", "ـ": "",
+    **{chr(code): "" for code in range(0x064B, 0x0653)},  # Arabic diacritics
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},  # Persian digits
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+})
+
+# Function to turn a name into its search key: case-folded, Persian-normalized, single-spaced
+def normalize_name(name):
+    name = unicodedata.normalize("NFKC", name).translate(persian_name_folding)
+    return " ".join(name.casefold().split())
+
+# Members seen in one chat. `names` indexes them by id; `by_name` keeps (search key, id) pairs
+# sorted for keyset pagination and `by_word` holds one pair per word of every name so a
+# prefix search matches first names and last names alike. Keyboards for the ban list are
+# cached per page and dropped whenever the membership changes.
+class MemberDirectory:
+    def __init__(self, page_size=10):
+        self.page_size = page_size
+        self.names = {}
+        self.by_name = []
+        self.by_word = []
+        self.keyboards = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _entries(self, user_id, name):
+        key = normalize_name(name)
+        return (key, user_id), [(word, user_id) for word in set(key.split())]
+
+    # Function to add or rename a member, returns True when the directory changed
+    def add(self, user_id, name):
+        old_name = self.names.get(user_id)
+        if old_name == name:
+            return False
+        if old_name is not None:
+            self.remove(user_id)
+        self.names[user_id] = name
+        name_entry, word_entries = self._entries(user_id, name)
+        bisect.insort(self.by_name, name_entry)
+        for entry in word_entries:
+            bisect.insort(self.by_word, entry)
+        self.keyboards.clear()
+        return True
+
+    # Function to add many members at once (used when restoring state)
+    def load(self, members):
+        for user_id, name in members:
+            self.names[user_id] = name
+        self.by_name, self.by_word = [], []
+        for user_id, name in self.names.items():
+            name_entry, word_entries = self._entries(user_id, name)
+            self.by_name.append(name_entry)
+            self.by_word.extend(word_entries)
+        self.by_name.sort()
+        self.by_word.sort()
+        self.keyboards.clear()
+
+    def remove(self, user_id):
+        name = self.names.pop(user_id, None)
+        if name is None:
+            return False
+        name_entry, word_entries = self._entries(user_id, name)
+        del self.by_name[bisect.bisect_left(self.by_name, name_entry)]
+        for entry in word_entries:
+            del self.by_word[bisect.bisect_left(self.by_word, entry)]
+        self.keyboards.clear()
+        return True
+
+    # Function to find members with a word starting with `prefix`, returns [(user_id, name)]
+    def search(self, prefix, limit=10):
+        prefix = normalize_name(prefix)
+        found = {}
+        position = bisect.bisect_left(self.by_word, (prefix,))
+        while position < len(self.by_word) and len(found) < limit:
+            word, user_id = self.by_word[position]
+            if not word.startswith(prefix):
+                break
+            found[user_id] = self.names[user_id]
+            position += 1
+        return list(found.items())
+
+    # Function to find where a page starts: right after `cursor` going forward, or a full page
+    # before it going backward. An unknown cursor (the member left) goes back to the first page.
+    def page_start(self, cursor=0, backwards=False):
+        if cursor not in self.names:
+            return 0
+        entry = (normalize_name(self.names[cursor]), cursor)
+        if backwards:
+            return max(0, bisect.bisect_left(self.by_name, entry) - self.page_size)
+        return bisect.bisect_right(self.by_name, entry)
+
+    # Function to build (or reuse) the ban keyboard for the page starting at `start`
+    def ban_keyboard(self, start):
+        keyboard = self.keyboards.get(start)
+        if keyboard is None:
+            page = self.by_name[start:start + self.page_size]
+            buttons = [
+                [InlineKeyboardButton(self.names[user_id], callback_data=encode_callback("select_ban", user_id=user_id))]
+                for _, user_id in page
+            ]
+            if start > 0:
+                buttons.insert(0, [InlineKeyboardButton("Previous", callback_data=encode_callback("prev_page_ban", user_id=page[0][1]))])
+            if start + self.page_size < len(self.by_name):
+                buttons.append([InlineKeyboardButton("Next", callback_data=encode_callback("next_page_ban", user_id=page[-1][1]))])
+            buttons.append(ui.back_row)
+            keyboard = self.keyboards[start] = InlineKeyboardMarkup(buttons)
+        return keyboard
+
+# Per-chat cache of administrator ids. A chat's admins are fetched with one
+# get_chat_administrators call and kept for `ttl` seconds; ChatMemberUpdated events keep the
+# cached set current in between, so a permission check normally costs no network call.
+class AdminCache:
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.admins = {}  # chat_id -> (set of admin user ids, fetched_at)
+        self.pending = {}  # chat_id -> in-flight fetch, shared by concurrent misses
+        self.on_fetch = None  # Called with (chat_id, admin ids) after every fetch
+        self.hits = 0
+        self.misses = 0
+
+    # Function to check whether a user is an admin or the creator of a chat
+    async def is_admin(self, chat, user_id):
+        if chat.type == "private":
+            return False  # Private chats have no administrators
+        entry = self.admins.get(chat.id)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return user_id in entry[0]
+
+        self.misses += 1
+        fetch = self.pending.get(chat.id)
+        if fetch is None:
+            fetch = self.pending[chat.id] = asyncio.ensure_future(self._fetch(chat))
+        return user_id in await fetch
+
+    async def _fetch(self, chat):
+        try:
+            administrators = await chat.get_administrators()
+        finally:
+            self.pending.pop(chat.id, None)
+        admin_ids = {member.user.id for member in administrators}
+        self.admins[chat.id] = (admin_ids, time.monotonic())
+        if self.on_fetch is not None:
+            self.on_fetch(chat.id, admin_ids)
+        return admin_ids
+
+    # Function to apply a ChatMemberUpdated change to the cached admins of a chat
+    def apply_member_update(self, chat_id, user_id, status):
+        entry = self.admins.get(chat_id)
+        if entry is None:
+            return
+        if status in ("administrator", "creator"):
+            entry[0].add(user_id)
+        else:
+            entry[0].discard(user_id)
+
+    def invalidate(self, chat_id):
+        self.admins.pop(chat_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "chats": len(self.admins)}
+
+# Bounded LRU memory of recent updates used to drop repeated work: updates Telegram delivers twice
+# (same update_id or callback query id) and rapid repeated taps of the same button by the same
+# user on the same message.
+class UpdateDeduplicator:
+    def __init__(self, capacity=4096, window=1.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.window = window
+        self.clock = clock
+        self.update_ids = OrderedDict()
+        self.query_ids = OrderedDict()
+        self.last_clicks = OrderedDict()  # (user_id, chat_id, message_id) -> (data, time)
+
+    def _remember(self, seen, key, value=True):
+        seen[key] = value
+        seen.move_to_end(key)
+        if len(seen) > self.capacity:
+            seen.popitem(last=False)
+
+    # Function to tell why an update repeats earlier work ("update", "query" or "click"), or None
+    def check(self, update, now=None):
+        if update.update_id in self.update_ids:
+            return "update"
+        self._remember(self.update_ids, update.update_id)
+        query = update.callback_query
+        if query is None:
+            return None
+        if query.id in self.query_ids:
+            return "query"
+        self._remember(self.query_ids, query.id)
+        if query.message is None:
+            return None
+        now = self.clock() if now is None else now
+        key = (query.from_user.id, query.message.chat_id, query.message.message_id)
+        last = self.last_clicks.get(key)
+        self._remember(self.last_clicks, key, (query.data, now))
+        if last is not None and last[0] == query.data and now - last[1] < self.window:
+            return "click"
+        return None
+
+# Records incoming updates as a gzip-compressed JSON Lines trace, so real traffic can be replayed
+# against new builds (benchmarks/replay.py). The first line describes the trace. Every other line
+# holds an update or the admins of a chat as fetched for the admin cache, with the time in
+# seconds since recording started. User and chat ids become keyed hashes (the key is random and
+# never written, so they cannot be traced back) and names become pseudonyms. Free text becomes
+# placeholders of the same length. Button data is kept, with member ids in it mapped the same
+# way. Commands keep their name, numbers and keywords; a name in their arguments becomes the
+# pseudonym of the one member of the chat it matches, and is masked otherwise.
+class UpdateRecorder:
+    identities = {"from", "user", "chat", "sender_chat", "new_chat_members", "left_chat_member", "forward_from", "forward_from_chat", "via_bot", "sender_user"}
+    dropped = {"username", "last_name", "title", "invite_link", "phone_number", "vcard", "chat_instance"}
+
+    def __init__(self, path, owner_id=None, flush_every=5.0):
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.key = os.urandom(16)
+        self.ids = {}  # real id -> pseudonymous id
+        self.started = time.monotonic()
+        self.flushed = self.started
+        self.flush_every = flush_every
+        self.recorded = 0
+        self._write({"trace": 1, "started": time.time(), "owner": self.pseudonym(owner_id) if owner_id else None})
+
+    # Function to map a user or chat id to its pseudonym (same sign, never 0)
+    def pseudonym(self, real_id):
+        mapped = self.ids.get(real_id)
+        if mapped is None:
+            digest = hmac.new(self.key, str(real_id).encode(), hashlib.sha256).digest()
+            mapped = int.from_bytes(digest[:6], "big") | 1
+            mapped = self.ids[real_id] = -mapped if real_id < 0 else mapped
+        return mapped
+
+    # Function to anonymize the Bot API form of an update (or any part of it)
+    def anonymize(self, value, key=None):
+        if isinstance(value, list):
+            return [self.anonymize(item, key) for item in value]
+        if not isinstance(value, dict):
+            return value
+        fields = {}
+        for name, item in value.items():
+            if name in self.dropped:
+                continue
+            if (name == "id" and key in self.identities) or (name == "user_id" and isinstance(item, int)):
+                item = self.pseudonym(item)
+            elif name == "first_name":
+                # A contact carries the user_id of the member it is, if any, and no id
+                real_id = value.get("id", value.get("user_id"))
+                item = f"Member {self.pseudonym(real_id) % 100000}" if real_id is not None else self.mask(item)
+            elif name == "forward_sender_name":
+                item = self.mask(item)
+            elif name == "text" and item.startswith("/"):
+                item = self.anonymize_command(item, value.get("chat", {}).get("id"))
+            elif name in ("text", "caption"):
+                item = self.mask(item)
+            elif name == "data" and key == "callback_query":
+                item = self.anonymize_callback(item)
+            else:
+                item = self.anonymize(item, name)
+            fields[name] = item
+        return fields
+
+    def mask(self, text):
+        return "".join(c if c in "\n " else "x" for c in text)
+
+    # Function to anonymize the arguments of a command, e.g. "/rate 7 Ali Rezaei" becomes
+    # "/rate 7 Member 12345". Arguments are comma-separated phrases (as /captains and /together
+    # take them); numbers and dates leading a phrase are kept, and so are export keywords.
+    def anonymize_command(self, text, chat_id):
+        command, *args = text.split()
+        keywords = set(export_kinds + export_formats)
+        phrases = []
+        for phrase in " ".join(args).split(","):
+            words = phrase.split()
+            kept = 0
+            while kept < len(words) and not any(c.isalpha() for c in words[kept]):
+                kept += 1
+            name = " ".join(words[kept:])
+            if name and not all(word.lower() in keywords for word in words[kept:]):
+                matches = resolve_member(name, directory_of(chat_id).search(words[kept], limit=50)) if chat_id is not None else []
+                name = f"Member {self.pseudonym(matches[0][0]) % 100000}" if len(matches) == 1 else self.mask(name)
+            phrases.append(" ".join(words[:kept] + ([name] if name else [])))
+        return " ".join([command, ", ".join(phrases)]) if args else command
+
+    def anonymize_callback(self, data):
+        try:
+            callback = decode_callback(data)
+        except ValueError:
+            return data
+        if not callback.user_id:
+            return data
+        return encode_callback(callback.action, callback.event_id, self.pseudonym(callback.user_id), callback.page, callback.days)
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        now = time.monotonic()
+        if now - self.flushed >= self.flush_every:
+            self.file.flush()
+            self.flushed = now
+
+    # Function to add an update (its Bot API dict) to the trace; `at` overrides the arrival time
+    def record(self, data, at=None):
+        at = time.monotonic() - self.started if at is None else at
+        self._write({"t": round(at, 4), "update": self.anonymize(data)})
+        self.recorded += 1
+
+    # Function to add the admins of a chat to the trace, so replays see the same permissions
+    def record_admins(self, chat_id, admin_ids, at=None):
+        at = time.monotonic() - self.started if at is None else at
+        self._write({"t": round(at, 4), "admins": {"chat": self.pseudonym(chat_id), "ids": sorted(self.pseudonym(uid) for uid in admin_ids)}})
+
+    def close(self):
+        self.file.close()
+
+# Hashed timer wheel for the per-event jobs (reminders, closing the vote). Scheduling and
+# cancelling are O(1), and a single repeating job advances the wheel once per tick, looking only
+# at the timers in the slots it passes, however many events are pending. Timers further away
+# than one turn of the wheel simply stay in their slot until their time comes.
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=3600):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.index = {}  # timer key -> slot holding it
+        self.position = int(time.time() // tick)  # last tick processed
+
+    def __len__(self):
+        return len(self.index)
+
+    # Function to (re)schedule the timer with this key for the given time
+    def schedule(self, key, when):
+        self.cancel(key)
+        due = when.timestamp() if isinstance(when, datetime) else when
+        tick = max(int(due // self.tick), self.position + 1)  # Overdue timers fire on the next tick
+        slot = self.slots[tick % len(self.slots)]
+        slot[key] = due
+        self.index[key] = slot
+
+    def cancel(self, key):
+        slot = self.index.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        return True
+
+    # Function to move the wheel up to now and return the keys of the timers that are due, earliest first
+    def advance(self, now):
+        current = int(now // self.tick)
+        due = []
+        for tick in range(max(self.position + 1, current - len(self.slots) + 1), current + 1):
+            slot = self.slots[tick % len(self.slots)]
+            for key, when in list(slot.items()):
+                if when <= now:
+                    del slot[key]
+                    del self.index[key]
+                    due.append((when, key))
+        self.position = max(self.position, current)
+        due.sort(key=lambda item: item[0])
+        return [key for _, key in due]
+
+# Latency histogram with fixed buckets (in seconds), in the Prometheus layout
+class Histogram:
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+# In-process metrics: counters and histograms are updated in place on the hot path (a dict
+# lookup and an addition), gauges are read only when the endpoint is scraped. Timers can be
+# sampled so only every n-th call pays for the clock reads.
+class Metrics:
+    def __init__(self, prefix="socialsoccerbot"):
+        self.prefix = prefix
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # name -> function returning a value or {labels: value}
+        self.calls = {}  # timer name -> calls seen, for sampling
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    # Function to decide whether this call of a timer should be measured (every n-th call)
+    def sampled(self, name, every=1):
+        calls = self.calls.get(name, 0)
+        self.calls[name] = calls + 1
+        return calls % every == 0
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    # Function to render everything in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                typed.add(name)
+            lines.append(f"{self.prefix}_{name}{self._labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            if name not in typed:
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.prefix}_{name}_bucket{self._labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_sum{self._labels(labels)} {histogram.sum}")
+            lines.append(f"{self.prefix}_{name}_count{self._labels(labels)} {histogram.count}")
+        for name, read in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                logger.error(f"Error reading metric {name}: {e}")
+                continue
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            for labels, gauge_value in (value.items() if isinstance(value, dict) else [((), value)]):
+                lines.append(f"{self.prefix}_{name}{self._labels(labels)} {gauge_value}")
+        return "\n".join(lines) + "\n"
+
+    # Function to serve GET /metrics on a local port (plain HTTP/1.0, one response per connection)
+    async def serve(self, host, port):
+        async def respond(reader, writer):
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+                while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                    pass
+                parts = request_line.decode("latin-1").split()
+                if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                    status, body = "200 OK", self.render().encode()
+                else:
+                    status, body = "404 Not Found", b"Not found\n"
+                writer.write(
+                    f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(respond, host, port)
+
+# HTTP transport that counts every Bot API call, its errors and its latency by API method
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = (("method", url.rsplit("/", 1)[-1]),)
+        metrics.inc("api_calls_total", api_method)
+        timed = metrics.sampled("api_call", latency_sample_every)
+        started = time.perf_counter() if timed else 0.0
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            metrics.inc("api_errors_total", api_method)
+            raise
+        if timed:
+            metrics.observe("api_call_seconds", time.perf_counter() - started, api_method)
+        if status >= 400:
+            metrics.inc("api_errors_total", api_method)
+        return status, payload
+
+# HTTP/1.1 server for Telegram's webhook. Only POSTs to the webhook path carrying the secret
+# token are accepted. Updates go straight into the application's update queue; while that queue
+# is full Telegram gets a 503 and delivers the update again later, so nothing is dropped. To try
+# it locally, POST a recorded update:
+#   curl -H "X-Telegram-Bot-Api-Secret-Token: <secret>" -H "Content-Type: application/json" \
+#        --data @update.json http://127.0.0.1:8080/<path>
+class WebhookServer:
+    max_body = 1 << 20
+    idle_timeout = 60
+    reasons = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+    def __init__(self, application, path="/", secret=None, max_queue=1000):
+        self.application = application
+        self.path = path
+        self.secret = secret.encode() if secret else None
+        self.max_queue = max_queue
+        self.server = None
+        self.closing = False
+        self.connections = set()
+        self.idle = set()  # connections waiting for their next request, closed first on shutdown
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.serve_connection, host, port)
+        return self.server
+
+    # Function to stop taking updates; requests already being answered are finished first
+    async def stop(self):
+        self.closing = True
+        self.server.close()
+        for writer in list(self.idle):
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    # Function to turn the JSON body into an Update
+    def parse_update(self, data):
+        return Update.de_json(data, self.application.bot)
+
+    async def read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body:
+            return method, path, headers, None
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    # Function to decide the response to one request and queue its update when accepted
+    def handle(self, method, path, headers, body):
+        if path.split("?")[0] != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if self.secret is not None:
+            token = headers.get("x-telegram-bot-api-secret-token", "").encode()
+            if not hmac.compare_digest(token, self.secret):
+                metrics.inc("webhook_rejected_total", (("reason", "secret"),))
+                return 403
+        if body is None:
+            return 413
+        if self.closing or self.application.update_queue.qsize() >= self.max_queue:
+            metrics.inc("webhook_rejected_total", (("reason", "busy"),))
+            return 503
+        try:
+            update = self.parse_update(json.loads(body))
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Ignoring malformed webhook update: {e}")
+            metrics.inc("webhook_rejected_total", (("reason", "malformed"),))
+            return 400
+        self.application.update_queue.put_nowait(update)
+        metrics.inc("webhook_updates_total")
+        return 200
+
+    async def serve_connection(self, reader, writer):
+        self.connections.add(asyncio.current_task())
+        try:
+            while not self.closing:
+                self.idle.add(writer)
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), timeout=self.idle_timeout)
+                except ValueError:
+                    request, status = None, 400
+                else:
+                    status = None
+                finally:
+                    self.idle.discard(writer)
+                if request is not None:
+                    status = self.handle(*request)
+                if status is None:
+                    break
+                # An oversized body is left unread and a bad request may be cut short, so the rest of
+                # the stream can't be trusted to start a new request: close the connection
+                keep_alive = (request is not None and request[3] is not None and status != 400
+                              and request[2].get("connection", "").lower() != "close" and not self.closing)
+                extra = "Retry-After: 1\r\n" if status == 503 else ""
+                writer.write(
+                    f"HTTP/1.1 {status} {self.reasons[status]}\r\nContent-Length: 0\r\n{extra}"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self.connections.discard(asyncio.current_task())
+
+# Update processor that handles updates from different chats concurrently but keeps the updates
+# of each chat strictly in arrival order, so first come, first served on the roster still holds.
+# An update waits for the previous one from its chat before it takes a worker slot, so a busy
+# chat occupies at most one slot and quiet chats are never stuck behind it.
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=64):
+        super().__init__(max_concurrent_updates)
+        self.tails = {}  # chat (or user) -> future resolved when its latest update is done
+        self.waiting = 0
+
+    @staticmethod
+    def ordering_key(update):
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, "effective_user", None)
+        return ("user", user.id) if user is not None else None
+
+    async def process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        previous = self.tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self.tails[key] = done
+        try:
+            if previous is not None:
+                self.waiting += 1
+                try:
+                    await asyncio.shield(previous)
+                finally:
+                    self.waiting -= 1
+            await super().process_update(update, coroutine)
+        finally:
+            done.set_result(None)
+            if self.tails.get(key) is done:
+                del self.tails[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+# Function to score a split: strength gap between the strongest and weakest team, plus a penalty
+# that outweighs any gap for teams whose sizes differ by more than one or that share a captain
+def split_cost(sums, counts, captain_counts, penalty):
+    cost = max(sums) - min(sums)
+    cost += penalty * max(0, max(counts) - min(counts) - 1)
+    cost += penalty * sum(count - 1 for count in captain_counts if count > 1)
+    return cost
+
+# Function to split players into balanced teams. `players` maps user id -> strength, `together`
+# lists groups of user ids that play on one team and `apart` the user ids (the captains) that go
+# to different teams. Two-team splits of up to `exact_limit` blocks are solved exactly (on strengths
+# rounded to tenths, then polished). Larger ones start from Karmarkar-Karp differencing, polished
+# by a local search of moves and swaps; while the time budget (seconds) lasts, the best split is
+# shaken by a few random swaps and searched again. Returns one list of user ids per team.
+def balance_teams(players, teams=2, together=(), apart=(), budget=0.04, exact_limit=16, tolerance=0.01):
+    # Friends are merged into blocks that always move together
+    parent = {uid: uid for uid in players}
+
+    def find(uid):
+        while parent[uid] != uid:
+            parent[uid] = parent[parent[uid]]
+            uid = parent[uid]
+        return uid
+
+    for group in together:
+        members = [uid for uid in group if uid in parent]
+        for uid in members[1:]:
+            parent[find(uid)] = find(members[0])
+    grouped = {}
+    for uid in players:
+        grouped.setdefault(find(uid), []).append(uid)
+    blocks = list(grouped.values())
+    apart = set(apart)
+    weights = [sum(players[uid] for uid in block) for block in blocks]
+    sizes = [len(block) for block in blocks]
+    captains = [sum(uid in apart for uid in block) for block in blocks]
+
+    if teams == 2 and len(blocks) <= exact_limit:
+        assignment = split_exact(weights, sizes, captains)
+        improve_split(assignment, weights, sizes, captains, teams, time.perf_counter() + budget)
+    else:
+        deadline = time.perf_counter() + budget
+        assignment = split_differencing(weights, teams)
+        cost = improve_split(assignment, weights, sizes, captains, teams, deadline)
+        rng = random.Random(len(weights))  # Same roster, same teams
+        while cost > tolerance and len(weights) > 1 and time.perf_counter() < deadline:
+            candidate = assignment[:]
+            for _ in range(2):
+                i, j = rng.sample(range(len(weights)), 2)
+                candidate[i], candidate[j] = candidate[j], candidate[i]
+            candidate_cost = improve_split(candidate, weights, sizes, captains, teams, deadline)
+            if candidate_cost < cost:
+                assignment, cost = candidate, candidate_cost
+    result = [[] for _ in range(teams)]
+    for block, team in zip(blocks, assignment):
+        result[team].extend(block)
+    return result
+
+# Function to find the best two-team split by DP over the (size, strength, captains) states of the
+# first team; strengths are rounded to tenths so the number of states stays small
+def split_exact(weights, sizes, captains):
+    states = {(0, 0, 0): 0}  # (size, strength x10, captains) of team 0 -> bitmask of its blocks
+    for i, (weight, size, captain) in enumerate(zip(weights, sizes, captains)):
+        scaled = round(weight * 10)
+        for (team_size, strength, team_captains), mask in list(states.items()):
+            states.setdefault((team_size + size, strength + scaled, team_captains + captain), mask | (1 << i))
+    total_size, total_strength, total_captains = sum(sizes), sum(round(weight * 10) for weight in weights), sum(captains)
+    penalty = total_strength + 1
+
+    def cost(state):
+        size, strength, team_captains = state
+        return split_cost([strength, total_strength - strength], [size, total_size - size], [team_captains, total_captains - team_captains], penalty)
+
+    best = states[min(states, key=cost)]
+    return [0 if best >> i & 1 else 1 for i in range(len(weights))]
+
+# Function to split weights into teams by Karmarkar-Karp differencing: repeatedly merge the two
+# partial splits with the largest gaps, pairing the heaviest team of one with the lightest of the other
+def split_differencing(weights, teams):
+    if not weights:
+        return []
+    heap = []
+    for i, weight in enumerate(weights):
+        partition = [(weight, [i])] + [(0.0, []) for _ in range(teams - 1)]
+        heap.append((-weight, i, partition))
+    heapq.heapify(heap)
+    order = len(weights)
+    while len(heap) > 1:
+        _, _, first = heapq.heappop(heap)
+        _, _, second = heapq.heappop(heap)
+        merged = sorted(((a[0] + b[0], a[1] + b[1]) for a, b in zip(first, reversed(second))), key=lambda part: -part[0])
+        heapq.heappush(heap, (merged[-1][0] - merged[0][0], order, merged))
+        order += 1
+    assignment = [0] * len(weights)
+    for team, (_, members) in enumerate(heap[0][2]):
+        for i in members:
+            assignment[i] = team
+    return assignment
+
+# Function to improve a split in place by moving single blocks or swapping pairs between teams,
+# returns the cost it reached
+def improve_split(assignment, weights, sizes, captains, teams, deadline):
+    sums, counts, captain_counts = [0.0] * teams, [0] * teams, [0] * teams
+    for i, team in enumerate(assignment):
+        sums[team] += weights[i]
+        counts[team] += sizes[i]
+        captain_counts[team] += captains[i]
+    penalty = sum(weights) + 1
+
+    def shift(i, source, target):
+        sums[source] -= weights[i]
+        sums[target] += weights[i]
+        counts[source] -= sizes[i]
+        counts[target] += sizes[i]
+        captain_counts[source] -= captains[i]
+        captain_counts[target] += captains[i]
+        assignment[i] = target
+
+    current = split_cost(sums, counts, captain_counts, penalty)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(len(weights)):
+            for target in range(teams):
+                source = assignment[i]
+                if source == target:
+                    continue
+                shift(i, source, target)
+                cost = split_cost(sums, counts, captain_counts, penalty)
+                if cost < current - 1e-9:
+                    current, improved = cost, True
+                    continue
+                # Moving alone does not help: try swapping with each block of the other team
+                for j in range(len(weights)):
+                    if j == i or assignment[j] != target:
+                        continue
+                    shift(j, target, source)
+                    cost = split_cost(sums, counts, captain_counts, penalty)
+                    if cost < current - 1e-9:
+                        current, improved = cost, True
+                        break
+                    shift(j, source, target)
+                else:
+                    shift(i, target, source)
+            if time.perf_counter() >= deadline:
+                break
+    return current
+
+# Function to split text into chunks that fit in one Telegram message, preferring line breaks
+def split_message(text, limit=4096):
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+# Function to pack lines into pages of at most `limit` characters as they are produced, so a
+# long report is never joined into one string first
+def paginate(lines, limit=4000):
+    page, size = [], 0
+    for line in lines:
+        for piece in (split_message(line, limit) if len(line) > limit else (line,)):
+            if page and size + len(piece) > limit:
+                yield "\n".join(page)
+                page, size = [], 0
+            if page or piece:  # No blank line at the top of a page
+                page.append(piece)
+                size += len(piece) + 1
+    if page:
+        yield "\n".join(page)
+
+# Coalesces roster message edits. A vote only marks its roster message dirty; each message is
+# then edited at most once per `window` seconds with whatever the roster looks like by then.
+# Section texts are cached by roster revision so only changed sections are re-joined, and an
+# edit is skipped when its content hash matches what the message already shows. Rosters longer
+# than one message continue in extra messages that are edited (or deleted) in later flushes.
+# A message stops being tracked once it is forgotten or its event closes (after its last edit).
+class RosterRenderer:
+    sections_shown = (("confirmed", "Total Confirmed"), ("waitlist", "Total Waitlist"), ("declined", "Total No"))
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.section_cache = {}  # (event key, section) -> (revision, text)
+        self.targets = {}  # (chat_id, message_id) -> (event, reply_markup)
+        self.scheduled = {}  # (chat_id, message_id) -> pending timer
+        self.shown = {}  # (chat_id, message_id) -> content hash of every chunk on screen
+        self.overflow = {}  # (chat_id, message_id) -> ids of the continuation messages
+        self.by_event = {}  # event key -> roster messages of the event
+        self.tasks = set()
+        self.edits = 0
+        self.coalesced = 0
+        self.unchanged = 0
+
+    # Function to request a re-render of a roster message; the edit happens after the window
+    def mark_dirty(self, bot, event, chat_id, message_id, reply_markup=None):
+        target = (chat_id, message_id)
+        previous = self.targets.get(target)
+        if previous is not None and previous[0] is not event:
+            self._drop(target)  # The message now shows another event's roster
+        self.targets[target] = (event, reply_markup)
+        self.by_event.setdefault(event.key, set()).add(target)
+        if target in self.scheduled:
+            self.coalesced += 1
+            return
+        self.scheduled[target] = asyncio.get_running_loop().call_later(self.window, self._start_flush, bot, target)
+
+    # Function to note that a message was edited elsewhere and no longer shows the roster
+    def forget(self, chat_id, message_id):
+        target = (chat_id, message_id)
+        timer = self.scheduled.pop(target, None)
+        if timer is not None:
+            timer.cancel()
+        self._drop(target)
+
+    # Function to stop tracking the roster messages of a closed event. Messages with an edit
+    # still pending are dropped by their last flush.
+    def release(self, event):
+        for target in list(self.by_event.get(event.key, ())):
+            if target not in self.scheduled:
+                self._drop(target)
+
+    def _drop(self, target):
+        entry = self.targets.pop(target, None)
+        self.shown.pop(target, None)
+        self.overflow.pop(target, None)
+        if entry is None:
+            return
+        key = entry[0].key
+        self.by_event[key].discard(target)
+        if not self.by_event[key]:
+            del self.by_event[key]
+            for name, _ in self.sections_shown:
+                self.section_cache.pop((key, name), None)
+
+    # Function to run a flush of a roster message after `delay` seconds, unless one is already due sooner
+    def _schedule(self, bot, target, delay):
+        loop = asyncio.get_running_loop()
+        timer = self.scheduled.get(target)
+        if timer is not None:
+            if timer.when() <= loop.time() + delay:
+                return
+            timer.cancel()
+        self.scheduled[target] = loop.call_later(delay, self._start_flush, bot, target)
+
+    def _start_flush(self, bot, target):
+        task = asyncio.ensure_future(self.flush(bot, target))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # Function to send every pending roster edit now instead of waiting for the window
+    async def drain(self, bot):
+        for target, timer in list(self.scheduled.items()):
+            timer.cancel()
+            self._start_flush(bot, target)
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    # Function to get the text of one roster section, rebuilt only when the section changed
+    def section_text(self, event, name, title):
+        revision = event.roster.revisions[name]
+        cached = self.section_cache.get((event.key, name))
+        if cached is None or cached[0] != revision:
+            section = getattr(event.roster, name)
+            names = "\n".join([f"{uid} - {user_name}" for uid, user_name in section.items()])
+            cached = self.section_cache[(event.key, name)] = (revision, f"**{title} ({len(section)}):**\n{names}")
+        return cached[1]
+
+    def render(self, event):
+        return "\n\n".join([self.section_text(event, name, title) for name, title in self.sections_shown])
+
+    # Function to bring a roster message (and its continuation messages) up to date
+    async def flush(self, bot, target):
+        self.scheduled.pop(target, None)
+        if target not in self.targets:
+            return  # Forgotten while the edit was waiting
+        event, reply_markup = self.targets[target]
+        chat_id, message_id = target
+        chunks = split_message(self.render(event))
+        shown = self.shown.setdefault(target, [])
+        overflow = self.overflow.setdefault(target, [])
+        try:
+            for i, chunk in enumerate(chunks):
+                digest = hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+                if i < len(shown) and shown[i] == digest:
+                    self.unchanged += 1
+                    continue
+                if i == 0:
+                    await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=chunk, reply_markup=reply_markup)
+                elif i - 1 < len(overflow):
+                    await bot.edit_message_text(chat_id=chat_id, message_id=overflow[i - 1], text=chunk)
+                else:
+                    message = await bot.send_message(chat_id=chat_id, text=chunk)
+                    overflow.append(message.message_id)
+                self.edits += 1
+                if i < len(shown):
+                    shown[i] = digest
+                else:
+                    shown.append(digest)
+
+            # The roster got shorter: drop the continuation messages that are no longer needed
+            while len(overflow) > len(chunks) - 1:
+                await bot.delete_message(chat_id=chat_id, message_id=overflow.pop())
+            del shown[len(chunks):]
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            self._schedule(bot, target, retry_after)
+        except BadRequest as e:
+            if "not modified" not in str(e):
+                logger.error(f"Error updating roster message {target}: {e}")
+        except NetworkError as e:
+            logger.error(f"Error updating roster message {target}, trying again: {e}")
+            self._schedule(bot, target, self.window)
+        if event.closed and target not in self.scheduled:
+            self._drop(target)
+
+# Pages of the participation report of every chat. A chat's pages are built once from a stream
+# of lines and served from here until its roster or bans change (the signature), so paging
+# back and forth re-renders nothing. Only the `capacity` most recently viewed chats are kept.
+class ReportPages:
+    def __init__(self, capacity=64, limit=4000):
+        self.capacity = capacity
+        self.limit = limit
+        self.cache = OrderedDict()  # chat_id -> (signature, pages)
+        self.hits = 0
+        self.misses = 0
+
+    # Function to get the pages of a chat, paginating `lines()` again only when the signature changed
+    def get(self, chat_id, signature, lines):
+        cached = self.cache.get(chat_id)
+        if cached is not None and cached[0] == signature:
+            self.hits += 1
+            self.cache.move_to_end(chat_id)
+            return cached[1]
+        self.misses += 1
+        pages = list(paginate(lines(), self.limit)) or [""]
+        self.cache[chat_id] = (signature, pages)
+        self.cache.move_to_end(chat_id)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+        return pages
+
+# Registry of the bot's keyboards and long texts, built once at startup instead of on every click.
+# Keyboards that never change are attributes; keyboards carrying an event or member id are built
+# on first use and kept (up to `cached_ids` each), so every message showing them shares one
+# object. Telegram objects cannot be changed once created, which makes sharing them safe. Texts
+# shown to one member come in English or Persian, picked from their Telegram app's language.
+class UIRegistry:
+    texts = {
+        "en": {
+            "welcome": "Welcome to our Saturday Social Soccer program! Please respect the group rules and others "
+                       "as we aim to have a friendly but competitive game. Please confirm you have read and agree to the following rules:",
+            "welcome_back": "Welcome back to our Saturday Social Soccer program! You have already agreed to the group rules.",
+            "terms_title": "Terms & Conditions:",
+            "rules_sent": "I've sent you the rules in a private message.",
+            "rules_above": "The rules are posted above.",
+        },
+        "fa": {
+            "welcome": "به برنامه فوتبال اجتماعی شنبه‌ها خوش آمدید! لطفاً به قوانین گروه و دیگران احترام بگذارید؛ "
+                       "هدف ما بازی دوستانه اما رقابتی است. لطفاً تأیید کنید که قوانین زیر را خوانده‌اید و با آن‌ها موافقید:",
+            "welcome_back": "دوباره به برنامه فوتبال اجتماعی شنبه‌ها خوش آمدید! شما قبلاً با قوانین گروه موافقت کرده‌اید.",
+            "terms_title": "قوانین و مقررات:",
+            "rules_sent": "قوانین را در پیام خصوصی برایتان فرستادم.",
+            "rules_above": "قوانین در بالا ارسال شده است.",
+        },
+    }
+    # Posted to the whole group with every new game, so it is short and in both languages
+    event_prompt = (
+        "A new game is up! Tap I Agree to vote. The first time, you agree to the group rules and get them in your language (📜 Rules shows them again).\n\n"
+        "بازی جدید اعلام شد! برای رأی دادن «I Agree» را بزنید. بار اول با قوانین گروه موافقت می‌کنید و آن‌ها را به زبان خودتان دریافت می‌کنید (📜 Rules دوباره نشانشان می‌دهد)."
+    )
+
+    def __init__(self, terms, cached_ids=4096):
+        self.terms = self.split_terms(terms)
+        self.terms_message = {language: f"{self.texts[language]['terms_title']}\n{text}" for language, text in self.terms.items()}
+        self.welcome = {language: f"{self.texts[language]['welcome']}\n\n{text}" for language, text in self.terms.items()}
+
+        self.back_row = (self.button("🔙 Back", "admin_actions"),)
+        self.back_to_admin = InlineKeyboardMarkup((self.back_row,))
+        self.start_menu = InlineKeyboardMarkup((
+            (self.button("I Agree", "agree_terms"),),
+            (self.button("🔨 Admin Actions", "admin_actions"),),  # Visible to everyone, usable by admins and the bot owner
+        ))
+        self.admin_entry = InlineKeyboardMarkup(((self.button("🔨 Admin Actions", "admin_actions"),),))
+        self.admin_menu = InlineKeyboardMarkup((
+            (self.button("➕ Create Event", "create_event"),),
+            (self.button("✏️ Edit Current Event", "update_event"),),
+            (self.button("🔨 Ban a Member", "ban_member"),),
+            (self.button("🚫 Unban a Member", "unban_member"),),
+            (self.button("📋 Generate Report", "generate_report"),),
+            (self.button("🚫 Mark No-Show", "mark_no_show"),),
+            (self.button("⚖️ Make Teams", "make_teams", page=2),),
+            (self.button("❌ Close Voting", "close_voting"),),
+            (self.button("❌ Exit Admin Actions", "exit_admin_actions"),),
+        ))
+        self.event_draft = InlineKeyboardMarkup((
+            (self.button("Edit Event", "edit_event"),),
+            (self.button("Approve Event", "approve_event"),),
+        ))
+        self.export_row = (
+            self.button("📄 CSV", "export_report", page=export_formats.index("csv")),
+            self.button("🧾 JSON", "export_report", page=export_formats.index("json")),
+        )
+
+        self.vote_menu = lru_cache(maxsize=cached_ids)(self._vote_menu)
+        self.change_vote_menu = lru_cache(maxsize=cached_ids)(self._change_vote_menu)
+        self.after_vote_menu = lru_cache(maxsize=cached_ids)(self._after_vote_menu)
+        self.terms_prompt = lru_cache(maxsize=cached_ids)(self._terms_prompt)
+        self.ban_durations = lru_cache(maxsize=cached_ids)(self._ban_durations)
+        self.confirm_unban = lru_cache(maxsize=cached_ids)(self._confirm_unban)
+        self.confirm_no_show = lru_cache(maxsize=cached_ids)(self._confirm_no_show)
+
+    @staticmethod
+    def button(text, action, **fields):
+        return InlineKeyboardButton(text, callback_data=encode_callback(action, **fields))
+
+    # Function to tidy the rules into one text per language: one rule per line, without the
+    # indentation and doubled line breaks of the source. Each language's list starts again at "1."
+    @staticmethod
+    def split_terms(terms):
+        rules = [line.strip() for line in terms.splitlines() if line.strip()]
+        restart = next((i for i, line in enumerate(rules) if i and line.startswith("1.")), len(rules))
+        return {"en": "\n".join(rules[:restart]), "fa": "\n".join(rules[restart:]) or "\n".join(rules[:restart])}
+
+    # Function to pick a member's language: Persian when their Telegram app is set to it
+    @staticmethod
+    def language_of(user):
+        code = getattr(user, "language_code", None) or ""
+        return "fa" if code.lower().startswith("fa") else "en"
+
+    def text(self, language, name):
+        return self.texts[language][name]
+
+    def _vote_menu(self, event_id):
+        return InlineKeyboardMarkup((
+            (self.button("👍 Yes, I'll be there", "confirm_attendance", event_id=event_id),),
+            (self.button("🚫 No, I can't make it", "cancel_attendance", event_id=event_id),),
+            (self.button("🔄 Change Vote", "change_vote", event_id=event_id),),
+        ))
+
+    def _change_vote_menu(self, event_id):
+        return InlineKeyboardMarkup((
+            (self.button("👍 Yes, I'll be there", "confirm_attendance", event_id=event_id),),
+            (self.button("🚫 No, I can't make it", "cancel_attendance", event_id=event_id),),
+            self.back_row,
+        ))
+
+    def _after_vote_menu(self, event_id):
+        return InlineKeyboardMarkup(((self.button("🔄 Change Vote", "change_vote", event_id=event_id),), self.back_row))
+
+    def _terms_prompt(self, event_id):
+        return InlineKeyboardMarkup((
+            (self.button("I Agree", "agree_terms", event_id=event_id), self.button("📜 Rules", "show_terms", event_id=event_id)),
+        ))
+
+    def _ban_durations(self, user_id):
+        return InlineKeyboardMarkup((
+            (self.button("1 Week", "confirm_ban", user_id=user_id, days=7),),
+            (self.button("2 Weeks", "confirm_ban", user_id=user_id, days=14),),
+            (self.button("1 Month", "confirm_ban", user_id=user_id, days=30),),
+            (self.button("📅 Custom Date", "custom_ban", user_id=user_id),),
+            (self.button("🔙 Back", "ban_member"),),  # Back to list members to ban
+        ))
+
+    def _confirm_unban(self, user_id):
+        return InlineKeyboardMarkup((
+            (self.button("Confirm Unban", "confirm_unban", user_id=user_id),),
+            (self.button("🔙 Back", "unban_member"),),  # Back to list members to unban
+        ))
+
+    def _confirm_no_show(self, user_id):
+        return InlineKeyboardMarkup((
+            (self.button("Confirm No-Show", "confirm_no_show", user_id=user_id),),
+            (self.button("🔙 Back", "mark_no_show"),),  # Back to list members for no-show
+        ))
 
 # Your user ID (provided by you)
 bot_owner_id = 122542800
 
+# Number of players in a game unless the admin sets another capacity
+default_capacity = 20
+
+# Rating (1-10) of players no admin has rated yet, until the chat has ratings to average
+default_rating = 5.0
+
+# Repeated taps of the same button by the same user within this many seconds count as one
+click_window = 1.0
+
+# Voting closes this long before kickoff (rule 8), and players are reminded this long before that
+close_before_kickoff = timedelta(hours=1)
+reminder_before_close = timedelta(hours=2)
+
+# Roster messages are edited at most once per this many seconds, however many votes arrive
+render_window = 1.0
+
+# Whether members get a message when their ban runs out
+notify_on_unban = True
+
+# Updates handled at the same time (updates from one chat always run one after another)
+max_concurrent_updates = 64
+
+# Local port for the Prometheus /metrics endpoint (None to turn it off)
+metrics_port = None
+
+# Only every n-th handler and API call is timed; raise this on very busy bots
+latency_sample_every = 1
+
+# Public HTTPS URL Telegram should post updates to (None keeps long polling)
+webhook_url = None
+
+# Address and port the webhook server listens on, behind the proxy that terminates TLS
+webhook_listen = "0.0.0.0"
+webhook_port = 8080
+
+# Secret Telegram sends back with every webhook request (1-256 characters: A-Z, a-z, 0-9, _ and -)
+webhook_secret = None
+
+# Updates allowed to wait for a handler before Telegram is asked to retry later
+webhook_queue_size = 1000
+
+# Where votes and bans are kept between restarts
+journal_path = "socialsoccerbot.db"
+
+# Where the attendance history of past games is kept
+history_path = "socialsoccerbot_history"
+
+# Directory to record anonymized traces of incoming updates into, for benchmarks/replay.py (None
+# turns recording off). Every start of the bot writes a new trace file.
+trace_directory = None
+
+# Exports are built in memory up to this many bytes and spill over to a temporary file beyond
+export_spool_size = 1 << 20
+
+# Kinds and formats of /export
+export_kinds = ("report", "history")
+export_formats = ("csv", "json")
+
+# Dropping out this close to kickoff counts as a late cancel
+late_cancel_window = timedelta(hours=24)
+
+# Promote the most reliable waitlisted player instead of the first in line (rule 7 says first in line)
+waitlist_by_reliability = False
+
+# Games a member must have played or skipped before their reliability may double a no-show ban
+min_games_for_longer_bans = 5
+
+# Button actions, in code order. The code of an action is its position in this list, so new
+# actions must be appended at the end to keep buttons already posted in chats working.
+callback_actions = (
+    "agree_terms", "confirm_attendance", "cancel_attendance", "change_vote", "admin_actions",
+    "create_event", "edit_event", "approve_event", "close_voting", "ban_member", "select_ban",
+    "confirm_ban", "custom_ban", "unban_member", "select_unban", "confirm_unban", "mark_no_show",
+    "select_no_show", "confirm_no_show", "next_page_ban", "exit_admin_actions", "generate_report",
+    "prev_page_ban", "make_teams", "export_report", "show_terms", "update_event",
+)
+action_codes = {action: code for code, action in enumerate(callback_actions)}
+callback_fields = ("event_id", "user_id", "page", "days")
+callback_version = 1
+
+CallbackData = namedtuple("CallbackData", ("action",) + callback_fields, defaults=(0, 0, 0, 0))
+
+# Function to pack a button action into callback_data: a version byte, the action code and two
+# bytes holding the byte length of each field (a nibble each, 0 when the field is absent),
+# followed by the fields themselves, all in URL-safe base64. The largest possible payload (four
+# 64-bit ids) is 36 bytes, 48 characters once encoded, well under Telegram's 64-byte limit.
+@lru_cache(maxsize=4096)
+def encode_callback(action, event_id=0, user_id=0, page=0, days=0):
+    values = [value.to_bytes((value.bit_length() + 7) // 8, "big") for value in (event_id, user_id, page, days)]
+    header = bytes((
+        callback_version,
+        action_codes[action],
+        len(values[0]) << 4 | len(values[1]),
+        len(values[2]) << 4 | len(values[3]),
+    ))
+    return base64.urlsafe_b64encode(header + b"".join(values)).rstrip(b"=").decode()
+
+# Function to unpack callback_data made by encode_callback; raises ValueError for anything else
+@lru_cache(maxsize=4096)
+def decode_callback(data):
+    try:
+        packed = binascii.a2b_base64(data.replace("-", "+").replace("_", "/") + "=" * (-len(data) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Unknown callback data {data!r}") from e
+    if len(packed) < 4 or packed[0] != callback_version or packed[1] >= len(callback_actions):
+        raise ValueError(f"Unknown callback data {data!r}")
+    user_at = 4 + (packed[2] >> 4)
+    page_at = user_at + (packed[2] & 0x0F)
+    days_at = page_at + (packed[3] >> 4)
+    if days_at + (packed[3] & 0x0F) != len(packed):
+        raise ValueError(f"Malformed callback data {data!r}")
+    return CallbackData(
+        callback_actions[packed[1]],
+        int.from_bytes(packed[4:user_at], "big"),
+        int.from_bytes(packed[user_at:page_at], "big"),
+        int.from_bytes(packed[page_at:days_at], "big"),
+        int.from_bytes(packed[days_at:], "big"),
+    )
+
+# Initialize variables
+events = EventRegistry()
+bans = BanRegistry()
+journal = None
+history = None
+recorder = None
+reliability_cache = {}  # chat_id -> (history version, {user_id: reliability})
+job_queue = None
+admin_cache = AdminCache(ttl=600)
+roster_renderer = RosterRenderer(window=render_window)
+report_pages = ReportPages()
+metrics = Metrics()
+deduplicator = UpdateDeduplicator(capacity=4096, window=click_window)
+timers = TimerWheel(tick=1.0, slots=3600)  # Reminders and vote closing of every event
+send_limiter = TokenBucket(rate=25, capacity=5)  # Shared by every broadcast, a little under Telegram's global limit
+broadcaster = None  # Broadcaster of the bot, created on the first broadcast
+directories = {}  # chat_id -> MemberDirectory
+ratings = {}  # chat_id -> {user_id: rating}
+terms_accepted = set()  # Members who agreed to the current rules
+terms_posted = set()  # (chat_id, event_id, language) of rules posted in a group for members the bot can't message
+
 # Group rules
 terms_and_conditions = (
     """1. No slide tackle.\n
@@ -43,6 +1874,542 @@ terms_and_conditions = (
     9. اگر کسی رأی 'بله' بدهد و در بازی حاضر نشود، ادمین‌ها او را به عنوان غایب علامت‌گذاری کرده و به صورت موقت یا دائمی او را ممنوع می‌کنند."""
 )
 
+# Version of the rules: members agree again when the rules change
+terms_version = hashlib.sha256(terms_and_conditions.encode()).hexdigest()[:12]
+
+ui = UIRegistry(terms_and_conditions)
+
+# Function to find the event a button belongs to: the event id in the callback data, or the chat's newest event
+def event_from_query(query):
+    chat_id = query.message.chat_id
+    event_id = decode_callback(query.data).event_id
+    if event_id:
+        return events.get(chat_id, event_id)
+    return events.latest(chat_id)
+
+# Function to record a vote in the event's roster and the journal, returns the promoted players
+def cast_vote(event, user_id, user_name, going):
+    at = time.time()
+    priority = reliability_of(event.chat_id, user_id) if going and waitlist_by_reliability else None
+    journal.record("vote", chat_id=event.chat_id, event_id=event.event_id, user_id=user_id, name=user_name, going=going, at=at, priority=priority)
+    note_vote_timing(event, user_id, going, at)
+    promoted = event.roster.vote(user_id, user_name, going, priority)
+    for next_user_id, _ in promoted:
+        journal.record("promote", chat_id=event.chat_id, event_id=event.event_id, user_id=next_user_id)
+    return promoted
+
+# Function to note when a player first said Yes, and whether a No drops them out late (called
+# before the vote is applied)
+def note_vote_timing(event, user_id, going, at):
+    if going:
+        event.voted_at.setdefault(user_id, at)
+        event.late_cancels.discard(user_id)
+    elif user_id in event.roster.confirmed:
+        kickoff = event.kickoff_at or event.close_at
+        if kickoff is not None and kickoff.timestamp() - at < late_cancel_window.total_seconds():
+            event.late_cancels.add(user_id)
+
+# Function to drop a confirmed player from the event and the journal, returns the promoted players
+def remove_player(event, user_id, status="no_show"):
+    journal.record("remove", chat_id=event.chat_id, event_id=event.event_id, user_id=user_id, status=status)
+    promoted = event.roster.remove(user_id, status, promote=not event.closed)
+    if status == "no_show" and history is not None:
+        history.append(time.time(), event.chat_id, event.event_id, [user_id], ["no_show"], [np.nan])
+    for next_user_id, _ in promoted:
+        journal.record("promote", chat_id=event.chat_id, event_id=event.event_id, user_id=next_user_id)
+    return promoted
+
+# Function to get the member directory of a chat
+def directory_of(chat_id):
+    directory = directories.get(chat_id)
+    if directory is None:
+        directory = directories[chat_id] = MemberDirectory()
+    return directory
+
+# Function to remember a member seen in a chat (or a new name) and record it in the journal
+def observe_member(chat_id, user_id, name):
+    if directory_of(chat_id).add(user_id, name):
+        journal.record("member", chat_id=chat_id, user_id=user_id, name=name)
+
+# Function to forget a member who left a chat and record it in the journal
+def forget_member(chat_id, user_id):
+    if directory_of(chat_id).remove(user_id):
+        journal.record("member_left", chat_id=chat_id, user_id=user_id)
+
+# Function to get the ban scope used by a chat's admin menu
+def ban_scope_of(chat_id):
+    event = events.latest(chat_id)
+    return event.ban_scope if event else chat_id
+
+# Function to ban a member within a ban scope until the given time and record it in the journal
+def ban_member(scope, user_id, user_name, ban_until):
+    journal.record("ban", scope=scope, user_id=user_id, name=user_name, until=ban_until.isoformat())
+    bans.ban(scope, user_id, user_name, ban_until)
+    schedule_ban_expiry()
+
+# Function to lift a ban and record it in the journal
+def unban_member(scope, user_id):
+    journal.record("unban", scope=scope, user_id=user_id)
+    return bans.unban(scope, user_id)
+
+# Function to keep exactly one job queued, for the moment the next ban runs out
+def schedule_ban_expiry():
+    if job_queue is None:
+        return
+    next_expiry = bans.next_expiry()
+    current = job_queue.get_jobs_by_name("ban_expiry")
+    if current and next_expiry is not None and current[0].data == next_expiry:
+        return
+    for job in current:
+        job.schedule_removal()
+    if next_expiry is not None:
+        delay = max(0.0, (next_expiry - datetime.now()).total_seconds())
+        job_queue.run_once(expire_bans, delay, data=next_expiry, name="ban_expiry")
+
+# Function run by the job queue when bans run out: lifts them, tells the members and re-arms
+async def expire_bans(context: ContextTypes.DEFAULT_TYPE) -> None:
+    expired = bans.expire()
+    for scope, user_id, user_name in expired:
+        journal.record("unban", scope=scope, user_id=user_id)
+        logger.info(f"Ban of {user_name} ({user_id}) in {scope} has expired")
+    if notify_on_unban and expired:
+        await broadcast(context.bot, "ban_expired", [user_id for _, user_id, _ in expired], "Your ban has ended. You're welcome to vote for the next game again!")
+    schedule_ban_expiry()
+
+# Function to open a new event for a chat and record it in the journal
+def create_chat_event(chat_id, content, capacity=None):
+    event = events.create(chat_id, content, capacity=capacity or default_capacity)
+    journal.record("event", chat_id=chat_id, event_id=event.event_id, content=content, capacity=event.roster.capacity)
+    return event
+
+# Function to close voting for an event and record it in the journal
+def close_event(event):
+    journal.record("close", chat_id=event.chat_id, event_id=event.event_id)
+    event.closed = True
+    roster_renderer.release(event)
+    record_outcomes(event)
+    for kind in ("reminder", "close"):
+        timers.cancel((kind, *event.key))
+
+# Function to add the outcome of every player of a closed event to the attendance history
+def record_outcomes(event):
+    if history is None or not event.roster.attendance:
+        return
+    closed_at = time.time()
+    deadline = (event.kickoff_at or event.close_at).timestamp() if (event.kickoff_at or event.close_at) else closed_at
+    user_ids, outcomes, leads = [], [], []
+    for uid, status in event.roster.attendance.items():
+        if status == "confirmed":
+            outcome = "played"
+        elif status == "canceled":
+            outcome = "late_cancel" if uid in event.late_cancels else "canceled"
+        elif status in ("no_show", "waitlist"):
+            outcome = status
+        else:
+            continue
+        user_ids.append(uid)
+        outcomes.append(outcome)
+        leads.append((deadline - event.voted_at[uid]) / 3600 if uid in event.voted_at else np.nan)
+    history.append(closed_at, event.chat_id, event.event_id, user_ids, outcomes, leads)
+
+# Function to get the statistics of a chat's members, over the last `days` days if given
+def member_stats(chat_id, days=None):
+    since = time.time() - days * 86400 if days else None
+    return history.stats(chat_id, since)
+
+# Function to get a member's reliability (0-1); the chat's scores are recomputed only after the
+# history changed, so this is a dictionary lookup on the vote path
+def reliability_of(chat_id, user_id):
+    cached = reliability_cache.get(chat_id)
+    if cached is None or cached[0] != history.version:
+        stats = member_stats(chat_id)
+        cached = reliability_cache[chat_id] = (history.version, dict(zip(stats["user_id"].tolist(), stats["reliability"].tolist())))
+    return cached[1].get(user_id, 0.75)
+
+# Function to suggest how many weeks to ban a no-show for: a week per no-show in the current
+# streak, doubled for members who rarely turn up once they have enough games behind them
+def suggested_ban_weeks(chat_id, user_id):
+    stats = member_stats(chat_id)
+    slot = np.searchsorted(stats["user_id"], user_id)
+    if slot == len(stats["user_id"]) or stats["user_id"][slot] != user_id:
+        return 1, 1, 0.75
+    streak, reliability = int(stats["no_show_streak"][slot]), float(stats["reliability"][slot])
+    unreliable = reliability < 0.5 and int(stats["games"][slot]) >= min_games_for_longer_bans
+    weeks = max(1, streak) * (2 if unreliable else 1)
+    return weeks, streak, reliability
+
+# Function to stream the lines of a chat's participation report
+def report_lines(chat_id):
+    event = events.latest(chat_id)
+    roster = event.roster if event else Roster(default_capacity)
+    ban_list = bans.in_scope(ban_scope_of(chat_id))
+
+    yield "**Participation Report**"
+    for title, section, empty in (
+        ("Confirmed", roster.confirmed, "No confirmed participants."),
+        ("Waitlist", roster.waitlist, "No waitlisted participants."),
+    ):
+        yield ""
+        yield f"**{title} ({len(section)}):**"
+        if not section:
+            yield empty
+        for uid, name in section.items():
+            yield f"{uid} - {name}"
+    yield ""
+    yield "**No-Shows:**"
+    if not ban_list:
+        yield "No no-shows recorded."
+    for uid, (name, _) in ban_list.items():
+        yield f"{uid} - {name}"
+
+# Function to get what a chat's report pages depend on: the current event's roster and the bans
+def report_signature(chat_id):
+    event = events.latest(chat_id)
+    return (event.key, tuple(event.roster.revisions.values())) if event else None, bans.revision
+
+# Function to get an iterator over the rows of an export, header first (the detail of a player
+# is when they first voted Yes, of a banned member when the ban ends). The roster and ban
+# sections are copied now (they are small, and votes keep changing them while the file is
+# written in a worker thread); the history, which grows with every game, is streamed.
+def export_rows(chat_id, kind):
+    if kind == "history":
+        header = ("time", "event_id", "user_id", "outcome", "vote_lead_hours")
+        return chain((header,), history.rows(chat_id) if history is not None else ())
+
+    event = events.latest(chat_id)
+    roster = event.roster if event else Roster(default_capacity)
+    voted_at = event.voted_at if event else {}
+    sections = [
+        (name, [
+            (uid, user_name, datetime.fromtimestamp(voted_at[uid]).isoformat(timespec="seconds") if uid in voted_at else "")
+            for uid, user_name in getattr(roster, name).items()
+        ])
+        for name in ("confirmed", "waitlist", "declined")
+    ]
+    sections.append(("banned", [(uid, name, until.isoformat(timespec="minutes")) for uid, (name, until) in bans.in_scope(ban_scope_of(chat_id)).items()]))
+    header = ("section", "position", "user_id", "name", "detail")
+    return chain((header,), (
+        (name, position, uid, user_name, detail) for name, players in sections for position, (uid, user_name, detail) in enumerate(players, 1)
+    ))
+
+# Function to write rows as CSV into a binary file, one row at a time
+def write_csv(rows, output):
+    text = io.TextIOWrapper(output, encoding="utf-8", newline="")
+    csv.writer(text).writerows(rows)
+    text.flush()
+    text.detach()  # Leave the file open for sending
+
+# Function to write rows as a JSON array of objects keyed by the header, one row at a time
+def write_json(rows, output):
+    header = next(rows)
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    output.write(b"[")
+    for i, row in enumerate(rows):
+        output.write((",\n" if i else "\n").encode() + encode(dict(zip(header, row))).encode())
+    output.write(b"\n]\n")
+
+export_writers = {"csv": write_csv, "json": write_json}
+
+# Function to build an export in a worker thread and send it to the chat as a document
+async def send_export(bot, chat_id, kind, fmt):
+    with tempfile.SpooledTemporaryFile(max_size=export_spool_size) as output:
+        await asyncio.to_thread(export_writers[fmt], export_rows(chat_id, kind), output)
+        output.seek(0)
+        await bot.send_document(chat_id=chat_id, document=output, filename=f"{kind}-{datetime.now():%Y%m%d-%H%M}.{fmt}")
+    metrics.inc("exports_total", (("kind", kind), ("format", fmt)))
+
+# Function to set an event's kickoff, which also fixes when its voting closes
+def set_kickoff(event, kickoff_at):
+    close_at = kickoff_at - close_before_kickoff
+    journal.record("kickoff", chat_id=event.chat_id, event_id=event.event_id, kickoff_at=kickoff_at.isoformat(), close_at=close_at.isoformat())
+    event.kickoff_at = kickoff_at
+    event.close_at = close_at
+    schedule_event_timers(event)
+
+# Function to (re)arm the reminder and closing timers of an event from its kickoff
+def schedule_event_timers(event):
+    if event.closed or event.close_at is None:
+        return
+    timers.schedule(("close", *event.key), event.close_at)
+    remind_at = event.close_at - reminder_before_close
+    if remind_at > datetime.now():
+        timers.schedule(("reminder", *event.key), remind_at)
+    else:
+        timers.cancel(("reminder", *event.key))
+
+# Function to remind the confirmed players that the vote is about to close
+async def remind_before_close(bot, event):
+    if not event.voting_open():
+        return
+    await broadcast(
+        bot,
+        "close_reminder",
+        list(event.roster.confirmed),
+        f"Voting closes at {event.close_at.strftime('%H:%M')}. If you can't make it, change your vote now so the next person on the waitlist gets your spot."
+    )
+
+# Function to close the vote at its scheduled time; from here on nobody is promoted from the waitlist
+async def close_on_schedule(bot, event):
+    if event.closed:
+        return
+    close_event(event)
+    logger.info(f"Voting closed on schedule for event {event.event_id} in chat {event.chat_id}")
+    kickoff = event.kickoff_at.strftime('%Y-%m-%d %H:%M')
+    await broadcast(bot, "scheduled_close", list(event.roster.confirmed), f"Voting is closed. You're in the game, see you at {kickoff}!")
+    await broadcast(bot, "waitlist_cutoff", list(event.roster.waitlist), "Voting is closed and no spot opened up for you this time. See you at the next game!")
+
+timer_actions = {"reminder": remind_before_close, "close": close_on_schedule}
+
+# Function run every tick by the job queue: fires the event timers that are due
+async def run_due_timers(context: ContextTypes.DEFAULT_TYPE) -> None:
+    for kind, chat_id, event_id in timers.advance(time.time()):
+        event = events.get(chat_id, event_id)
+        if event is None:
+            continue
+        try:
+            await timer_actions[kind](context.bot, event)
+        except Exception as e:
+            logger.error(f"Error running {kind} timer of event {event_id} in chat {chat_id}: {e}")
+
+# Function to change how many players an open event takes, returns the promoted players
+def set_capacity(event, capacity):
+    journal.record("capacity", chat_id=event.chat_id, event_id=event.event_id, capacity=capacity)
+    event.roster.capacity = capacity
+    return [] if event.closed else event.roster.promote()
+
+# Function to rate how well a member plays (1-10) and record it in the journal
+def rate_player(chat_id, user_id, rating):
+    journal.record("rating", chat_id=chat_id, user_id=user_id, rating=rating)
+    ratings.setdefault(chat_id, {})[user_id] = rating
+
+# Function to remember that a member agreed to the current rules, returns False if they already had
+def accept_terms(user_id):
+    if user_id in terms_accepted:
+        return False
+    journal.record("terms", user_id=user_id, version=terms_version)
+    terms_accepted.add(user_id)
+    return True
+
+# Function to set which players must play together and record it in the journal
+def set_together(event, groups):
+    journal.record("together", chat_id=event.chat_id, event_id=event.event_id, groups=groups)
+    event.together = groups
+
+# Function to change the details of an event and record it in the journal
+def set_event_content(event, content):
+    journal.record("content", chat_id=event.chat_id, event_id=event.event_id, content=content)
+    event.content = content
+
+# Function to set the captains of an event and record it in the journal
+def set_captains(event, user_ids):
+    journal.record("captains", chat_id=event.chat_id, event_id=event.event_id, user_ids=user_ids)
+    event.captains = user_ids
+
+# Function to count the games each member of a chat actually played (confirmed in a closed event)
+def games_played(chat_id):
+    played = {}
+    for event_id in range(1, events.latest_ids.get(chat_id, 0) + 1):
+        event = events.get(chat_id, event_id)
+        if event is None or not event.closed:
+            continue
+        for uid, status in event.roster.attendance.items():
+            if status == "confirmed":
+                played[uid] = played.get(uid, 0) + 1
+    return played
+
+# Function to get the strength of every confirmed player: their rating, pulled toward the chat's
+# average while they have played few games here (unrated players count as average)
+def team_strengths(event):
+    chat_ratings = ratings.get(event.chat_id, {})
+    average = sum(chat_ratings.values()) / len(chat_ratings) if chat_ratings else default_rating
+    played = games_played(event.chat_id)
+    strengths = {}
+    for uid in event.roster.confirmed:
+        games = played.get(uid, 0)
+        strengths[uid] = average + (chat_ratings.get(uid, average) - average) * (games + 1) / (games + 2)
+    return strengths
+
+# Function to split an event's confirmed players into teams and describe them
+def teams_text(event, count):
+    strengths = team_strengths(event)
+    started = time.perf_counter()
+    teams = balance_teams(strengths, count, together=event.together, apart=event.captains)
+    metrics.observe("team_split_seconds", time.perf_counter() - started)
+    sections = []
+    for number, team in enumerate(teams, 1):
+        names = "\n".join(f"{event.roster.confirmed[uid]}{' (C)' if uid in event.captains else ''}" for uid in team)
+        sections.append(f"**Team {number}** ({len(team)} players, strength {sum(strengths[uid] for uid in team):.1f}):\n{names}")
+    return "\n\n".join(sections)
+
+# Function to find the member a name refers to, among (user_id, name) candidates; an exact
+# name wins over names that only start with it
+def resolve_member(text, candidates):
+    query = normalize_name(text)
+    matches = [(uid, name) for uid, name in candidates if normalize_name(name).startswith(query)]
+    exact = [(uid, name) for uid, name in matches if normalize_name(name) == query]
+    return exact if len(exact) == 1 else matches
+
+# Function to capture one event for a journal snapshot
+def event_state(event):
+    return {
+        "chat_id": event.chat_id,
+        "event_id": event.event_id,
+        "content": event.content,
+        "capacity": event.roster.capacity,
+        "kickoff_at": event.kickoff_at.isoformat() if event.kickoff_at else None,
+        "close_at": event.close_at.isoformat() if event.close_at else None,
+        "closed": event.closed,
+        "ban_scope": event.ban_scope,
+        "confirmed": list(event.roster.confirmed.items()),
+        "waitlist": list(event.roster.waitlist.items()),
+        "declined": list(event.roster.declined.items()),
+        "attendance": list(event.roster.attendance.items()),
+        "together": event.together,
+        "captains": event.captains,
+        "priority": list(event.roster.priority.items()),
+        "voted_at": list(event.voted_at.items()),
+        "late_cancels": list(event.late_cancels),
+    }
+
+# Function to rebuild one event from a journal snapshot
+def event_from_state(state):
+    event = Event(state["chat_id"], state["event_id"], state["content"], capacity=state["capacity"], ban_scope=state["ban_scope"])
+    event.kickoff_at = datetime.fromisoformat(state["kickoff_at"]) if state.get("kickoff_at") else None
+    event.close_at = datetime.fromisoformat(state["close_at"]) if state["close_at"] else None
+    event.closed = state["closed"]
+    event.roster.confirmed = dict(state["confirmed"])
+    event.roster.waitlist = OrderedDict(state["waitlist"])
+    event.roster.declined = dict(state["declined"])
+    event.roster.attendance = dict(state["attendance"])
+    event.together = state.get("together", [])
+    event.captains = state.get("captains", [])
+    priority = dict(state.get("priority", []))
+    for user_id in event.roster.waitlist:
+        if user_id in priority:
+            event.roster.rank(user_id, priority[user_id])
+    event.voted_at = dict(state.get("voted_at", []))
+    event.late_cancels = set(state.get("late_cancels", []))
+    return event
+
+# Function to capture the whole state for a journal snapshot
+def snapshot_state():
+    return {
+        "events": [event_state(event) for event in events.events.values()],
+        "bans": [(scope, uid, name, until.isoformat()) for scope, scope_bans in bans.scopes.items() for uid, (name, until) in scope_bans.items()],
+        "members": [(chat_id, uid, name) for chat_id, directory in directories.items() for uid, name in directory.names.items()],
+        "ratings": [(chat_id, uid, rating) for chat_id, chat_ratings in ratings.items() for uid, rating in chat_ratings.items()],
+        "terms": {"version": terms_version, "accepted": sorted(terms_accepted)},
+    }
+
+# Function to replay one journal entry onto the in-memory state
+def apply_journal_entry(op, payload):
+    if op == "event":
+        events.add(Event(payload["chat_id"], payload["event_id"], payload["content"], capacity=payload["capacity"]))
+    elif op == "ban":
+        bans.ban(payload["scope"], payload["user_id"], payload["name"], datetime.fromisoformat(payload["until"]))
+    elif op == "unban":
+        bans.unban(payload["scope"], payload["user_id"])
+    elif op == "member":
+        directory_of(payload["chat_id"]).add(payload["user_id"], payload["name"])
+    elif op == "member_left":
+        directory_of(payload["chat_id"]).remove(payload["user_id"])
+    elif op == "rating":
+        ratings.setdefault(payload["chat_id"], {})[payload["user_id"]] = payload["rating"]
+    elif op == "terms":
+        if payload["version"] == terms_version:
+            terms_accepted.add(payload["user_id"])
+    else:
+        event = events.get(payload["chat_id"], payload["event_id"])
+        if event is None:
+            return
+        if op == "vote":
+            if "at" in payload:
+                note_vote_timing(event, payload["user_id"], payload["going"], payload["at"])
+            event.roster.vote(payload["user_id"], payload["name"], payload["going"], payload.get("priority"))
+        elif op == "remove":
+            event.roster.remove(payload["user_id"], payload["status"], promote=not event.closed)
+        elif op == "close":
+            event.closed = True
+        elif op == "together":
+            event.together = payload["groups"]
+        elif op == "captains":
+            event.captains = payload["user_ids"]
+        elif op == "content":
+            event.content = payload["content"]
+        elif op == "kickoff":
+            event.kickoff_at = datetime.fromisoformat(payload["kickoff_at"])
+            event.close_at = datetime.fromisoformat(payload["close_at"])
+        elif op == "capacity":
+            event.roster.capacity = payload["capacity"]
+            if not event.closed:
+                event.roster.promote()
+        # "promote" entries are informational: replaying the votes promotes the same players
+
+# Function to rebuild the in-memory state from the last snapshot and the journal
+def restore_state():
+    state, entries = journal.load()
+    if state:
+        for item in state["events"]:
+            events.add(event_from_state(item))
+        for scope, uid, name, until in state["bans"]:
+            bans.ban(scope, uid, name, datetime.fromisoformat(until))
+        members = {}
+        for chat_id, uid, name in state.get("members", []):
+            members.setdefault(chat_id, []).append((uid, name))
+        for chat_id, chat_members in members.items():
+            directory_of(chat_id).load(chat_members)
+        for chat_id, uid, rating in state.get("ratings", []):
+            ratings.setdefault(chat_id, {})[uid] = rating
+        terms = state.get("terms", {})
+        if terms.get("version") == terms_version:
+            terms_accepted.update(terms["accepted"])
+    for op, payload in entries:
+        apply_journal_entry(op, payload)
+    logger.info(f"Restored {len(events.events)} events and {len(bans)} bans ({len(entries)} journal entries replayed)")
+
+# Function to periodically fold the journal into a snapshot
+async def compact_journal(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await journal.compact(snapshot_state)
+
+# Function to open the journal and restore state before the bot starts polling
+async def post_init(application: Application) -> None:
+    global journal, history, job_queue, recorder
+    journal = Journal(journal_path)
+    history = AttendanceHistory(history_path)
+    if trace_directory is not None:
+        os.makedirs(trace_directory, exist_ok=True)
+        recorder = UpdateRecorder(os.path.join(trace_directory, f"updates-{datetime.now():%Y%m%d-%H%M%S}.jsonl.gz"), owner_id=bot_owner_id)
+        admin_cache.on_fetch = recorder.record_admins
+    job_queue = application.job_queue
+    restore_state()
+    schedule_ban_expiry()  # Bans that ran out while the bot was down are lifted right away
+    for event in events.events.values():
+        schedule_event_timers(event)  # Votes that should have closed meanwhile close on the first tick
+    application.job_queue.run_repeating(run_due_timers, interval=timers.tick, first=timers.tick)
+    application.job_queue.run_repeating(compact_journal, interval=600, first=600)
+    register_gauges(application)
+    if metrics_port is not None:
+        await metrics.serve("127.0.0.1", metrics_port)
+        logger.info(f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
+
+# Function to send the roster edits still waiting in the render window before the bot stops
+async def post_stop(application: Application) -> None:
+    await roster_renderer.drain(application.bot)
+
+# Function to write out everything pending before the bot exits
+async def post_shutdown(application: Application) -> None:
+    await journal.compact(snapshot_state)
+    journal.close()
+    if recorder is not None:
+        recorder.close()
+
+# Function to send one message to many members through the shared rate limiter
+async def broadcast(bot, name, chat_ids, text, **kwargs):
+    global broadcaster
+    if broadcaster is None or broadcaster.bot is not bot:
+        broadcaster = Broadcaster(bot, send_limiter)
+    return await broadcaster.run(name, chat_ids, text, **kwargs)
+
 # Function to check if the user is a group admin or the bot owner
 async def is_group_admin_or_owner(update: Update) -> bool:
     user_id = update.effective_user.id
@@ -50,22 +2417,49 @@ async def is_group_admin_or_owner(update: Update) -> bool:
 
     # Check if the user is the bot owner
     if user_id == bot_owner_id:
-        logger.info(f"User {user_id} is the bot owner.")
         return True
 
-    # Check if the user is the chat owner or an admin
+    # Check if the user is the chat owner or an admin (served from the admin cache)
     try:
-        member = await chat.get_member(user_id)
-        if member.status in ['administrator', 'creator']:
-            logger.info(f"User {user_id} is an admin or the creator.")
-            return True
-        else:
-            logger.info(f"User {user_id} is neither admin nor creator.")
-            return False
+        is_admin = await admin_cache.is_admin(chat, user_id)
+        logger.debug(f"User {user_id} admin check in chat {chat.id}: {is_admin}")
+        return is_admin
     except Exception as e:
         logger.error(f"Error checking admin status: {e}")
         return False
 
+# Function to keep the admin cache and member directory current when someone joins, leaves,
+# is promoted or is demoted
+async def track_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    change = update.chat_member
+    member = change.new_chat_member
+    admin_cache.apply_member_update(change.chat.id, member.user.id, member.status)
+    if member.status in ("left", "kicked"):
+        forget_member(change.chat.id, member.user.id)
+    elif not member.user.is_bot:
+        observe_member(change.chat.id, member.user.id, member.user.full_name)
+
+# Function to add everyone who writes or presses a button in a group to its member directory
+async def track_members_seen(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat, user = update.effective_chat, update.effective_user
+    if chat is not None and user is not None and chat.type in ("group", "supergroup") and not user.is_bot:
+        observe_member(chat.id, user.id, user.full_name)
+
+# Function run before every other handler to add the update to the trace (only registered when recording)
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    recorder.record(update.to_dict())
+
+# Function run before every other handler to stop duplicate updates and repeated taps; a repeated
+# tap is still answered at once so the button stops spinning
+async def drop_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    reason = deduplicator.check(update)
+    if reason is None:
+        return
+    metrics.inc("suppressed_updates_total", (("reason", reason),))
+    if reason == "click":
+        await update.callback_query.answer()
+    raise ApplicationHandlerStop
+
 # Function to start the bot and send the welcome message with admin buttons
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await is_group_admin_or_owner(update):
@@ -73,39 +2467,56 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     
     logger.info("Start command received")
-    welcome_message = (
-        "Welcome to our Saturday Social Soccer program! Please respect the group rules and others "
-        "as we aim to have a friendly but competitive game. Please confirm you have read and agree to the following rules:"
-    )
-    welcome_message += terms_and_conditions
+    user = update.effective_user
+    language = ui.language_of(user)
 
-    # Add terms confirmation button
-    keyboard = [[InlineKeyboardButton("I Agree", callback_data="agree_terms")]]
-    
-    # Admin buttons (visible to group admins, owners, and the bot owner)
-    keyboard.append([InlineKeyboardButton("🔨 Admin Actions", callback_data="admin_actions")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+    # Members who already agreed to the rules skip them
+    if user.id in terms_accepted:
+        await update.message.reply_text(ui.text(language, "welcome_back"), reply_markup=ui.admin_entry)
+        return
+    await update.message.reply_text(ui.welcome[language], reply_markup=ui.start_menu)
 
-# Function to handle the agreement to terms
+# Function to handle the agreement to terms. A member's first agreement comes with the rules in
+# their language; members who agreed to the current rules before go straight to the vote.
 async def agree_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    await query.answer()
-    
+    first_time = accept_terms(query.from_user.id)
+    # The /start welcome, whose button carries no event id, already shows the rules
+    shown = not decode_callback(query.data).event_id
+    await query.answer(await send_terms(context.bot, query) if first_time and not shown else None)
+
+    event = event_from_query(query)
+    if event is None:
+        await query.edit_message_text("No event found. Please ask an admin to create an event first.")
+        return
+
     # Send the attendance confirmation buttons
-    keyboard = [
-        [InlineKeyboardButton("👍 Yes, I'll be there", callback_data="confirm_attendance")],
-        [InlineKeyboardButton("🚫 No, I can't make it", callback_data="cancel_attendance")],
-        [InlineKeyboardButton("🔄 Change Vote", callback_data="change_vote")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
-        text="Thank you for agreeing to the terms. Please confirm or change your attendance:",
-        reply_markup=reply_markup
+        text="Thank you for agreeing to the terms. Please confirm or change your attendance:" if first_time else "Please confirm or change your attendance:",
+        reply_markup=ui.vote_menu(event.event_id)
     )
+    roster_renderer.forget(query.message.chat_id, query.message.message_id)
+
+# Function to send the group rules to the member who pressed a button, in their language: in a
+# private message when the member has started a chat with the bot, otherwise posted in the group
+# once per game and language. Returns the text to answer the button with.
+async def send_terms(bot, query):
+    language = ui.language_of(query.from_user)
+    try:
+        await bot.send_message(chat_id=query.from_user.id, text=ui.terms_message[language])
+        return ui.text(language, "rules_sent")
+    except (Forbidden, BadRequest):
+        posted = (query.message.chat_id, decode_callback(query.data).event_id, language)
+        if posted in terms_posted:
+            return ui.text(language, "rules_above")
+        terms_posted.add(posted)
+        await query.message.reply_text(ui.terms_message[language])
+        return None
+
+# Function to show the group rules to one member again (📜 Rules)
+async def show_terms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer(await send_terms(context.bot, query))
 
 # Function to handle attendance confirmation and changes
 async def handle_attendance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -113,72 +2524,42 @@ async def handle_attendance(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user = query.from_user
     user_id = user.id
     user_name = user.first_name  # Using first name for simplicity
+    action = decode_callback(query.data).action
 
-    # Remove user from any list if they are already there
-    if (user_id, user_name) in yes_votes:
-        yes_votes.remove((user_id, user_name))
-    if (user_id, user_name) in no_votes:
-        no_votes.remove((user_id, user_name))
-    if (user_id, user_name) in waitlist:
-        waitlist.remove((user_id, user_name))
+    event = event_from_query(query)
+    if event is None:
+        await query.answer("This event no longer exists.")
+        return
 
     # Handle vote based on button clicked
-    if query.data == "confirm_attendance":
-        if len(yes_votes) < 20:
-            yes_votes.append((user_id, user_name))
-            attendance[user_id] = "confirmed"
-        else:
-            waitlist.append((user_id, user_name))
-            attendance[user_id] = "waitlist"
-    elif query.data == "cancel_attendance":
-        no_votes.append((user_id, user_name))
-        attendance[user_id] = "canceled"
-    elif query.data == "change_vote":
+    if action == "change_vote":
         # Allow the user to change their vote
-        keyboard = [
-            [InlineKeyboardButton("👍 Yes, I'll be there", callback_data="confirm_attendance")],
-            [InlineKeyboardButton("🚫 No, I can't make it", callback_data="cancel_attendance")],
-            [InlineKeyboardButton("🔙 Back", callback_data="admin_actions")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.answer()
         await query.edit_message_text(
             text="You can change your vote below:",
-            reply_markup=reply_markup
+            reply_markup=ui.change_vote_menu(event.event_id)
         )
+        roster_renderer.forget(query.message.chat_id, query.message.message_id)
         return
 
-    # Move the first person from the waitlist to the main list if needed
-    if len(yes_votes) < 20 and waitlist:
-        next_user_id, next_user_name = waitlist.pop(0)
-        yes_votes.append((next_user_id, next_user_name))
-        attendance[next_user_id] = "confirmed"
-        await context.bot.send_message(chat_id=next_user_id, text="A spot opened up for you. You're now confirmed!")
+    if not event.voting_open():
+        await query.answer("Voting for this game is closed.")
+        return
+    if action == "confirm_attendance" and bans.is_banned(event.ban_scope, user_id):
+        _, ban_until = bans.get(event.ban_scope, user_id)
+        await query.answer(f"You are banned until {ban_until.strftime('%Y-%m-%d')} and can't join this game.", show_alert=True)
+        return
 
-    # Prepare the message to display current attendance status
-    confirmed_list = "\n".join([f"{uid} - {name}" for uid, name in yes_votes])
-    waitlist_list = "\n".join([f"{uid} - {name}" for uid, name in waitlist])
-    no_list = "\n".join([f"{uid} - {name}" for uid, name in no_votes])
+    promoted = cast_vote(event, user_id, user_name, going=action == "confirm_attendance")
+    await query.answer()
 
-    # Create the updated text
-    new_text = (
-        f"**Total Confirmed ({len(yes_votes)}):**\n{confirmed_list}\n\n"
-        f"**Total Waitlist ({len(waitlist)}):**\n{waitlist_list}\n\n"
-        f"**Total No ({len(no_votes)}):**\n{no_list}"
-    )
+    # Show the updated lists with an option to change the vote; the edit is coalesced with
+    # the other votes arriving within the render window
+    roster_renderer.mark_dirty(context.bot, event, query.message.chat_id, query.message.message_id, ui.after_vote_menu(event.event_id))
 
-    # Check if the new text is different before attempting to edit
-    if query.message.text != new_text:
-        # Show the updated lists with an option to change the vote
-        keyboard = [
-            [InlineKeyboardButton("🔄 Change Vote", callback_data="change_vote")],
-            [InlineKeyboardButton("🔙 Back", callback_data="admin_actions")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            text=new_text,
-            reply_markup=reply_markup
-        )
+    # Let anyone moved up from the waitlist know they are now in the game
+    if promoted:
+        await broadcast(context.bot, "promoted", [next_user_id for next_user_id, _ in promoted], "A spot opened up for you. You're now confirmed!")
 
 # Admin actions menu
 async def admin_actions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -186,21 +2567,10 @@ async def admin_actions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     await query.answer()
 
     # Log for debugging
-    logger.info(f"Admin actions button clicked by user {query.from_user.id}")
+    logger.debug(f"Admin actions button clicked by user {query.from_user.id}")
 
     # Admin actions available
-    keyboard = [
-        [InlineKeyboardButton("➕ Create Event", callback_data="create_event")],
-        [InlineKeyboardButton("🔨 Ban a Member", callback_data="ban_member")],
-        [InlineKeyboardButton("🚫 Unban a Member", callback_data="unban_member")],
-        [InlineKeyboardButton("📋 Generate Report", callback_data="generate_report")],
-        [InlineKeyboardButton("🚫 Mark No-Show", callback_data="mark_no_show")],
-        [InlineKeyboardButton("❌ Close Voting", callback_data="close_voting")],
-        [InlineKeyboardButton("❌ Exit Admin Actions", callback_data="exit_admin_actions")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text("Select an admin action:", reply_markup=reply_markup)
+    await query.edit_message_text("Select an admin action:", reply_markup=ui.admin_menu)
 
 # Function to handle event creation
 async def create_event(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -209,6 +2579,21 @@ async def create_event(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     
     await query.edit_message_text("Please type the event details you'd like to create.")
     context.user_data['creating_event'] = True
+    context.user_data.pop('updating_event', None)
+
+# Function to start editing the details of the chat's open event; its confirmed players are told
+# about the change once the new details are approved
+async def update_event(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    event = events.latest(query.message.chat_id)
+    if event is None or event.closed:
+        await query.edit_message_text("No open event to edit. Please create an event first.", reply_markup=ui.back_to_admin)
+        return
+    await query.edit_message_text("Please send the updated event details.")
+    context.user_data['creating_event'] = True
+    context.user_data['updating_event'] = event.event_id
 
 # Function to handle the event message
 async def handle_event_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -217,16 +2602,10 @@ async def handle_event_message(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data['event_content'] = update.message.text
         context.user_data['creating_event'] = False
         
-        keyboard = [
-            [InlineKeyboardButton("Edit Event", callback_data="edit_event")],
-            [InlineKeyboardButton("Approve Event", callback_data="approve_event")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text("Here's the event you've prepared:")
-        await update.message.reply_text(context.user_data['event_content'], reply_markup=reply_markup)
+        await update.message.reply_text(context.user_data['event_content'], reply_markup=ui.event_draft)
     else:
-        logger.info("Event creation was not started, ignoring message")
+        logger.debug("Event creation was not started, ignoring message")
 
 # Function to edit the event message
 async def edit_event(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -242,13 +2621,20 @@ async def approve_event(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     await query.answer()
 
     event_content = context.user_data.get('event_content')
-    if event_content:
-        logger.info("Event approved. Asking members to agree to T&Cs.")
-        keyboard = [[InlineKeyboardButton("I Agree", callback_data="agree_terms")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    updating = events.get(query.message.chat_id, context.user_data.pop('updating_event', 0))
+    if event_content and updating is not None and not updating.closed:
+        set_event_content(updating, event_content)
+        logger.info(f"Event {updating.event_id} updated in chat {updating.chat_id}. Notifying the confirmed players.")
+        report = await notify_last_minute_changes(context.bot, updating)
+        await query.edit_message_text(
+            f"The event has been updated. Notified {len(report.delivered)} confirmed players ({len(report.failed)} could not be reached)."
+        )
+    elif event_content:
+        event = create_chat_event(query.message.chat_id, event_content)
+        logger.info(f"Event {event.event_id} approved in chat {event.chat_id}. Asking members to agree to T&Cs.")
 
-        await query.message.reply_text("Please agree to the terms and conditions to participate:")
-        await query.message.reply_text(f"Terms & Conditions: \n{terms_and_conditions}", reply_markup=reply_markup)
+        # The rules themselves go to each member in their language, with their first I Agree or on 📜 Rules
+        await query.message.reply_text(ui.event_prompt, reply_markup=ui.terms_prompt(event.event_id))
     else:
         logger.info("No event content found to approve")
         await query.edit_message_text("No event content found. Please create an event first.")
@@ -258,64 +2644,127 @@ async def close_voting(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     query = update.callback_query
     await query.answer()
 
+    event = events.latest(query.message.chat_id)
+    if event is None:
+        await query.edit_message_text("No event found. Please create an event first.")
+        return
+    if event.closed:
+        await query.edit_message_text("Voting is already closed.")
+        return
+
     # Prevent further changes to the voting
-    for user_id in yes_votes:
-        await context.bot.send_message(chat_id=user_id, text="Voting has been closed by an admin. Thank you for participating!")
-    
-    await query.edit_message_text("Voting has been closed.")
+    close_event(event)
+    report = await broadcast(context.bot, "close_voting", list(event.roster.confirmed), "Voting has been closed by an admin. Thank you for participating!")
+
+    await query.edit_message_text(f"Voting has been closed. Notified {len(report.delivered)} confirmed players ({len(report.failed)} could not be reached).")
+
+# Function to notify the confirmed players of last-minute changes to an event's details
+async def notify_last_minute_changes(bot, event):
+    return await broadcast(
+        bot,
+        "last_minute_changes",
+        list(event.roster.confirmed),
+        f"Attention: The event details have been updated. Here are the latest details:\n{event.content}"
+    )
 
-# Function to notify participants of last-minute changes
-async def notify_last_minute_changes(context: ContextTypes.DEFAULT_TYPE) -> None:
-    event_content = context.user_data.get('event_content')
-    for user_id, status in attendance.items():
-        if status == "confirmed":
-            await context.bot.send_message(chat_id=user_id, text=f"Attention: The event details have been updated. Here are the latest details:\n{event_content}")
+# Function to set how many players the chat's current event takes, e.g. /capacity 22
+async def set_event_capacity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
 
-# Function to list members to ban
+    event = events.latest(update.effective_chat.id)
+    if event is None:
+        await update.message.reply_text("No event found. Please create an event first.")
+        return
+    if event.closed:
+        await update.message.reply_text("Voting for this game is closed, so its capacity can't change anymore.")
+        return
+    if len(context.args) != 1 or not context.args[0].isdigit() or int(context.args[0]) < 1:
+        await update.message.reply_text("Usage: /capacity <number of players>")
+        return
+
+    promoted = set_capacity(event, int(context.args[0]))
+    if promoted:
+        await broadcast(context.bot, "promoted", [next_user_id for next_user_id, _ in promoted], "A spot opened up for you. You're now confirmed!")
+    await update.message.reply_text(f"The game now takes {event.roster.capacity} players.")
+
+# Function to list members to ban, one cached page of the chat's member directory at a time
 async def list_members_to_ban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    await query.answer()
 
-    # Generate buttons for each member
-    buttons = [
-        [InlineKeyboardButton(f"{name}", callback_data=f"select_ban_{user_id}")]
-        for user_id, name in members
-    ]
+    directory = directory_of(query.message.chat_id)
 
-    # Pagination for large member lists
-    if len(buttons) > 10:
-        buttons = buttons[:10]  # Show only the first 10 for now
-        buttons.append([InlineKeyboardButton("Next", callback_data="next_page_ban_1")])
+    if not directory:
+        await query.edit_message_text("No members seen in this group yet.", reply_markup=ui.back_to_admin)
+        return
 
-    buttons.append([InlineKeyboardButton("🔙 Back", callback_data="admin_actions")])  # Add Back button
+    await query.edit_message_text("Select a member to ban:", reply_markup=directory.ban_keyboard(0))
 
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await query.edit_message_text("Select a member to ban:", reply_markup=reply_markup)
+# Function to set when the chat's current game starts, e.g. /kickoff 2026-10-24 10:00
+async def set_event_kickoff(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+
+    event = events.latest(update.effective_chat.id)
+    if event is None:
+        await update.message.reply_text("No event found. Please create an event first.")
+        return
+    try:
+        kickoff_at = datetime.strptime(" ".join(context.args), "%Y-%m-%d %H:%M")
+    except ValueError:
+        await update.message.reply_text("Usage: /kickoff YYYY-MM-DD HH:MM")
+        return
+    if kickoff_at - close_before_kickoff <= datetime.now():
+        await update.message.reply_text("That kickoff is too soon: voting would already be closed.")
+        return
+
+    set_kickoff(event, kickoff_at)
+    await update.message.reply_text(
+        f"Kickoff is set for {kickoff_at.strftime('%Y-%m-%d %H:%M')}. Voting closes at {event.close_at.strftime('%Y-%m-%d %H:%M')}."
+    )
+
+# Function to search the member directory by name, e.g. /find ali
+async def find_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+    if not context.args:
+        await update.message.reply_text("Usage: /find <start of a name>")
+        return
+
+    matches = directory_of(update.effective_chat.id).search(" ".join(context.args))
+    if not matches:
+        await update.message.reply_text("No members found.")
+        return
+
+    buttons = [
+        [InlineKeyboardButton(name, callback_data=encode_callback("select_ban", user_id=user_id))]
+        for user_id, name in matches
+    ]
+    await update.message.reply_text("Select a member to ban:", reply_markup=InlineKeyboardMarkup(buttons))
 
 # Function to handle member selection for banning
 async def select_member_to_ban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = int(query.data.split("_")[2])
-    user_name = next(name for uid, name in members if uid == user_id)
+    await query.answer()
+
+    user_id = decode_callback(query.data).user_id
+    user_name = directory_of(query.message.chat_id).names.get(user_id, str(user_id))
 
     # Ask for ban duration
-    buttons = [
-        [InlineKeyboardButton("1 Week", callback_data=f"confirm_ban_{user_id}_7")],
-        [InlineKeyboardButton("2 Weeks", callback_data=f"confirm_ban_{user_id}_14")],
-        [InlineKeyboardButton("1 Month", callback_data=f"confirm_ban_{user_id}_30")],
-        [InlineKeyboardButton("📅 Custom Date", callback_data=f"custom_ban_{user_id}")],
-        [InlineKeyboardButton("🔙 Back", callback_data="list_members_to_ban")]  # Back to list members to ban
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    
-    await query.edit_message_text(f"Choose ban duration for {user_name}:", reply_markup=reply_markup)
+    await query.edit_message_text(f"Choose ban duration for {user_name}:", reply_markup=ui.ban_durations(user_id))
 
 # Function to confirm the ban with a specified duration
 async def confirm_ban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id, days = map(int, query.data.split("_")[2:4])
-    user_name = next(name for uid, name in members if uid == user_id)
+    callback = decode_callback(query.data)
+    user_id, days = callback.user_id, callback.days
+    user_name = directory_of(query.message.chat_id).names.get(user_id, str(user_id))
     ban_until = datetime.now() + timedelta(days=days)
-    ban_list[user_id] = (user_name, ban_until)
+    ban_member(ban_scope_of(query.message.chat_id), user_id, user_name, ban_until)
 
     # Return to admin actions after banning
     await query.edit_message_text(f"User {user_name} has been banned until {ban_until.strftime('%Y-%m-%d')}.")
@@ -324,20 +2773,30 @@ async def confirm_ban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 # Function to list members for unbanning
 async def list_members_to_unban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    await query.answer()
 
-    # Generate buttons for each banned member
+    page = decode_callback(query.data).page
+    banned = bans.in_scope(ban_scope_of(query.message.chat_id))
+    start = page * 10
+
+    # Generate buttons for each banned member on this page
     buttons = [
-        [InlineKeyboardButton(f"{name} (Banned until {ban_until.strftime('%Y-%m-%d')})", callback_data=f"select_unban_{user_id}")]
-        for user_id, (name, ban_until) in ban_list.items()
+        [InlineKeyboardButton(f"{name} (Banned until {ban_until.strftime('%Y-%m-%d')})", callback_data=encode_callback("select_unban", user_id=user_id))]
+        for user_id, (name, ban_until) in islice(banned.items(), start, start + 10)
     ]
 
     # Handle empty ban list
     if not buttons:
-        buttons.append([InlineKeyboardButton("🔙 Back", callback_data="admin_actions")])
-        await query.edit_message_text("No banned members to unban.", reply_markup=InlineKeyboardMarkup(buttons))
+        await query.edit_message_text("No banned members to unban.", reply_markup=ui.back_to_admin)
         return
 
-    buttons.append([InlineKeyboardButton("🔙 Back", callback_data="admin_actions")])  # Add Back button
+    # Add Previous and Next buttons for pagination
+    if page > 0:
+        buttons.insert(0, [InlineKeyboardButton("Previous", callback_data=encode_callback("unban_member", page=page - 1))])
+    if start + 10 < len(banned):
+        buttons.append([InlineKeyboardButton("Next", callback_data=encode_callback("unban_member", page=page + 1))])
+
+    buttons.append(ui.back_row)  # Add Back button
 
     reply_markup = InlineKeyboardMarkup(buttons)
     await query.edit_message_text("Select a member to unban:", reply_markup=reply_markup)
@@ -345,22 +2804,19 @@ async def list_members_to_unban(update: Update, context: ContextTypes.DEFAULT_TY
 # Function to handle member selection for unbanning
 async def select_member_to_unban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = int(query.data.split("_")[2])
-    user_name, ban_until = ban_list[user_id]
+    await query.answer()
+
+    user_id = decode_callback(query.data).user_id
+    user_name, ban_until = bans.get(ban_scope_of(query.message.chat_id), user_id)
 
     # Ask for confirmation
-    buttons = [
-        [InlineKeyboardButton("Confirm Unban", callback_data=f"confirm_unban_{user_id}")],
-        [InlineKeyboardButton("🔙 Back", callback_data="list_members_to_unban")]  # Back to list members to unban
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await query.edit_message_text(f"Are you sure you want to unban {user_name}?", reply_markup=reply_markup)
+    await query.edit_message_text(f"Are you sure you want to unban {user_name}?", reply_markup=ui.confirm_unban(user_id))
 
 # Function to confirm the unban
 async def confirm_unban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = int(query.data.split("_")[2])
-    user_name, _ = ban_list.pop(user_id, (None, None))
+    user_id = decode_callback(query.data).user_id
+    user_name, _ = unban_member(ban_scope_of(query.message.chat_id), user_id)
 
     # Return to admin actions after unbanning
     await query.edit_message_text(f"User {user_name} has been unbanned.")
@@ -369,20 +2825,23 @@ async def confirm_unban(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 # Function to list confirmed members for marking as no-shows
 async def list_members_for_no_show(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    await query.answer()
+
+    event = events.latest(query.message.chat_id)
+    confirmed = event.roster.confirmed if event else {}
 
     # Generate buttons for each confirmed member
     buttons = [
-        [InlineKeyboardButton(f"{name}", callback_data=f"select_no_show_{user_id}")]
-        for user_id, name in yes_votes
+        [InlineKeyboardButton(f"{name}", callback_data=encode_callback("select_no_show", user_id=user_id))]
+        for user_id, name in confirmed.items()
     ]
 
     # Handle empty list
     if not buttons:
-        buttons.append([InlineKeyboardButton("🔙 Back", callback_data="admin_actions")])
-        await query.edit_message_text("No confirmed members to mark as no-show.", reply_markup=InlineKeyboardMarkup(buttons))
+        await query.edit_message_text("No confirmed members to mark as no-show.", reply_markup=ui.back_to_admin)
         return
 
-    buttons.append([InlineKeyboardButton("🔙 Back", callback_data="admin_actions")])  # Add Back button
+    buttons.append(ui.back_row)  # Add Back button
 
     reply_markup = InlineKeyboardMarkup(buttons)
     await query.edit_message_text("Select a member to mark as no-show:", reply_markup=reply_markup)
@@ -390,111 +2849,402 @@ async def list_members_for_no_show(update: Update, context: ContextTypes.DEFAULT
 # Function to handle selection for marking as no-show
 async def select_member_as_no_show(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = int(query.data.split("_")[2])
-    user_name = next(name for uid, name in yes_votes if uid == user_id)
+    user_id = decode_callback(query.data).user_id
+    event = events.latest(query.message.chat_id)
+    if event is None or user_id not in event.roster.confirmed:
+        await query.answer("This member is no longer on the confirmed list.")
+        return
+    user_name = event.roster.confirmed[user_id]
 
     # Ask for confirmation
-    buttons = [
-        [InlineKeyboardButton("Confirm No-Show", callback_data=f"confirm_no_show_{user_id}")],
-        [InlineKeyboardButton("🔙 Back", callback_data="list_members_for_no_show")]  # Back to list members for no-show
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await query.edit_message_text(f"Are you sure you want to mark {user_name} as a no-show?", reply_markup=reply_markup)
+    await query.edit_message_text(f"Are you sure you want to mark {user_name} as a no-show?", reply_markup=ui.confirm_no_show(user_id))
 
 # Function to confirm the no-show and ban the member
 async def confirm_no_show(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    user_id = int(query.data.split("_")[2])
-    user_name = next(name for uid, name in yes_votes if uid == user_id)
+    user_id = decode_callback(query.data).user_id
+    event = events.latest(query.message.chat_id)
+    if event is None or user_id not in event.roster.confirmed:
+        await query.answer("This member is no longer on the confirmed list.")
+        return
+    user_name = event.roster.confirmed[user_id]
+
+    # Remove from the confirmed list and, while voting is open, move the first person from the waitlist up
+    promoted = remove_player(event, user_id)
 
-    # Mark as no-show and ban
-    ban_list[user_id] = (user_name, datetime.now() + timedelta(weeks=1))
-    yes_votes.remove((user_id, user_name))  # Remove from the confirmed list
+    # Ban for longer when the member keeps not showing up; the ban is in place before any message goes out
+    weeks, streak, reliability = suggested_ban_weeks(event.chat_id, user_id)
+    ban_member(event.ban_scope, user_id, user_name, datetime.now() + timedelta(weeks=weeks))
 
-    # Move the first person from the waitlist to the main list if needed
-    if len(yes_votes) < 20 and waitlist:
-        next_user_id, next_user_name = waitlist.pop(0)
-        yes_votes.append((next_user_id, next_user_name))
-        attendance[next_user_id] = "confirmed"
-        await context.bot.send_message(chat_id=next_user_id, text="A spot opened up for you due to a no-show. You're now confirmed!")
+    if promoted:
+        await broadcast(context.bot, "promoted", [next_user_id for next_user_id, _ in promoted], "A spot opened up for you due to a no-show. You're now confirmed!")
 
-    await query.edit_message_text(f"User {user_name} has been marked as a no-show and banned for 1 week.")
+    await query.edit_message_text(
+        f"User {user_name} has been marked as a no-show and banned for {weeks} week{'s' if weeks != 1 else ''} "
+        f"(no-shows in a row: {streak}, reliability {reliability:.0%})."
+    )
     await admin_actions(update, context)
 
-# Function to handle pagination for large member lists
+# Function to handle pagination for large member lists; the buttons carry the first or last
+# member shown as a keyset cursor, so pages stay stable while members join and leave
 async def handle_pagination(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    page = int(query.data.split("_")[-1])
-
-    start = page * 10
-    end = start + 10
-
-    # Generate buttons for the current page
-    buttons = [
-        [InlineKeyboardButton(f"{name}", callback_data=f"select_ban_{user_id}")]
-        for user_id, name in members[start:end]
-    ]
-
-    # Add Previous and Next buttons for pagination
-    if page > 0:
-        buttons.insert(0, [InlineKeyboardButton("Previous", callback_data=f"next_page_ban_{page - 1}")])
-    if end < len(members):
-        buttons.append([InlineKeyboardButton("Next", callback_data=f"next_page_ban_{page + 1}")])
+    await query.answer()
 
-    buttons.append([InlineKeyboardButton("🔙 Back", callback_data="admin_actions")])  # Add Back button
+    callback = decode_callback(query.data)
+    directory = directory_of(query.message.chat_id)
 
-    reply_markup = InlineKeyboardMarkup(buttons)
-    await query.edit_message_text("Select a member to ban:", reply_markup=reply_markup)
+    start = directory.page_start(callback.user_id, backwards=callback.action == "prev_page_ban")
+    await query.edit_message_text("Select a member to ban:", reply_markup=directory.ban_keyboard(start))
 
 # Function to exit admin actions
 async def exit_admin_actions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
+    await query.answer()
+
     await query.edit_message_text("Admin actions exited.")
 
-# Function to generate participation report
+# Function to split the confirmed players of the chat's current game into balanced teams
+# (the button's page field carries the number of teams)
+async def make_teams(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    event = events.latest(query.message.chat_id)
+    count = decode_callback(query.data).page or 2
+    if event is None or len(event.roster.confirmed) < count:
+        await query.edit_message_text("There are not enough confirmed players to make teams.", reply_markup=ui.back_to_admin)
+        return
+    await query.edit_message_text(teams_text(event, count), reply_markup=ui.back_to_admin)
+
+# Function to make teams from a command, e.g. /teams or /teams 3
+async def make_teams_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+
+    event = events.latest(update.effective_chat.id)
+    count = int(context.args[0]) if len(context.args) == 1 and context.args[0].isdigit() else 2
+    if count < 2:
+        await update.message.reply_text("Usage: /teams [number of teams]")
+        return
+    if event is None or len(event.roster.confirmed) < count:
+        await update.message.reply_text("There are not enough confirmed players to make teams.")
+        return
+    await update.message.reply_text(teams_text(event, count))
+
+# Function to rate a member for team making, e.g. /rate 7 ali reza
+async def rate_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+    if len(context.args) < 2 or not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= 10:
+        await update.message.reply_text("Usage: /rate <1-10> <name>")
+        return
+
+    name = " ".join(context.args[1:])
+    matches = resolve_member(name, directory_of(update.effective_chat.id).search(context.args[1], limit=50))
+    if len(matches) != 1:
+        found = ", ".join(match_name for _, match_name in matches) if matches else "nobody"
+        await update.message.reply_text(f"'{name}' matches {found}. Please be more specific.")
+        return
+
+    user_id, user_name = matches[0]
+    rate_player(update.effective_chat.id, user_id, int(context.args[0]))
+    await update.message.reply_text(f"{user_name} is rated {context.args[0]}.")
+
+# Function to resolve comma-separated names to confirmed players, returns (user ids, error text)
+def confirmed_players_named(event, text):
+    user_ids = []
+    for name in filter(None, (part.strip() for part in text.split(","))):
+        matches = resolve_member(name, event.roster.confirmed.items())
+        if len(matches) != 1:
+            found = ", ".join(match_name for _, match_name in matches) if matches else "no confirmed player"
+            return None, f"'{name}' matches {found}. Please be more specific."
+        user_ids.append(matches[0][0])
+    return user_ids, None
+
+# Function to choose the captains, who go to different teams, e.g. /captains ali, sara
+async def choose_captains(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+
+    event = events.latest(update.effective_chat.id)
+    if event is None:
+        await update.message.reply_text("No event found. Please create an event first.")
+        return
+    user_ids, error = confirmed_players_named(event, " ".join(context.args))
+    if error:
+        await update.message.reply_text(error)
+        return
+
+    set_captains(event, user_ids)
+    names = ", ".join(event.roster.confirmed[uid] for uid in user_ids)
+    await update.message.reply_text(f"Captains: {names}" if user_ids else "Captains cleared.")
+
+# Function to keep friends on the same team, e.g. /together ali, sara (no names clears all groups)
+async def keep_together(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+
+    event = events.latest(update.effective_chat.id)
+    if event is None:
+        await update.message.reply_text("No event found. Please create an event first.")
+        return
+    user_ids, error = confirmed_players_named(event, " ".join(context.args))
+    if error:
+        await update.message.reply_text(error)
+        return
+
+    if not user_ids:
+        set_together(event, [])
+        await update.message.reply_text("All groups cleared.")
+        return
+    set_together(event, event.together + [user_ids])
+    names = ", ".join(event.roster.confirmed[uid] for uid in user_ids)
+    await update.message.reply_text(f"{names} will play on the same team.")
+
+# Function to show the season's attendance statistics of the chat, e.g. /stats or /stats 90 (days)
+async def season_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+    days = int(context.args[0]) if len(context.args) == 1 and context.args[0].isdigit() else 365
+
+    stats = member_stats(update.effective_chat.id, days)
+    if not len(stats["user_id"]):
+        await update.message.reply_text("No finished games recorded yet.")
+        return
+
+    names = directory_of(update.effective_chat.id).names
+    lines = [f"**Attendance over the last {days} days** (least reliable first):"]
+    for slot in np.argsort(stats["reliability"], kind="stable"):
+        uid = int(stats["user_id"][slot])
+        lead = stats["vote_lead_hours"][slot]
+        lines.append(
+            f"{names.get(uid, uid)}: reliability {stats['reliability'][slot]:.0%}, played {stats['played'][slot]}/{stats['games'][slot]}, "
+            f"late cancels {stats['late_cancel_rate'][slot]:.0%}, no-shows in a row {stats['no_show_streak'][slot]}"
+            + (f", votes {lead:.0f}h ahead" if not np.isnan(lead) else "")
+        )
+    for chunk in split_message("\n".join(lines)):
+        await update.message.reply_text(chunk)
+
+# Function to show one page of the participation report (the button's page field), with buttons
+# to page through it and to download it as a file
 async def generate_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    confirmed_list = "\n".join([f"{uid} - {name}" for uid, name in yes_votes]) if yes_votes else "No confirmed participants."
-    waitlist_list = "\n".join([f"{uid} - {name}" for uid, name in waitlist]) if waitlist else "No waitlisted participants."
-    no_show_list = "\n".join([f"{uid} - {name}" for uid, name in ban_list if ban_list[uid][1] > datetime.now()]) if ban_list else "No no-shows recorded."
-
-    report = (
-        f"**Participation Report**\n\n"
-        f"**Confirmed ({len(yes_votes)}):**\n{confirmed_list}\n\n"
-        f"**Waitlist ({len(waitlist)}):**\n{waitlist_list}\n\n"
-        f"**No-Shows:**\n{no_show_list}\n"
-    )
+    query = update.callback_query
+    await query.answer()
+    chat_id = query.message.chat_id
+    pages = report_pages.get(chat_id, report_signature(chat_id), lambda: report_lines(chat_id))
+    page = min(decode_callback(query.data).page, len(pages) - 1)
+
+    buttons = []
+    if len(pages) > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("◀️ Previous", callback_data=encode_callback("generate_report", page=page - 1)))
+        if page + 1 < len(pages):
+            navigation.append(InlineKeyboardButton("Next ▶️", callback_data=encode_callback("generate_report", page=page + 1)))
+        buttons.append(navigation)
+    buttons.append(ui.export_row)
+    buttons.append(ui.back_row)
+
+    text = pages[page] + (f"\n\nPage {page + 1}/{len(pages)}" if len(pages) > 1 else "")
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons))
+
+# Function to send the participation report as a file (the button's page field picks the format)
+async def export_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    fmt = export_formats[min(decode_callback(query.data).page, len(export_formats) - 1)]
+    await query.answer("Preparing the file...")
+    await send_export(context.bot, query.message.chat_id, "report", fmt)
 
-    await update.callback_query.edit_message_text(report)
+# Function to export the chat's data as a file, e.g. /export, /export history or /export history json
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await is_group_admin_or_owner(update):
+        await update.message.reply_text("You don't have permission to use this command.")
+        return
+    args = [arg.lower() for arg in context.args]
+    kind = next((arg for arg in args if arg in export_kinds), "report")
+    fmt = next((arg for arg in args if arg in export_formats), "csv")
+    if len(args) > 2 or any(arg not in export_kinds + export_formats for arg in args):
+        await update.message.reply_text("Usage: /export [report|history] [csv|json]")
+        return
+    await send_export(context.bot, update.effective_chat.id, kind, fmt)
+
+# Which handler serves each button action
+callback_routes = {
+    "create_event": create_event,
+    "update_event": update_event,
+    "edit_event": edit_event,
+    "approve_event": approve_event,
+    "agree_terms": agree_terms,
+    "show_terms": show_terms,
+    "confirm_attendance": handle_attendance,
+    "cancel_attendance": handle_attendance,
+    "change_vote": handle_attendance,
+    "admin_actions": admin_actions,
+    "close_voting": close_voting,
+    "ban_member": list_members_to_ban,
+    "select_ban": select_member_to_ban,
+    "confirm_ban": confirm_ban,
+    "unban_member": list_members_to_unban,
+    "select_unban": select_member_to_unban,
+    "confirm_unban": confirm_unban,
+    "mark_no_show": list_members_for_no_show,
+    "select_no_show": select_member_as_no_show,
+    "confirm_no_show": confirm_no_show,
+    "next_page_ban": handle_pagination,
+    "prev_page_ban": handle_pagination,
+    "exit_admin_actions": exit_admin_actions,
+    "generate_report": generate_report,
+    "make_teams": make_teams,
+    "export_report": export_report,
+}
+
+# Which handler serves each command
+command_routes = {
+    "start": start,
+    "capacity": set_event_capacity,
+    "find": find_member,
+    "kickoff": set_event_kickoff,
+    "rate": rate_member,
+    "captains": choose_captains,
+    "together": keep_together,
+    "teams": make_teams_command,
+    "stats": season_stats,
+    "export": export_command,
+}
+
+# Button actions only group admins and the bot owner may use
+admin_only_actions = {
+    "admin_actions", "create_event", "update_event", "edit_event", "approve_event", "close_voting", "ban_member",
+    "select_ban", "confirm_ban", "custom_ban", "unban_member", "select_unban", "confirm_unban",
+    "mark_no_show", "select_no_show", "confirm_no_show", "next_page_ban", "exit_admin_actions",
+    "generate_report", "prev_page_ban", "make_teams", "export_report",
+}
+
+# Function to dispatch every button press to its handler with one dictionary lookup
+async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    try:
+        action = decode_callback(query.data).action
+    except ValueError:
+        await query.answer("This button has expired. Please use a newer message.")
+        return
+
+    handler = callback_routes.get(action)
+    if handler is None:
+        await query.answer("This option is not available yet.")
+        return
+    if action in admin_only_actions and not await is_group_admin_or_owner(update):
+        await query.answer("Only admins can use this button.", show_alert=True)
+        return
+    await run_timed(action, handler, update, context)
+
+# Function to run a handler while counting its calls and errors and (sampled) timing it
+async def run_timed(name, handler, update, context):
+    labels = (("handler", name),)
+    metrics.inc("handler_calls_total", labels)
+    timed = metrics.sampled("handler", latency_sample_every)
+    started = time.perf_counter() if timed else 0.0
+    try:
+        await handler(update, context)
+    except Exception:
+        metrics.inc("handler_errors_total", labels)
+        raise
+    finally:
+        if timed:
+            metrics.observe("handler_seconds", time.perf_counter() - started, labels)
+
+# Function to wrap a command or message handler so it is measured like the button handlers
+def timed_handler(name, handler):
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        await run_timed(name, handler, update, context)
+    return wrapper
+
+# Function to expose the state sizes and cache statistics as gauges read at scrape time
+def register_gauges(application):
+    metrics.gauge("update_queue_depth", lambda: application.update_queue.qsize())
+    metrics.gauge("updates_waiting_for_their_chat", lambda: application.update_processor.waiting)
+    metrics.gauge("events", lambda: len(events.events))
+    metrics.gauge("pending_timers", lambda: len(timers))
+    metrics.gauge("roster_players", lambda: {
+        (("section", "confirmed"),): sum(len(event.roster.confirmed) for event in events.events.values()),
+        (("section", "waitlist"),): sum(len(event.roster.waitlist) for event in events.events.values()),
+        (("section", "declined"),): sum(len(event.roster.declined) for event in events.events.values()),
+    })
+    metrics.gauge("active_bans", lambda: len(bans))
+    metrics.gauge("known_members", lambda: sum(len(directory) for directory in directories.values()))
+    metrics.gauge("journal_pending_entries", lambda: len(journal.pending))
+    metrics.gauge("recorded_updates", lambda: recorder.recorded if recorder is not None else 0)
+    metrics.gauge("admin_cache_hit_rate", lambda: admin_cache.stats()["hit_rate"])
+    metrics.gauge("report_page_cache_lookups", lambda: {(("result", "hit"),): report_pages.hits, (("result", "miss"),): report_pages.misses})
+    metrics.gauge("admin_cache_lookups", lambda: {(("result", "hit"),): admin_cache.hits, (("result", "miss"),): admin_cache.misses})
+    metrics.gauge("callback_decode_cache_hit_rate", lambda: (lambda info: info.hits / (info.hits + info.misses) if info.hits + info.misses else 0.0)(decode_callback.cache_info()))
+    metrics.gauge("roster_edits", lambda: {
+        (("result", "sent"),): roster_renderer.edits,
+        (("result", "coalesced"),): roster_renderer.coalesced,
+        (("result", "unchanged"),): roster_renderer.unchanged,
+    })
+
+# Function to run the bot behind the webhook server until SIGINT or SIGTERM, then drain it
+async def run_webhook(application):
+    server = WebhookServer(application, path=urlsplit(webhook_url).path or "/", secret=webhook_secret, max_queue=webhook_queue_size)
+    await application.initialize()
+    await application.post_init(application)
+    await application.bot.set_webhook(url=webhook_url, secret_token=webhook_secret, allowed_updates=Update.ALL_TYPES)
+    await application.start()
+    await server.start(webhook_listen, webhook_port)
+    logger.info(f"Receiving updates on {webhook_listen}:{webhook_port}{server.path}")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    try:
+        await stopping.wait()
+    finally:
+        # Updates Telegram could not deliver meanwhile are kept and retried by Telegram
+        await server.stop()
+        await application.stop()  # Handles every update already queued before returning
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
 
 def main():
     # Create the Application and pass it your bot's token.
-    application = Application.builder().token("7440125060:AAGajH921h9t9T70i75PmDz57h6UMMac6JU").build()
+    application = (
+        Application.builder()
+        .token("7440125060:AAGajH921h9t9T70i75PmDz57h6UMMac6JU")
+        .request(InstrumentedRequest())
+        .concurrent_updates(OrderedUpdateProcessor(max_concurrent_updates))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Register the command handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(create_event, pattern="create_event"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_event_message))
-    application.add_handler(CallbackQueryHandler(edit_event, pattern="edit_event"))
-    application.add_handler(CallbackQueryHandler(approve_event, pattern="approve_event"))
-    application.add_handler(CallbackQueryHandler(agree_terms, pattern="agree_terms"))
-    application.add_handler(CallbackQueryHandler(handle_attendance, pattern="confirm_attendance|cancel_attendance|change_vote"))
-    application.add_handler(CallbackQueryHandler(admin_actions, pattern="admin_actions"))
-    application.add_handler(CallbackQueryHandler(close_voting, pattern="close_voting"))
-    application.add_handler(CallbackQueryHandler(list_members_to_ban, pattern="ban_member"))
-    application.add_handler(CallbackQueryHandler(select_member_to_ban, pattern="select_ban_"))
-    application.add_handler(CallbackQueryHandler(confirm_ban, pattern="confirm_ban_"))
-    application.add_handler(CallbackQueryHandler(list_members_to_unban, pattern="unban_member"))
-    application.add_handler(CallbackQueryHandler(select_member_to_unban, pattern="select_unban_"))
-    application.add_handler(CallbackQueryHandler(confirm_unban, pattern="confirm_unban"))
-    application.add_handler(CallbackQueryHandler(list_members_for_no_show, pattern="mark_no_show"))
-    application.add_handler(CallbackQueryHandler(select_member_as_no_show, pattern="select_no_show_"))
-    application.add_handler(CallbackQueryHandler(confirm_no_show, pattern="confirm_no_show"))
-    application.add_handler(CallbackQueryHandler(handle_pagination, pattern="next_page_ban_"))
-    application.add_handler(CallbackQueryHandler(exit_admin_actions, pattern="exit_admin_actions"))
-    application.add_handler(CallbackQueryHandler(generate_report, pattern="generate_report"))
+    if trace_directory is not None:
+        application.add_handler(TypeHandler(Update, record_update), group=-3)  # Sees duplicates too, as they arrived
+    application.add_handler(TypeHandler(Update, drop_duplicate_updates), group=-2)
+    application.add_handler(TypeHandler(Update, track_members_seen), group=-1)
+    application.add_handler(ChatMemberHandler(track_chat_members, ChatMemberHandler.CHAT_MEMBER))
+    for command, handler in command_routes.items():
+        application.add_handler(CommandHandler(command, timed_handler(command, handler)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed_handler("event_message", handle_event_message)))
+
+    # Register the button handlers behind the single callback router
+    application.add_handler(CallbackQueryHandler(route_callback))
 
     # Start the Bot
-    application.run_polling()
+    if webhook_url is None:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)  # chat_member updates keep the admin cache current
+    else:
+        asyncio.run(run_webhook(application))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,80 @@
+# Broadcast delivery: members who never started the bot are given up on at once, broadcasts
+# share one Broadcaster, and a promotion message that can't be delivered doesn't break the vote.
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeContext, FakeUser
+from socialsoccerbot import Broadcaster, TokenBucket, encode_callback
+
+CHAT_ID = -1001234567890
+
+
+def test_unknown_chats_fail_without_retries():
+    bot = FakeBot(unknown=[2, 3])
+    report = asyncio.run(Broadcaster(bot, TokenBucket(rate=1000)).run("test", [1, 2, 3], "Hello"))
+    assert report.delivered == [1]
+    assert set(report.failed) == {2, 3}
+    assert report.retries == 0
+    assert bot.calls["sendMessage"] == 3
+
+
+def test_broadcasts_share_one_broadcaster():
+    bot = FakeBot()
+
+    async def run():
+        await bot_module.broadcast(bot, "first", [1], "Hello")
+        first = bot_module.broadcaster
+        await bot_module.broadcast(bot, "second", [2], "Hello")
+        return first, bot_module.broadcaster
+
+    first, second = asyncio.run(run())
+    assert first is second
+
+
+def test_undeliverable_promotion_still_updates_roster(tmp_path):
+    bot_module.journal = bot_module.Journal(str(tmp_path / "journal.db"))
+    bot_module.roster_renderer = bot_module.RosterRenderer(window=0.01)
+    bot = FakeBot(unknown=[2])  # The player moved up from the waitlist never started the bot
+    chat = FakeChat(bot, CHAT_ID)
+
+    async def run():
+        event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00", capacity=1)
+        bot_module.cast_vote(event, 1, "Ali", True)
+        bot_module.cast_vote(event, 2, "Sara", True)
+        press = bot.press(FakeUser(1, "Ali"), chat, 500, encode_callback("cancel_attendance", event_id=event.event_id))
+        await bot_module.handle_attendance(press, FakeContext(bot))
+        await bot_module.roster_renderer.drain(bot)
+        await bot_module.journal.flush()
+        return event
+
+    event = asyncio.run(run())
+    bot_module.journal.close()
+    assert list(event.roster.confirmed) == [2]
+    assert [message_id for _, message_id, _ in bot.edits] == [500]
+
+
+def test_closing_twice_notifies_once(tmp_path):
+    bot_module.journal = bot_module.Journal(str(tmp_path / "journal.db"))
+    bot_module.roster_renderer = bot_module.RosterRenderer(window=0.01)
+    bot = FakeBot()
+    chat = FakeChat(bot, CHAT_ID)
+
+    async def run():
+        event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00", capacity=2)
+        bot_module.cast_vote(event, 1, "Ali", True)
+        bot_module.cast_vote(event, 2, "Sara", True)
+        for _ in range(2):
+            press = bot.press(FakeUser(99, "Admin"), chat, 600, encode_callback("close_voting"))
+            await bot_module.close_voting(press, FakeContext(bot))
+        await bot_module.journal.flush()
+
+    asyncio.run(run())
+    closes = bot_module.journal.db.execute("SELECT COUNT(*) FROM journal WHERE op = 'close'").fetchone()[0]
+    bot_module.journal.close()
+    assert sorted(chat_id for chat_id, _ in bot.sent) == [1, 2]
+    assert closes == 1
+    assert bot.edits[-1][2] == "Voting is already closed."
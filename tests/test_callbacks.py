@@ -0,0 +1,51 @@
+# Every button press is answered exactly once, so the client stops its loading spinner right away.
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeContext, FakeUser
+from socialsoccerbot import encode_callback
+
+CHAT_ID = -1001234567890
+ADMIN_ID = 99
+
+presses = [
+    ("ban_member", {}),
+    ("select_ban", {"user_id": 1}),
+    ("next_page_ban", {"user_id": 1}),
+    ("unban_member", {}),
+    ("select_unban", {"user_id": 3}),
+    ("mark_no_show", {}),
+    ("exit_admin_actions", {}),
+    ("change_vote", {}),
+]
+
+
+@pytest.mark.parametrize("action, fields", presses)
+def test_press_is_answered_once(tmp_path, action, fields):
+    bot_module.journal = bot_module.Journal(str(tmp_path / "journal.db"))
+    bot_module.roster_renderer = bot_module.RosterRenderer(window=0.01)
+    bot = FakeBot(admin_ids=[ADMIN_ID])
+    chat = FakeChat(bot, CHAT_ID)
+
+    async def run():
+        event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00", capacity=10)
+        for user_id, name in ((1, "Ali"), (2, "Sara")):
+            bot_module.observe_member(CHAT_ID, user_id, name)
+            bot_module.cast_vote(event, user_id, name, True)
+        bot_module.ban_member(CHAT_ID, 3, "Reza", datetime.now() + timedelta(weeks=1))
+        if action == "change_vote":
+            fields["event_id"] = event.event_id
+        press = bot.press(FakeUser(ADMIN_ID, "Admin"), chat, 700, encode_callback(action, **fields))
+        await bot_module.route_callback(press, FakeContext(bot))
+        await bot_module.journal.flush()
+
+    asyncio.run(run())
+    bot_module.journal.close()
+    assert bot.calls["answerCallbackQuery"] == 1
@@ -0,0 +1,117 @@
+# Recovery tests for the vote journal: votes recorded while a compaction runs must survive a
+# restart, and a process killed in the middle of a vote burst must come back with every vote it
+# committed, none duplicated and none out of order.
+import asyncio
+import importlib
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from socialsoccerbot import Roster
+
+CHAT_ID = -1001234567890
+CAPACITY = 20
+
+
+# Function to start a fresh bot state on the journal at `path`, as a restart would
+def restart(path):
+    importlib.reload(bot_module)
+    bot_module.journal = bot_module.Journal(path)
+    bot_module.restore_state()
+    return bot_module.events.latest(CHAT_ID)
+
+
+# Function to describe a roster by its sections, in order
+def sections(roster):
+    return list(roster.confirmed), list(roster.waitlist), list(roster.declined)
+
+
+# The votes of the burst: everyone says Yes, and every fifth voter changes their mind
+def burst(count):
+    for i in range(count):
+        yield 1000 + i, True
+        if i % 5 == 4:
+            yield 1000 + i - 2, False
+
+
+def test_votes_during_compaction_survive_restart(tmp_path):
+    path = str(tmp_path / "journal.db")
+
+    async def run():
+        restart(path)
+        event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00", capacity=CAPACITY)
+        for i in range(50):
+            bot_module.cast_vote(event, 1000 + i, f"Player {i}", True)
+        # Hold the snapshot write back a little, so the votes below are committed before it
+        compact = bot_module.journal._compact
+        bot_module.journal._compact = lambda *args: (time.sleep(0.05), compact(*args))
+        compaction = asyncio.create_task(bot_module.journal.compact(bot_module.snapshot_state))
+        voters = 50
+        while not compaction.done():
+            bot_module.cast_vote(event, 1000 + voters, f"Player {voters}", True)
+            voters += 1
+            await asyncio.sleep(0)
+        assert voters > 50, "some votes should have arrived while the compaction ran"
+        await bot_module.journal.flush()
+        bot_module.journal.close()
+        return sections(event.roster), voters
+
+    before, voters = asyncio.run(run())
+    event = restart(path)
+    assert sections(event.roster) == before
+    assert len(event.roster.confirmed) + len(event.roster.waitlist) == voters
+    bot_module.journal.close()
+
+
+def test_recovers_after_kill_mid_burst(tmp_path):
+    path = str(tmp_path / "journal.db")
+    # The child votes in a burst, compacting now and then, and reports every vote it committed
+    child = textwrap.dedent(f"""
+        import asyncio, sys
+        sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+        sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+        import socialsoccerbot as bot_module
+        from test_journal import CAPACITY, CHAT_ID, burst
+
+        async def run():
+            bot_module.journal = bot_module.Journal({path!r})
+            event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00", capacity=CAPACITY)
+            for n, (user_id, going) in enumerate(burst(100000), 1):
+                bot_module.cast_vote(event, user_id, f"Player {{user_id}}", going)
+                if n % 500 == 0:
+                    asyncio.create_task(bot_module.journal.compact(bot_module.snapshot_state))
+                if n % 50 == 0:
+                    await bot_module.journal.flush()
+                    print(n, flush=True)
+                await asyncio.sleep(0)
+
+        asyncio.run(run())
+    """)
+    process = subprocess.Popen([sys.executable, "-c", child], stdout=subprocess.PIPE, text=True)
+    committed = 0
+    for line in process.stdout:
+        committed = int(line)
+        if committed >= 3000:
+            break
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    assert committed >= 3000
+
+    event = restart(path)
+    restored, players = sections(event.roster), len(event.roster.attendance)
+    bot_module.journal.close()
+    # The restored roster must be exactly the roster after some prefix of the burst that holds
+    # every committed vote
+    roster = Roster(CAPACITY)
+    for n, (user_id, going) in enumerate(burst(100000), 1):
+        roster.vote(user_id, f"Player {user_id}", going)
+        if n >= committed and len(roster.attendance) == players and sections(roster) == restored:
+            break
+    else:
+        raise AssertionError("restored roster matches no prefix of the burst that holds the committed votes")
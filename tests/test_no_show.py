@@ -0,0 +1,61 @@
+# No-shows: the ban is in place before anyone is messaged, and a member's first no-show is a
+# one-week ban however unreliable a single game makes them look.
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeChat, FakeContext, FakeUser
+from socialsoccerbot import encode_callback
+
+CHAT_ID = -1001234567890
+ADMIN_ID = 99
+
+
+# Fake bot that notes, for every message it sends, whether the no-show was banned already
+class WatchingBot(FakeBot):
+    def __init__(self, no_show, **kwargs):
+        super().__init__(**kwargs)
+        self.no_show = no_show
+        self.banned_when_sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.banned_when_sent.append(self.no_show in bot_module.bans.in_scope(CHAT_ID))
+        return await super().send_message(chat_id, text, **kwargs)
+
+
+# Function to mark user 1 as a no-show in a full game with user 2 waiting, returns the ban given
+def mark_no_show(tmp_path, bot):
+    bot_module.journal = bot_module.Journal(str(tmp_path / "journal.db"))
+    bot_module.history = bot_module.AttendanceHistory(str(tmp_path / "history"))
+    bot_module.roster_renderer = bot_module.RosterRenderer(window=0.01)
+    chat = FakeChat(bot, CHAT_ID)
+
+    async def run():
+        event = bot_module.create_chat_event(CHAT_ID, "Saturday 10:00", capacity=1)
+        bot_module.cast_vote(event, 1, "Ali", True)
+        bot_module.cast_vote(event, 2, "Sara", True)
+        press = bot.press(FakeUser(ADMIN_ID, "Admin"), chat, 500, encode_callback("confirm_no_show", user_id=1))
+        await bot_module.confirm_no_show(press, FakeContext(bot))
+        await bot_module.journal.flush()
+        return event
+
+    event = asyncio.run(run())
+    bot_module.journal.close()
+    return event, bot_module.suggested_ban_weeks(CHAT_ID, 1)
+
+
+def test_ban_applies_before_promotion_message(tmp_path):
+    bot = WatchingBot(1, admin_ids=[ADMIN_ID])
+    event, _ = mark_no_show(tmp_path, bot)
+    assert list(event.roster.confirmed) == [2]
+    assert bot.sent and bot.sent[0][0] == 2
+    assert all(bot.banned_when_sent)
+
+
+def test_first_no_show_is_banned_for_one_week(tmp_path):
+    _, (weeks, streak, reliability) = mark_no_show(tmp_path, WatchingBot(1, admin_ids=[ADMIN_ID]))
+    assert reliability < 0.5  # One game, and it was a no-show
+    assert (weeks, streak) == (1, 1)
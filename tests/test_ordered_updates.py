@@ -0,0 +1,68 @@
+# First come, first served within every chat: with OrderedUpdateProcessor, the handlers of a
+# chat's updates start in arrival order however long each one waits first, and every roster ends
+# up as a sequential replay of the same votes would leave it. Votes for several chats arrive
+# interleaved, and the fake Bot API answers after a random time.
+import asyncio
+import os
+import random
+import sys
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+from benchmarks.fake_bot import FakeBot, FakeContext
+from benchmarks.ordered_updates_bench import build_votes
+from socialsoccerbot import OrderedUpdateProcessor, Roster
+
+LATENCY = 0.005
+ARGS = SimpleNamespace(chats=4, users=12, votes=20, capacity=5)
+
+
+# Function to replay the votes one by one on plain rosters: the order the bot must reproduce
+def expected_rosters(votes):
+    rosters = {}
+    for chat_id, event, user, going, _ in votes:
+        roster = rosters.setdefault(chat_id, Roster(event.roster.capacity))
+        roster.vote(user.id, user.full_name, going)
+    return {chat_id: (list(roster.confirmed), list(roster.waitlist)) for chat_id, roster in rosters.items()}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_chats_keep_arrival_order(tmp_path, seed):
+    bot_module.journal = bot_module.Journal(str(tmp_path / "journal.db"))
+    bot_module.roster_renderer = bot_module.RosterRenderer(window=0.01)
+    rng = random.Random(seed)
+    bot = FakeBot(latency=LATENCY, jitter=LATENCY * 2, seed=seed)
+    votes = build_votes(bot, ARGS, rng)
+    contexts = defaultdict(lambda: FakeContext(bot))
+    started = defaultdict(list)  # chat_id -> update ids in the order their handlers started
+
+    async def handle(update, delay):
+        await asyncio.sleep(delay)
+        started[update.effective_chat.id].append(update.update_id)
+        context = contexts[update.effective_user.id]
+        await bot_module.track_members_seen(update, context)
+        await bot_module.route_callback(update, context)
+
+    async def run():
+        processor = OrderedUpdateProcessor(16)
+        await asyncio.gather(*[
+            processor.process_update(update, handle(update, rng.random() * LATENCY)) for *_, update in votes
+        ])
+        await bot_module.roster_renderer.drain(bot)
+        await bot_module.journal.flush()
+
+    asyncio.run(run())
+    bot_module.journal.close()
+
+    arrival = defaultdict(list)
+    for chat_id, *_, update in votes:
+        arrival[chat_id].append(update.update_id)
+    assert dict(started) == dict(arrival)
+    expected = expected_rosters(votes)
+    for chat_id, event, *_ in votes:
+        assert (list(event.roster.confirmed), list(event.roster.waitlist)) == expected[chat_id]
@@ -0,0 +1,59 @@
+# Anonymization of recorded traces: no member name typed into a command may reach the trace, and
+# names that match one member become that member's pseudonym so replays still resolve them.
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialsoccerbot as bot_module
+
+CHAT_ID = -1001234567890
+
+
+def test_command_arguments_are_anonymized(tmp_path):
+    bot_module.journal = bot_module.Journal(str(tmp_path / "journal.db"))
+    for user_id, name in ((11, "Ali Rezaei"), (12, "Sara Karimi"), (13, "Ali Moradi")):
+        bot_module.observe_member(CHAT_ID, user_id, name)
+    recorder = bot_module.UpdateRecorder(str(tmp_path / "trace.jsonl.gz"))
+    commands = ["/rate 7 Ali Rezaei", "/captains Sara Karimi, Ali Rezaei", "/together ali r, sara", "/find ali", "/export history json"]
+    for update_id, text in enumerate(commands, 1):
+        recorder.record({"update_id": update_id, "message": {"text": text, "chat": {"id": CHAT_ID}, "from": {"id": 12, "first_name": "Sara"}}})
+    recorder.close()
+    bot_module.journal.close()
+
+    with gzip.open(tmp_path / "trace.jsonl.gz", "rt", encoding="utf-8") as f:
+        trace = f.read()
+    for name in ("Ali", "Rezaei", "Sara", "Karimi", "ali", "sara"):
+        assert name not in trace
+    ali, sara = (f"Member {recorder.pseudonym(user_id) % 100000}" for user_id in (11, 12))
+    assert f'"/rate 7 {ali}"' in trace
+    assert f'"/captains {sara}, {ali}"' in trace
+    assert '"/find xxx"' in trace  # Two members are called Ali
+    assert '"/export history json"' in trace
+
+
+def test_every_user_field_is_anonymized(tmp_path):
+    recorder = bot_module.UpdateRecorder(str(tmp_path / "trace.jsonl.gz"))
+    ali, sara = {"id": 11, "first_name": "Ali", "is_bot": False}, {"id": 12, "first_name": "Sara", "is_bot": False}
+    chat = {"id": CHAT_ID, "type": "supergroup", "title": "Futsal"}
+    messages = [
+        {"chat": chat, "from": ali, "new_chat_members": [ali, sara]},
+        {"chat": chat, "from": sara, "left_chat_member": sara},
+        {"chat": chat, "from": ali, "contact": {"first_name": "Sara", "phone_number": "+98912", "user_id": 12}},
+        {"chat": chat, "from": ali, "contact": {"first_name": "Reza", "phone_number": "+98935"}},
+        {"chat": chat, "from": ali, "forward_from": sara, "text": "see you"},
+        {"chat": chat, "from": ali, "via_bot": {"id": 777, "first_name": "Gifs", "is_bot": True}, "caption": "goal"},
+    ]
+    for update_id, message in enumerate(messages, 1):
+        recorder.record({"update_id": update_id, "message": dict(message, message_id=update_id)})
+    recorder.close()
+
+    with gzip.open(tmp_path / "trace.jsonl.gz", "rt", encoding="utf-8") as f:
+        trace = f.read()
+    for name in ("Ali", "Sara", "Reza", "Gifs", "98912", "98935"):
+        assert name not in trace
+    for real_id in (11, 12, 777):
+        assert f":{real_id}," not in trace and f":{real_id}}}" not in trace
+    assert f'"user_id":{recorder.pseudonym(12)}' in trace
+    assert trace.count(f"Member {recorder.pseudonym(12) % 100000}") >= 5
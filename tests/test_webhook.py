@@ -0,0 +1,48 @@
+# Connection handling of the webhook server: a request whose body was not read (or not read in
+# full) must close the connection, so leftover bytes are never parsed as the next request.
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from socialsoccerbot import WebhookServer
+
+PATH = "/webhook"
+
+
+# Function to send raw bytes on one connection and read everything the server answers until it closes it
+async def exchange(payload):
+    application = SimpleNamespace(update_queue=asyncio.Queue(), bot=None)
+    server = WebhookServer(application, path=PATH)
+    await server.start("127.0.0.1", 0)
+    port = server.server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(payload)
+    await writer.drain()
+    response = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+    try:
+        response += await asyncio.wait_for(reader.read(), timeout=5)
+    except ConnectionResetError:
+        pass  # Closed with our unread bytes still queued: the end of the connection all the same
+    writer.close()
+    await server.stop()
+    return response.decode("latin-1")
+
+
+def test_oversized_body_closes_connection():
+    # The body starts with what would look like a second request if the server read on
+    request = f"POST {PATH} HTTP/1.1\r\nHost: bot\r\nContent-Length: {WebhookServer.max_body + 1}\r\n\r\n".encode()
+    response = asyncio.run(exchange(request + b"GET /x HTTP/1.1\r\nHost: bot\r\n\r\n"))
+    assert response.startswith("HTTP/1.1 413 ")
+    assert response.count("HTTP/1.1 ") == 1
+    assert "Connection: close" in response
+
+
+def test_bad_request_closes_connection():
+    body = b"not json"
+    request = f"POST {PATH} HTTP/1.1\r\nHost: bot\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    response = asyncio.run(exchange(request + b"GET /x HTTP/1.1\r\nHost: bot\r\n\r\n"))
+    assert response.startswith("HTTP/1.1 400 ")
+    assert response.count("HTTP/1.1 ") == 1